@@ -0,0 +1,140 @@
+import argparse
+import math
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import closing
+from pathlib import Path
+
+BENCHMARK_DIR = Path(__file__).parent
+SRC_DIR = BENCHMARK_DIR.parent / "src"
+sys.path.insert(0, str(SRC_DIR))
+sys.path.insert(0, str(SRC_DIR / "database" / "data-generator"))
+
+from columnar_store import ColumnarStore, UnsupportedQueryError
+from generate_sql import generate_database, years_growth
+
+DATABASE = SRC_DIR / "database" / "contoso-sales.db"
+DEFAULT_SIZES = "40000,1000000,10000000"
+WORK_DIR = Path(tempfile.gettempdir()) / "contoso-sales-benchmark"
+SEED = 42
+
+# The shapes of query the assistant writes most, from a whole-table total to a filtered, sorted top-N
+QUERIES = [
+    ("total", "SELECT SUM(revenue), COUNT(*) FROM sales_data"),
+    ("by region", "SELECT region, SUM(revenue) AS revenue FROM sales_data GROUP BY region"),
+    (
+        "filtered by year",
+        "SELECT main_category, SUM(revenue), AVG(discount) FROM sales_data WHERE year = 2023 GROUP BY main_category",
+    ),
+    (
+        "monthly trend",
+        "SELECT month_date, SUM(number_of_orders), SUM(shipping_cost) FROM sales_data "
+        "WHERE region = 'EUROPE' GROUP BY month_date ORDER BY month_date",
+    ),
+    (
+        "top products",
+        "SELECT product_type, SUM(revenue) AS total FROM sales_data WHERE main_category = 'WINTER SPORTS' "
+        "AND year IN (2022, 2023) GROUP BY product_type ORDER BY total DESC LIMIT 10",
+    ),
+    (
+        "finest grain",
+        "SELECT region, main_category, year, month, COUNT(*), MAX(revenue) FROM sales_data "
+        "GROUP BY region, main_category, year, month",
+    ),
+    (
+        "measure filter",
+        "SELECT region, COUNT(DISTINCT product_type), AVG(revenue) FROM sales_data "
+        "WHERE discount > 0.1 AND revenue BETWEEN 500 AND 5000 GROUP BY region HAVING COUNT(*) > 10",
+    ),
+]
+
+
+def build_database(rows: int) -> Path:
+    """Return a sales database with `rows` rows, generating it on first use."""
+    if rows <= 0:
+        raise ValueError("The number of rows must be positive.")
+    with closing(sqlite3.connect(f"{DATABASE.resolve().as_uri()}?mode=ro", uri=True)) as conn:
+        (source_rows,) = conn.execute("SELECT COUNT(*) FROM sales_data;").fetchone()
+    if rows == source_rows:
+        return DATABASE
+
+    path = WORK_DIR / f"contoso-sales-{rows}-seed-{SEED}.db"
+    if not path.exists():
+        WORK_DIR.mkdir(parents=True, exist_ok=True)
+        print(f"Generating a {rows:,} row database at {path}...")
+        generate_database(path, rows, years_growth, SEED)
+    return path
+
+
+def time_ms(function: callable, repeat: int) -> tuple[float, object]:
+    """Return the median time of `repeat` calls in milliseconds, and the last call's result."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def same_results(expected: tuple[list, list], actual: tuple[list, list]) -> bool:
+    """Compare results by column names and rows, allowing rounding differences in float sums."""
+    (expected_names, expected_rows), (actual_names, actual_rows) = expected, actual
+    if expected_names != actual_names or len(expected_rows) != len(actual_rows):
+        return False
+    for expected_row, actual_row in zip(expected_rows, actual_rows):
+        for expected_value, actual_value in zip(expected_row, actual_row):
+            if isinstance(expected_value, float) and isinstance(actual_value, float):
+                if not math.isclose(expected_value, actual_value, rel_tol=1e-12):
+                    return False
+            elif expected_value != actual_value or type(expected_value) is not type(actual_value):
+                return False
+    return True
+
+
+def benchmark(rows: int, repeat: int) -> None:
+    path = build_database(rows)
+
+    start = time.perf_counter()
+    store = ColumnarStore()
+    store.load(str(path))
+    load_seconds = time.perf_counter() - start
+
+    print(f"\n{rows:,} rows: columns loaded in {load_seconds:.2f}s, {store.nbytes / 1024 / 1024:.1f} MB")
+    print(f"{'query':<18} {'sqlite ms':>10} {'columnar ms':>12} {'speedup':>8}  result")
+
+    with closing(sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True)) as conn:
+
+        def run_sqlite(query: str) -> tuple[list, list]:
+            cursor = conn.execute(query)
+            return [description[0] for description in cursor.description], cursor.fetchall()
+
+        for label, query in QUERIES:
+            sqlite_ms, expected = time_ms(lambda query=query: run_sqlite(query), repeat)
+            try:
+                columnar_ms, actual = time_ms(lambda query=query: store.execute(query), repeat)
+            except UnsupportedQueryError as e:
+                print(f"{label:<18} {sqlite_ms:>10.2f} {'-':>12} {'-':>8}  unsupported: {e}")
+                continue
+            if actual is None:
+                print(f"{label:<18} {sqlite_ms:>10.2f} {'-':>12} {'-':>8}  not an aggregate query")
+                continue
+            status = "same" if same_results(expected, actual) else "DIFFERENT"
+            print(f"{label:<18} {sqlite_ms:>10.2f} {columnar_ms:>12.2f} {sqlite_ms / columnar_ms:>7.1f}x  {status}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare aggregate queries on SQLite and on the columnar store.")
+    parser.add_argument("--rows", default=DEFAULT_SIZES, help="Comma separated table sizes to benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per query; the median is reported")
+    args = parser.parse_args()
+
+    for rows in (int(size) for size in args.rows.split(",")):
+        benchmark(rows, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import suppress
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+import psutil
+import socketio
+from pydantic import BaseModel
+
+from mock_assistants import MOCK_ASSISTANT_ID, RECORDINGS_DIR, load_recordings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BENCHMARK_DIR = Path(__file__).parent
+SRC_DIR = BENCHMARK_DIR.parent / "src"
+BENCHMARK_USER = "sales@contoso.com"
+BENCHMARK_PASSWORD = "benchmark"
+STARTUP_TIMEOUT_SECONDS = 60
+TURN_TIMEOUT_SECONDS = 120
+SAMPLE_INTERVAL_SECONDS = 0.5
+# Compared against a baseline; a regression is a value above the baseline by more than --max-regression
+COMPARED_METRICS = ["turn_ms.p95", "first_token_ms.p95", "tool_call_ms.p95", "cpu_percent.mean", "rss_mb.max"]
+
+
+class TurnResult(BaseModel):
+    user: int
+    recording: str
+    turn_ms: float
+    first_token_ms: float | None = None
+    error: str | None = None
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list[float], percent: float) -> float | None:
+    """Return the nearest-rank percentile, or None without values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def distribution(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values, default=None),
+        "mean": round(sum(values) / len(values), 1) if values else None,
+    }
+
+
+class ProcessMonitor:
+    """Samples the CPU and resident memory of the app process while the benchmark runs."""
+
+    def __init__(self: "ProcessMonitor", pid: int) -> None:
+        self.process = psutil.Process(pid)
+        self.cpu_percent: list[float] = []
+        self.rss_mb: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    async def _sample(self: "ProcessMonitor") -> None:
+        # The first reading only starts the measurement interval
+        self.process.cpu_percent(None)
+        while True:
+            await asyncio.sleep(SAMPLE_INTERVAL_SECONDS)
+            with suppress(psutil.Error):
+                self.cpu_percent.append(self.process.cpu_percent(None))
+                self.rss_mb.append(round(self.process.memory_info().rss / 1024 / 1024, 1))
+
+    def start(self: "ProcessMonitor") -> None:
+        self._task = asyncio.create_task(self._sample())
+
+    async def stop(self: "ProcessMonitor") -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+
+
+class SimulatedUser:
+    """A signed-in chat session that sends prompts over the Chainlit socket and times the replies.
+
+    A turn lasts from sending the message until Chainlit reports the task has ended. The first token is
+    the first streamed text of an assistant message.
+    """
+
+    def __init__(
+        self: "SimulatedUser", index: int, app_url: str, prompts: list[tuple[str, str]], turns: int, think_time: float
+    ) -> None:
+        self.index = index
+        self.app_url = app_url
+        self.prompts = prompts
+        self.turns = turns
+        self.think_time = think_time
+        self.results: list[TurnResult] = []
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.sio.on("task_start", self.on_task_start)
+        self.sio.on("task_end", self.on_task_end)
+        self.sio.on("stream_start", self.on_stream_start)
+        self.sio.on("new_message", self.on_new_message)
+        self._connected = asyncio.Event()
+        self._task_started = False
+        self._task_ended = asyncio.Event()
+        self._sent_at = 0.0
+        self._first_token_at: float | None = None
+        self._error: str | None = None
+
+    async def on_task_start(self: "SimulatedUser", _data: dict) -> None:
+        self._task_started = True
+
+    async def on_task_end(self: "SimulatedUser", _data: dict) -> None:
+        # Chainlit also ends a task when the session connects
+        if not self._connected.is_set():
+            self._connected.set()
+        elif self._task_started:
+            self._task_ended.set()
+
+    async def on_stream_start(self: "SimulatedUser", step: dict) -> None:
+        if self._first_token_at is None and step.get("type") == "assistant_message" and step.get("output"):
+            self._first_token_at = time.perf_counter()
+
+    async def on_new_message(self: "SimulatedUser", step: dict) -> None:
+        output = step.get("output") or ""
+        if output.startswith(("An error occurred", "The assistant is at capacity")):
+            self._error = output
+
+    async def login(self: "SimulatedUser") -> str:
+        async with httpx.AsyncClient(base_url=self.app_url) as http:
+            response = await http.post(
+                "/sales/login", data={"username": BENCHMARK_USER, "password": BENCHMARK_PASSWORD}
+            )
+            response.raise_for_status()
+            return response.json()["access_token"]
+
+    async def send(self: "SimulatedUser", recording: str, prompt: str) -> TurnResult:
+        self._task_started = False
+        self._task_ended.clear()
+        self._first_token_at = None
+        self._error = None
+        message = {
+            "id": str(uuid.uuid4()),
+            "threadId": "",
+            "name": "User",
+            "type": "user_message",
+            "output": prompt,
+            "createdAt": datetime.now(timezone.utc).isoformat(),
+        }
+
+        self._sent_at = time.perf_counter()
+        await self.sio.emit("client_message", {"message": message, "fileReferences": None})
+        try:
+            await asyncio.wait_for(self._task_ended.wait(), timeout=TURN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            self._error = f"No reply within {TURN_TIMEOUT_SECONDS} seconds."
+        finished = time.perf_counter()
+
+        return TurnResult(
+            user=self.index,
+            recording=recording,
+            turn_ms=round((finished - self._sent_at) * 1000, 1),
+            first_token_ms=round((self._first_token_at - self._sent_at) * 1000, 1) if self._first_token_at else None,
+            error=self._error,
+        )
+
+    async def run(self: "SimulatedUser") -> list[TurnResult]:
+        token = await self.login()
+        # Alternate locales, so the per-session instructions vary as they do in production
+        language = "nl-NL,nl;q=0.9,en;q=0.8" if self.index % 2 else "en-US,en;q=0.9"
+        await self.sio.connect(
+            self.app_url,
+            headers={
+                "Authorization": f"Bearer {token}",
+                "X-Chainlit-Session-Id": str(uuid.uuid4()),
+                "X-Chainlit-Client-Type": "webapp",
+                "Accept-Language": language,
+            },
+            transports=["websocket"],
+            socketio_path="/sales/ws/socket.io",
+        )
+        try:
+            await self.sio.emit("connection_successful")
+            await asyncio.wait_for(self._connected.wait(), timeout=STARTUP_TIMEOUT_SECONDS)
+            for turn in range(self.turns):
+                recording, prompt = self.prompts[(self.index + turn) % len(self.prompts)]
+                self.results.append(await self.send(recording, prompt))
+                await asyncio.sleep(self.think_time)
+        finally:
+            await self.sio.disconnect()
+        return self.results
+
+
+async def wait_until_ready(url: str, process: subprocess.Popen, log_path: Path) -> None:
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    async with httpx.AsyncClient() as http:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode}, see {log_path}")
+            with suppress(httpx.HTTPError):
+                if (await http.get(url)).status_code == 200:
+                    return
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"{url} was not ready after {STARTUP_TIMEOUT_SECONDS} seconds, see {log_path}")
+
+
+def start_process(command: list[str], log_path: Path, cwd: Path, env: dict) -> subprocess.Popen:
+    with log_path.open("wb") as log:
+        return subprocess.Popen(command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def summarize(results: list[TurnResult], mock_stats: dict, monitor: ProcessMonitor, elapsed: float) -> dict:
+    completed = [result for result in results if result.error is None]
+    return {
+        "turns": len(results),
+        "errors": len(results) - len(completed),
+        "elapsed_seconds": round(elapsed, 2),
+        "turns_per_second": round(len(completed) / elapsed, 2) if elapsed else None,
+        "turn_ms": distribution([result.turn_ms for result in completed]),
+        "first_token_ms": distribution([result.first_token_ms for result in completed if result.first_token_ms]),
+        "tool_call_ms": distribution(mock_stats.get("tool_call_ms", [])),
+        "cpu_percent": distribution(monitor.cpu_percent),
+        "rss_mb": distribution(monitor.rss_mb),
+        "api_requests": mock_stats.get("requests"),
+        "error_samples": sorted({result.error for result in results if result.error})[:5],
+    }
+
+
+def print_report(summary: dict, args: argparse.Namespace) -> None:
+    print()
+    print(
+        f"{args.users} users x {args.turns} turns, time scale {args.time_scale:g}: {summary['turns']} turns, "
+        f"{summary['errors']} errors, {summary['turns_per_second']} turns/s over {summary['elapsed_seconds']} s"
+    )
+    print(f"{'':<24}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for key, label in [
+        ("turn_ms", "turn latency (ms)"),
+        ("first_token_ms", "first token (ms)"),
+        ("tool_call_ms", "tool calls (ms)"),
+        ("cpu_percent", "app CPU (%)"),
+        ("rss_mb", "app RSS (MB)"),
+    ]:
+        values = [summary[key][name] for name in ["p50", "p95", "p99", "max"]]
+        print(f"{label:<24}" + "".join(f"{'-' if value is None else value:>10}" for value in values))
+    for error in summary["error_samples"]:
+        print(f"error: {error}")
+
+
+def find_regressions(summary: dict, baseline: dict, max_regression: float) -> list[str]:
+    regressions = []
+    for metric in COMPARED_METRICS:
+        key, statistic = metric.split(".")
+        current = summary.get(key, {}).get(statistic)
+        previous = baseline.get(key, {}).get(statistic)
+        if current is not None and previous and current > previous * (1 + max_regression):
+            regressions.append(f"{metric}: {current} vs baseline {previous} (+{(current / previous - 1) * 100:.0f}%)")
+    return regressions
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    recordings = load_recordings(args.recordings)
+    prompts = [(recording.name, recording.prompt) for recording in recordings]
+    mock_url = f"http://127.0.0.1:{free_port()}"
+    app_url = f"http://127.0.0.1:{free_port()}"
+    log_dir = Path(tempfile.mkdtemp(prefix="contoso-sales-benchmark-"))
+
+    env = {
+        **os.environ,
+        "ENV": "production",
+        "AZURE_OPENAI_ENDPOINT": mock_url,
+        "AZURE_OPENAI_API_KEY": "benchmark",
+        "AZURE_OPENAI_API_VERSION": os.getenv("AZURE_OPENAI_API_VERSION", "2024-05-01-preview"),
+        "AZURE_OPENAI_ASSISTANT_ID": MOCK_ASSISTANT_ID,
+        "AZURE_OPENAI_DEPLOYMENT": "gpt-4o",
+        "ASSISTANT_PASSWORD": BENCHMARK_PASSWORD,
+        "CHAINLIT_AUTH_SECRET": secrets.token_urlsafe(32),
+        # The mock doesn't rate limit, so the client shouldn't wait out retries either
+        "OPENAI_MAX_RETRIES": "0",
+    }
+    mock_process = start_process(
+        [
+            sys.executable,
+            str(BENCHMARK_DIR / "mock_assistants.py"),
+            "--port",
+            mock_url.rsplit(":", 1)[1],
+            "--recordings",
+            str(args.recordings),
+            "--time-scale",
+            str(args.time_scale),
+        ],
+        log_dir / "mock.log",
+        BENCHMARK_DIR,
+        env,
+    )
+    app_process = start_process(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", app_url.rsplit(":", 1)[1]],
+        log_dir / "app.log",
+        SRC_DIR,
+        env,
+    )
+    logger.info("Logs are written to %s", log_dir)
+
+    try:
+        await wait_until_ready(f"{mock_url}/benchmark/stats", mock_process, log_dir / "mock.log")
+        await wait_until_ready(f"{app_url}/ready", app_process, log_dir / "app.log")
+        async with httpx.AsyncClient() as http:
+            await http.post(f"{mock_url}/benchmark/reset")
+
+        monitor = ProcessMonitor(app_process.pid)
+        monitor.start()
+        users = [SimulatedUser(index, app_url, prompts, args.turns, args.think_time) for index in range(args.users)]
+
+        async def start_user(user: SimulatedUser) -> list[TurnResult]:
+            # Sessions start spread over the ramp up, rather than all connecting at once
+            await asyncio.sleep(args.ramp_up * user.index / max(1, args.users))
+            return await user.run()
+
+        started = time.perf_counter()
+        user_results = await asyncio.gather(*[start_user(user) for user in users], return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        await monitor.stop()
+
+        results = []
+        for user, result in zip(users, user_results, strict=True):
+            if isinstance(result, BaseException):
+                logger.error("Simulated user %d failed: %s", user.index, result)
+                result = [
+                    *user.results,
+                    TurnResult(user=user.index, recording="", turn_ms=0.0, error=f"Session failed: {result}"),
+                ]
+            results += result
+
+        async with httpx.AsyncClient() as http:
+            mock_stats = (await http.get(f"{mock_url}/benchmark/stats")).json()
+        return summarize(results, mock_stats, monitor, elapsed)
+    finally:
+        stop_process(app_process)
+        stop_process(mock_process)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Load test the app against recorded Assistants API runs, without calling Azure."
+    )
+    parser.add_argument("--users", type=int, default=10, help="Concurrent simulated users.")
+    parser.add_argument("--turns", type=int, default=5, help="Messages each user sends.")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Seconds a user waits between messages.")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="Seconds over which the users connect.")
+    parser.add_argument(
+        "--time-scale", type=float, default=1.0, help="Multiplier for the recorded delays; 0 replays without delays."
+    )
+    parser.add_argument("--recordings", type=Path, default=RECORDINGS_DIR, help="Directory of recorded runs.")
+    parser.add_argument("--output", type=Path, help="Write the results as JSON, for use as a later baseline.")
+    parser.add_argument("--baseline", type=Path, help="Results JSON of an earlier run to compare against.")
+    parser.add_argument(
+        "--max-regression", type=float, default=0.2, help="Allowed increase over the baseline, as a fraction."
+    )
+    args = parser.parse_args()
+
+    summary = asyncio.run(run_benchmark(args))
+    print_report(summary, args)
+
+    if args.output:
+        args.output.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+    failed = summary["errors"] > 0
+    if args.baseline:
+        regressions = find_regressions(
+            summary, json.loads(args.baseline.read_text(encoding="utf-8")), args.max_regression
+        )
+        for regression in regressions:
+            print(f"regression: {regression}")
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
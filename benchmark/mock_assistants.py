@@ -0,0 +1,549 @@
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from PIL import Image
+from pydantic import BaseModel
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RECORDINGS_DIR = Path(__file__).parent / "recordings"
+# Recorded delays are multiplied by this; 0 replays the events as fast as the app can take them
+MOCK_TIME_SCALE = float(os.getenv("MOCK_TIME_SCALE", "1.0"))
+MOCK_ASSISTANT_ID = "asst_benchmark"
+DOWNLOAD_SIZE_BYTES = 64 * 1024
+TOKEN_PATTERN = re.compile(r"\s*\S+")
+
+
+def new_id(prefix: str) -> str:
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+def render_chart() -> bytes:
+    """Return a small PNG standing in for a code interpreter chart."""
+    image = Image.new("RGB", (800, 600), (245, 245, 245))
+    for index, color in enumerate([(230, 57, 70), (69, 123, 157), (42, 157, 143), (233, 196, 106)]):
+        image.paste(color, (100 + index * 160, 500 - index * 100, 220 + index * 160, 550))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class Recording(BaseModel):
+    """A run as the service streamed it: rounds of steps separated by tool outputs, with their timing.
+
+    Each round but the last ends with a function_calls step, which puts the run in requires_action.
+    """
+
+    name: str
+    prompt: str
+    rounds: list[dict]
+    usage: dict = {}
+
+
+class MockRun(BaseModel):
+    id: str
+    thread_id: str
+    assistant_id: str
+    recording: str
+    round: int = 0
+    created_at: int
+    cancelled: bool = False
+    # When the run went to requires_action, for the tool call latency
+    requires_action_at: float | None = None
+    required_action: dict | None = None
+    status: str = "queued"
+    # Charts drawn by the run's code interpreter steps, shown again by its messages
+    images: list[str] = []
+
+
+class BenchmarkStats(BaseModel):
+    runs_started: int = 0
+    runs_completed: int = 0
+    runs_cancelled: int = 0
+    tool_call_ms: list[float] = []
+    requests: int = 0
+
+
+class MockAssistants:
+    """Serves the Assistants API endpoints the app uses, replaying recorded runs as event streams.
+
+    A run replays the recording whose prompt matches the thread's last user message, or a random one
+    when no prompt matches.
+    """
+
+    def __init__(self: "MockAssistants", recordings: list[Recording], time_scale: float = MOCK_TIME_SCALE) -> None:
+        self.recordings = {recording.name: recording for recording in recordings}
+        self.prompts = {recording.prompt: recording.name for recording in recordings}
+        self.time_scale = time_scale
+        self.assistant = {
+            "id": MOCK_ASSISTANT_ID,
+            "object": "assistant",
+            "created_at": int(time.time()),
+            "name": "Contoso Sales Assistant",
+            "description": None,
+            "model": "gpt-4o",
+            "instructions": "",
+            "tools": [],
+            "metadata": {},
+        }
+        self.threads: dict[str, dict] = {}
+        self.runs: dict[str, MockRun] = {}
+        self.files: dict[str, dict] = {}
+        # Cited documents keep their file id, like files uploaded to the assistant's vector store
+        self.cited_files: dict[str, str] = {}
+        self.chart = render_chart()
+        self.stats = BenchmarkStats()
+
+    async def pause(self: "MockAssistants", milliseconds: float) -> None:
+        if milliseconds and self.time_scale:
+            await asyncio.sleep(milliseconds * self.time_scale / 1000)
+
+    def add_file(self: "MockAssistants", filename: str, content: bytes, purpose: str = "assistants_output") -> str:
+        file_id = new_id("file")
+        self.files[file_id] = {"filename": filename, "content": content, "purpose": purpose}
+        return file_id
+
+    def file_object(self: "MockAssistants", file_id: str) -> dict:
+        stored = self.files.get(file_id, {"filename": f"{file_id}.txt", "content": b"", "purpose": "assistants"})
+        return {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(stored["content"]),
+            "created_at": int(time.time()),
+            "filename": stored["filename"],
+            "purpose": stored["purpose"],
+            "status": "processed",
+            "status_details": None,
+        }
+
+    def create_thread(self: "MockAssistants", messages: list[dict] | None = None) -> dict:
+        thread = {"id": new_id("thread"), "object": "thread", "created_at": int(time.time()), "metadata": {}}
+        self.threads[thread["id"]] = {"thread": thread, "prompt": None}
+        for message in messages or []:
+            self.add_message(thread["id"], message)
+        return thread
+
+    def add_message(self: "MockAssistants", thread_id: str, message: dict) -> dict:
+        content = message.get("content", "")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        self.threads.setdefault(thread_id, {"thread": {"id": thread_id}, "prompt": None})["prompt"] = content
+        return self.message_object(new_id("msg"), thread_id, None, [self.text_content(content)], "completed", "user")
+
+    def create_run(self: "MockAssistants", thread_id: str, assistant_id: str) -> MockRun:
+        prompt = self.threads.get(thread_id, {}).get("prompt")
+        recording = self.prompts.get(prompt) or random.choice(list(self.recordings))
+        run = MockRun(
+            id=new_id("run"),
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            recording=recording,
+            created_at=int(time.time()),
+        )
+        self.runs[run.id] = run
+        self.stats.runs_started += 1
+        return run
+
+    def run_object(self: "MockAssistants", run: MockRun, usage: dict | None = None) -> dict:
+        return {
+            "id": run.id,
+            "object": "thread.run",
+            "created_at": run.created_at,
+            "assistant_id": run.assistant_id,
+            "thread_id": run.thread_id,
+            "status": run.status,
+            "started_at": run.created_at,
+            "expires_at": None,
+            "cancelled_at": None,
+            "failed_at": None,
+            "completed_at": int(time.time()) if run.status == "completed" else None,
+            "required_action": run.required_action if run.status == "requires_action" else None,
+            "last_error": None,
+            "model": self.assistant["model"],
+            "instructions": "",
+            "tools": self.assistant["tools"],
+            "metadata": {},
+            "usage": usage,
+            "temperature": 0.2,
+            "top_p": 1.0,
+            "max_prompt_tokens": None,
+            "max_completion_tokens": None,
+            "truncation_strategy": {"type": "auto", "last_messages": None},
+            "incomplete_details": None,
+            "response_format": "auto",
+            "tool_choice": "auto",
+            "parallel_tool_calls": True,
+        }
+
+    def step_object(self: "MockAssistants", run: MockRun, step_id: str, step_details: dict, status: str) -> dict:
+        return {
+            "id": step_id,
+            "object": "thread.run.step",
+            "created_at": int(time.time()),
+            "run_id": run.id,
+            "assistant_id": run.assistant_id,
+            "thread_id": run.thread_id,
+            "type": step_details["type"],
+            "status": status,
+            "step_details": step_details,
+            "last_error": None,
+            "expired_at": None,
+            "cancelled_at": None,
+            "failed_at": None,
+            "completed_at": int(time.time()) if status == "completed" else None,
+            "metadata": {},
+            "usage": None,
+        }
+
+    def message_object(
+        self: "MockAssistants",
+        message_id: str,
+        thread_id: str,
+        run: MockRun | None,
+        content: list[dict],
+        status: str,
+        role: str = "assistant",
+    ) -> dict:
+        return {
+            "id": message_id,
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "assistant_id": run.assistant_id if run else None,
+            "thread_id": thread_id,
+            "run_id": run.id if run else None,
+            "role": role,
+            "content": content,
+            "attachments": [],
+            "metadata": {},
+            "status": status,
+            "incomplete_details": None,
+            "completed_at": None,
+            "incomplete_at": None,
+        }
+
+    @staticmethod
+    def text_content(value: str, annotations: list | None = None, index: int | None = None) -> dict:
+        content = {"type": "text", "text": {"value": value, "annotations": annotations or []}}
+        if index is not None:
+            content["index"] = index
+        return content
+
+    @staticmethod
+    def event(event: str, data: dict | str) -> bytes:
+        return f"event: {event}\ndata: {data if isinstance(data, str) else json.dumps(data)}\n\n".encode()
+
+    def step_delta(self: "MockAssistants", step_id: str, tool_call: dict) -> bytes:
+        delta = {"step_details": {"type": "tool_calls", "tool_calls": [tool_call]}}
+        return self.event("thread.run.step.delta", {"id": step_id, "object": "thread.run.step.delta", "delta": delta})
+
+    def message_delta(self: "MockAssistants", message_id: str, content: dict) -> bytes:
+        delta = {"content": [content]}
+        return self.event("thread.message.delta", {"id": message_id, "object": "thread.message.delta", "delta": delta})
+
+    async def replay_function_calls(self: "MockAssistants", run: MockRun, step: dict) -> AsyncIterator[bytes]:
+        step_id = new_id("step")
+        tool_calls = [
+            {
+                "id": new_id("call"),
+                "type": "function",
+                "function": {"name": call["name"], "arguments": json.dumps(call["arguments"])},
+            }
+            for call in step["calls"]
+        ]
+        yield self.event(
+            "thread.run.step.created",
+            self.step_object(run, step_id, {"type": "tool_calls", "tool_calls": []}, "in_progress"),
+        )
+        for index, tool_call in enumerate(tool_calls):
+            await self.pause(step.get("token_ms", 0))
+            yield self.step_delta(
+                step_id, {**tool_call, "index": index, "function": {**tool_call["function"], "output": None}}
+            )
+
+        run.status = "requires_action"
+        run.required_action = {"type": "submit_tool_outputs", "submit_tool_outputs": {"tool_calls": tool_calls}}
+        run.requires_action_at = time.perf_counter()
+        yield self.event("thread.run.requires_action", self.run_object(run))
+
+    async def replay_tool_step(self: "MockAssistants", run: MockRun, step: dict) -> AsyncIterator[bytes]:
+        """Replay a code interpreter or file search step."""
+        step_id = new_id("step")
+        call_id = new_id("call")
+        yield self.event(
+            "thread.run.step.created",
+            self.step_object(run, step_id, {"type": "tool_calls", "tool_calls": []}, "in_progress"),
+        )
+
+        if step["type"] == "file_search":
+            tool_call = {"id": call_id, "type": "file_search", "file_search": {}}
+            yield self.step_delta(step_id, {**tool_call, "index": 0})
+            await self.pause(step.get("run_ms", 0))
+        else:
+            code = step["code"]
+            tool_call = {"index": 0, "type": "code_interpreter"}
+            for chunk_index, chunk in enumerate(TOKEN_PATTERN.findall(code)):
+                await self.pause(step.get("token_ms", 0))
+                if chunk_index == 0:
+                    yield self.step_delta(
+                        step_id, {**tool_call, "id": call_id, "code_interpreter": {"input": chunk, "outputs": []}}
+                    )
+                else:
+                    yield self.step_delta(step_id, {**tool_call, "code_interpreter": {"input": chunk}})
+            await self.pause(step.get("run_ms", 0))
+
+            outputs = []
+            if step.get("image"):
+                run.images.append(self.add_file("chart.png", self.chart))
+                outputs.append({"index": 0, "type": "image", "image": {"file_id": run.images[-1]}})
+                yield self.step_delta(step_id, {**tool_call, "code_interpreter": {"outputs": outputs}})
+            code_interpreter = {"input": code, "outputs": outputs}
+            tool_call = {"id": call_id, "type": "code_interpreter", "code_interpreter": code_interpreter}
+
+        yield self.event(
+            "thread.run.step.completed",
+            self.step_object(run, step_id, {"type": "tool_calls", "tool_calls": [tool_call]}, "completed"),
+        )
+
+    def annotate(self: "MockAssistants", token: str, offset: int, step: dict, first_index: int) -> list[dict]:
+        """Return the annotations of a text delta.
+
+        Citations are recorded as 【n:m†source】 markers and downloads as sandbox links.
+        """
+        annotations = []
+        for match in re.finditer(r"【.*?】|sandbox:/mnt/data/[^)\s]+", token):
+            if match.group().startswith("sandbox:"):
+                file_id = self.add_file(match.group().split("/")[-1], os.urandom(DOWNLOAD_SIZE_BYTES))
+                detail = {"type": "file_path", "file_path": {"file_id": file_id}}
+            else:
+                citations = step.get("citations") or ["contoso-tents-datasheet.pdf"]
+                file_name = citations[(first_index + len(annotations)) % len(citations)]
+                file_id = self.cited_files.get(file_name) or self.add_file(file_name, b"", "assistants")
+                self.cited_files[file_name] = file_id
+                detail = {"type": "file_citation", "file_citation": {"file_id": file_id, "quote": ""}}
+            annotations.append(
+                {
+                    "index": first_index + len(annotations),
+                    "text": match.group(),
+                    "start_index": offset + match.start(),
+                    "end_index": offset + match.end(),
+                    **detail,
+                }
+            )
+        return annotations
+
+    async def replay_message(self: "MockAssistants", run: MockRun, step: dict) -> AsyncIterator[bytes]:
+        """Replay an assistant message token by token, with its citations, download links and chart."""
+        step_id = new_id("step")
+        message_id = new_id("msg")
+        step_details = {"type": "message_creation", "message_creation": {"message_id": message_id}}
+        yield self.event("thread.run.step.created", self.step_object(run, step_id, step_details, "in_progress"))
+        message = self.message_object(message_id, run.thread_id, run, [], "in_progress")
+        yield self.event("thread.message.created", message)
+        yield self.event("thread.message.in_progress", message)
+
+        text = ""
+        annotations = []
+        for token in TOKEN_PATTERN.findall(step["text"]):
+            await self.pause(step.get("token_ms", 0))
+            token_annotations = self.annotate(token, len(text), step, len(annotations))
+            annotations += [{key: value for key, value in item.items() if key != "index"} for item in token_annotations]
+            text += token
+            yield self.message_delta(message_id, self.text_content(token, token_annotations, index=0))
+
+        content = [self.text_content(text, annotations)]
+        if step.get("image") and run.images:
+            image_content = {"type": "image_file", "image_file": {"file_id": run.images[-1], "detail": None}}
+            content.append(image_content)
+            yield self.message_delta(message_id, {**image_content, "index": 1})
+
+        message = self.message_object(message_id, run.thread_id, run, content, "completed")
+        yield self.event("thread.message.completed", message)
+        yield self.event("thread.run.step.completed", self.step_object(run, step_id, step_details, "completed"))
+
+    async def replay(self: "MockAssistants", run: MockRun, new_run: bool) -> AsyncIterator[bytes]:
+        """Stream the run's current round, ending in requires_action or completed."""
+        recording = self.recordings[run.recording]
+        current_round = recording.rounds[min(run.round, len(recording.rounds) - 1)]
+
+        if new_run:
+            yield self.event("thread.run.created", self.run_object(run))
+        run.status = "queued"
+        yield self.event("thread.run.queued", self.run_object(run))
+        await self.pause(current_round.get("latency_ms", 0))
+        run.status = "in_progress"
+        yield self.event("thread.run.in_progress", self.run_object(run))
+
+        replay_step = {
+            "message": self.replay_message,
+            "code_interpreter": self.replay_tool_step,
+            "file_search": self.replay_tool_step,
+            "function_calls": self.replay_function_calls,
+        }
+        for step in current_round["steps"]:
+            async for event in replay_step[step["type"]](run, step):
+                if run.cancelled:
+                    run.status = "cancelled"
+                    self.stats.runs_cancelled += 1
+                    yield self.event("thread.run.cancelled", self.run_object(run))
+                    yield self.event("done", "[DONE]")
+                    return
+                yield event
+            if run.status == "requires_action":
+                yield self.event("done", "[DONE]")
+                return
+
+        run.status = "completed"
+        self.stats.runs_completed += 1
+        usage = recording.usage or {"prompt_tokens": 2000, "completion_tokens": 200, "total_tokens": 2200}
+        yield self.event("thread.run.completed", self.run_object(run, usage))
+        yield self.event("done", "[DONE]")
+
+    def stream(self: "MockAssistants", run: MockRun, new_run: bool = True) -> StreamingResponse:
+        return StreamingResponse(self.replay(run, new_run), media_type="text/event-stream")
+
+
+def create_app(mock: MockAssistants) -> FastAPI:
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def count_requests(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+        mock.stats.requests += 1
+        return await call_next(request)
+
+    @app.get("/openai/assistants/{assistant_id}")
+    async def retrieve_assistant(assistant_id: str) -> dict:
+        return {**mock.assistant, "id": assistant_id}
+
+    @app.post("/openai/assistants/{assistant_id}")
+    async def update_assistant(assistant_id: str, request: Request) -> dict:
+        mock.assistant.update(await request.json())
+        return {**mock.assistant, "id": assistant_id}
+
+    @app.post("/openai/threads")
+    async def create_thread(request: Request) -> dict:
+        body = await request.json() if await request.body() else {}
+        return mock.create_thread(body.get("messages"))
+
+    @app.delete("/openai/threads/{thread_id}")
+    async def delete_thread(thread_id: str) -> dict:
+        mock.threads.pop(thread_id, None)
+        return {"id": thread_id, "object": "thread.deleted", "deleted": True}
+
+    @app.post("/openai/threads/{thread_id}/messages")
+    async def create_message(thread_id: str, request: Request) -> dict:
+        return mock.add_message(thread_id, await request.json())
+
+    @app.post("/openai/threads/runs")
+    async def create_thread_and_run(request: Request) -> StreamingResponse:
+        body = await request.json()
+        thread = mock.create_thread((body.get("thread") or {}).get("messages"))
+        return mock.stream(mock.create_run(thread["id"], body["assistant_id"]))
+
+    @app.post("/openai/threads/{thread_id}/runs")
+    async def create_run(thread_id: str, request: Request) -> StreamingResponse:
+        body = await request.json()
+        return mock.stream(mock.create_run(thread_id, body["assistant_id"]))
+
+    @app.get("/openai/threads/{thread_id}/runs")
+    async def list_runs(thread_id: str) -> dict:
+        runs = [mock.run_object(run) for run in mock.runs.values() if run.thread_id == thread_id][::-1]
+        return {
+            "object": "list",
+            "data": runs,
+            "first_id": runs[0]["id"] if runs else None,
+            "last_id": runs[-1]["id"] if runs else None,
+            "has_more": False,
+        }
+
+    @app.post("/openai/threads/{thread_id}/runs/{run_id}/submit_tool_outputs")
+    async def submit_tool_outputs(run_id: str, request: Request) -> Response:
+        run = mock.runs.get(run_id)
+        if run is None or run.status != "requires_action":
+            return JSONResponse({"error": {"message": "Run is not waiting for tool outputs."}}, status_code=400)
+        mock.stats.tool_call_ms.append(round((time.perf_counter() - run.requires_action_at) * 1000, 1))
+        await request.json()
+        run.round += 1
+        return mock.stream(run, new_run=False)
+
+    @app.post("/openai/threads/{thread_id}/runs/{run_id}/cancel")
+    async def cancel_run(run_id: str) -> Response:
+        run = mock.runs.get(run_id)
+        if run is None or run.status in ["completed", "cancelled"]:
+            return JSONResponse({"error": {"message": "Cannot cancel a finished run."}}, status_code=400)
+        run.cancelled = True
+        run.status = "cancelling"
+        return JSONResponse(mock.run_object(run))
+
+    @app.post("/openai/files")
+    async def create_file(request: Request) -> dict:
+        form = await request.form()
+        upload = form["file"]
+        return mock.file_object(mock.add_file(upload.filename, await upload.read(), form.get("purpose", "assistants")))
+
+    @app.get("/openai/files/{file_id}")
+    async def retrieve_file(file_id: str) -> dict:
+        return mock.file_object(file_id)
+
+    @app.get("/openai/files/{file_id}/content")
+    async def file_content(file_id: str) -> Response:
+        stored = mock.files.get(file_id)
+        if stored is None:
+            return JSONResponse({"error": {"message": "No such file."}}, status_code=404)
+        return Response(stored["content"], media_type="application/octet-stream")
+
+    @app.delete("/openai/files/{file_id}")
+    async def delete_file(file_id: str) -> dict:
+        mock.files.pop(file_id, None)
+        return {"id": file_id, "object": "file", "deleted": True}
+
+    @app.get("/benchmark/stats")
+    async def stats() -> dict:
+        return mock.stats.model_dump()
+
+    @app.post("/benchmark/reset")
+    async def reset() -> dict:
+        mock.stats = BenchmarkStats()
+        return mock.stats.model_dump()
+
+    return app
+
+
+def load_recordings(recordings_dir: Path = RECORDINGS_DIR) -> list[Recording]:
+    recordings = []
+    for path in sorted(recordings_dir.glob("*.json")):
+        with path.open("r", encoding="utf-8") as file:
+            recordings.append(Recording(name=path.stem, **json.load(file)))
+    return recordings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve recorded Assistants API runs for benchmarking the app.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--recordings", type=Path, default=RECORDINGS_DIR, help="Directory of recorded runs.")
+    parser.add_argument(
+        "--time-scale", type=float, default=MOCK_TIME_SCALE, help="Multiplier for recorded delays; 0 for no delays."
+    )
+    args = parser.parse_args()
+
+    mock = MockAssistants(load_recordings(args.recordings), time_scale=args.time_scale)
+    logger.info("Replaying %d recordings: %s", len(mock.recordings), ", ".join(mock.recordings))
+    uvicorn.run(create_app(mock), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+import argparse
+import re
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import closing
+from pathlib import Path
+
+from pydantic import BaseModel
+
+BENCHMARK_DIR = Path(__file__).parent
+SRC_DIR = BENCHMARK_DIR.parent / "src"
+sys.path.insert(0, str(SRC_DIR))
+
+from aggregate_query import parse_aggregate_query, select_clauses
+from query_cache import SQL_KEYWORDS, tokenize_sql
+from query_plan_log import QueryPlanEntry, format_query_plan, read_query_plan_log
+
+DATABASE = SRC_DIR / "database" / "contoso-sales.db"
+TABLE = "sales_data"
+# A full scan of the table: "SCAN sales_data" since SQLite 3.36, "SCAN TABLE sales_data" before
+TABLE_SCAN_PATTERN = re.compile(rf"SCAN (?:TABLE )?{TABLE}\b")
+# Wider indexes cost more to store and maintain than they are likely to save
+MAX_INDEX_COLUMNS = 6
+EQUALITY_OPERATORS = ("=", "==", "IN")
+RANGE_OPERATORS = ("<", "<=", ">", ">=", "BETWEEN")
+
+
+class QueryShape(BaseModel):
+    """The columns of a query that an index on the table could serve, in the order it would want them."""
+
+    equality: list[str] = []
+    range: list[str] = []
+    group_by: list[str] = []
+    order_by: list[str] = []
+    # Every column the query reads, or None when it reads all of them (SELECT *)
+    referenced: set[str] | None = None
+
+
+class Candidate(BaseModel):
+    columns: tuple[str, ...]
+    # Indexes of the workload queries it was proposed for
+    queries: set[int] = set()
+
+    @property
+    def name(self: "Candidate") -> str:
+        return f"idx_advisor_{'_'.join(self.columns)}"
+
+    @property
+    def statement(self: "Candidate") -> str:
+        return f"CREATE INDEX {self.name} ON {TABLE}({', '.join(self.columns)});"
+
+
+class Measurement(BaseModel):
+    candidate: Candidate
+    size_bytes: int
+    # Median milliseconds per workload query, before and after creating the index
+    before_ms: list[float]
+    after_ms: list[float]
+    plans: list[list[str]]
+
+    @property
+    def saved_ms(self: "Measurement") -> float:
+        return sum(self.before_ms) - sum(self.after_ms)
+
+
+def plan_problems(plan: list[str]) -> list[str]:
+    """Return the full table scans and temporary B-tree sorts in a query plan."""
+    problems = []
+    for line in plan:
+        detail = line.strip()
+        is_scan = TABLE_SCAN_PATTERN.match(detail) is not None and "COVERING INDEX" not in detail
+        if is_scan or detail.startswith("USE TEMP B-TREE"):
+            problems.append(detail)
+    return problems
+
+
+def _column(token: tuple[str, str, int, int], columns: set[str]) -> str | None:
+    kind, text, _, _ = token
+    if kind == "quoted":
+        text = text[1:-1]
+    elif kind != "word" or text.upper() in SQL_KEYWORDS:
+        return None
+    return text.lower() if text.lower() in columns else None
+
+
+def query_shape(query: str, columns: set[str]) -> QueryShape | None:
+    """Find the columns of a single-table query that are filtered, grouped and sorted on.
+
+    Filters are only used when the condition is a conjunction: an index can't serve terms joined by OR.
+    """
+    clauses = select_clauses(query)
+    if clauses is None or clauses["FROM"].strip().strip('"`[]').lower() != TABLE:
+        return None
+    shape = QueryShape()
+
+    where = tokenize_sql(clauses.get("WHERE", ""))
+    depth = 0
+    for index, (_, text, _, _) in enumerate(where):
+        depth += {"(": 1, ")": -1}.get(text, 0)
+        if depth == 0 and text.upper() == "OR":
+            shape.equality, shape.range = [], []
+            break
+        column = _column(where[index], columns)
+        if column is None:
+            continue
+        # The operator follows the column, or precedes it when the literal comes first
+        following = where[index + 1][1].upper() if index + 1 < len(where) else ""
+        preceding = where[index - 1][1].upper() if index > 0 else ""
+        operator = following if following in EQUALITY_OPERATORS + RANGE_OPERATORS else preceding
+        if operator in EQUALITY_OPERATORS and column not in shape.equality:
+            shape.equality.append(column)
+        elif operator in RANGE_OPERATORS and column not in shape.range:
+            shape.range.append(column)
+
+    parsed = parse_aggregate_query(query)
+    for clause, target in (("GROUP", shape.group_by), ("ORDER", shape.order_by)):
+        for token in tokenize_sql(clauses.get(clause, "")):
+            if token[0] == "number" and clause == "GROUP" and parsed is not None:
+                position = int(token[1]) if token[1].isdigit() else 0
+                if 1 <= position <= len(parsed.select_items) and parsed.select_items[position - 1].column:
+                    target.append(parsed.select_items[position - 1].column)
+            elif (column := _column(token, columns)) and column not in target:
+                target.append(column)
+
+    if parsed is not None:
+        shape.referenced = parsed.columns | {call.column for call in parsed.aggregates if call.column}
+    return shape
+
+
+def propose_indexes(shape: QueryShape) -> list[tuple[str, ...]]:
+    """Propose a composite index and a covering one for a query.
+
+    The composite index leads with the equality filters, then serves the GROUP BY or, without one, the
+    ORDER BY, and ends with a range filter. The covering index adds every other column the query reads,
+    so the query never has to look up the table's rows.
+    """
+    key = list(shape.equality)
+    for column in shape.group_by or shape.order_by:
+        if column not in key:
+            key.append(column)
+    if shape.range and shape.range[0] not in key:
+        key.append(shape.range[0])
+
+    proposals = []
+    if key:
+        proposals.append(tuple(key[:MAX_INDEX_COLUMNS]))
+    if shape.referenced is not None:
+        covering = key + sorted(shape.referenced - set(key))
+        if len(covering) > len(key) and len(covering) <= MAX_INDEX_COLUMNS:
+            proposals.append(tuple(covering))
+    return proposals
+
+
+def existing_indexes(conn: sqlite3.Connection) -> set[tuple[str, ...]]:
+    indexes = set()
+    for (name,) in conn.execute(f"SELECT name FROM pragma_index_list('{TABLE}');").fetchall():
+        columns = conn.execute(f"SELECT name FROM pragma_index_info('{name}') ORDER BY seqno;").fetchall()
+        indexes.add(tuple(column.lower() for (column,) in columns if column))
+    return indexes
+
+
+def run_workload(conn: sqlite3.Connection, queries: list[str], repeat: int) -> tuple[list[float], list[list[str]]]:
+    """Return the median milliseconds and the plan of each query, after one run to warm the page cache."""
+    timings = []
+    plans = []
+    for query in queries:
+        conn.execute(query).fetchall()
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(query).fetchall()
+            samples.append((time.perf_counter() - start) * 1000)
+        timings.append(statistics.median(samples))
+        plans.append(format_query_plan(conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()))
+    return timings, plans
+
+
+def database_size(conn: sqlite3.Connection) -> int:
+    (page_count,) = conn.execute("PRAGMA page_count;").fetchone()
+    (page_size,) = conn.execute("PRAGMA page_size;").fetchone()
+    return page_count * page_size
+
+
+def load_workload(log_path: Path, all_backends: bool) -> list[QueryPlanEntry]:
+    """Return the logged queries that ran on the table, or all of them with `all_backends`."""
+    entries = read_query_plan_log(log_path)
+    return [entry for entry in entries if all_backends or entry.backend == "sqlite"]
+
+
+def advise(database: Path, entries: list[QueryPlanEntry], repeat: int, min_improvement: float) -> None:
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Indexes are tried on a copy, never on the database the app serves
+        copy = Path(work_dir) / database.name
+        shutil.copyfile(database, copy)
+        with closing(sqlite3.connect(copy)) as conn:
+            columns = {name.lower() for (name,) in conn.execute(f"SELECT name FROM pragma_table_info('{TABLE}');")}
+            existing = existing_indexes(conn)
+
+            workload = []
+            for entry in entries:
+                try:
+                    conn.execute(f"EXPLAIN {entry.query}")
+                except sqlite3.Error as e:
+                    print(f"Skipping a query that no longer runs ({e}): {entry.query}")
+                    continue
+                workload.append(entry)
+            if not workload:
+                print("No queries to analyze.")
+                return
+
+            candidates: dict[tuple[str, ...], Candidate] = {}
+            print(f"Workload: {len(workload)} queries\n")
+            for index, entry in enumerate(workload):
+                problems = plan_problems(entry.plan)
+                if not problems:
+                    continue
+                print(f"[{index}] {entry.query}")
+                for problem in problems:
+                    print(f"      {problem}")
+                shape = query_shape(entry.query, columns)
+                for proposal in propose_indexes(shape) if shape else []:
+                    if proposal in existing:
+                        continue
+                    candidates.setdefault(proposal, Candidate(columns=proposal)).queries.add(index)
+            if not candidates:
+                print("\nNo index to propose.")
+                return
+
+            queries = [entry.query for entry in workload]
+            print(f"\nBenchmarking {len(candidates)} candidate indexes against the workload...")
+            before_ms, _ = run_workload(conn, queries, repeat)
+            base_size = database_size(conn)
+
+            measurements = []
+            for candidate in candidates.values():
+                conn.execute(candidate.statement)
+                after_ms, plans = run_workload(conn, queries, repeat)
+                size = database_size(conn) - base_size
+                conn.execute(f"DROP INDEX {candidate.name};")
+                measurement = Measurement(
+                    candidate=candidate, size_bytes=size, before_ms=before_ms, after_ms=after_ms, plans=plans
+                )
+                measurements.append(measurement)
+
+    print_report(measurements, min_improvement)
+
+
+def print_report(measurements: list[Measurement], min_improvement: float) -> None:
+    total_ms = sum(measurements[0].before_ms)
+    print(f"\nWorkload total before: {total_ms:.2f} ms\n")
+    for measurement in sorted(measurements, key=lambda measurement: measurement.saved_ms, reverse=True):
+        after_total = sum(measurement.after_ms)
+        change = (after_total - total_ms) / total_ms * 100 if total_ms else 0.0
+        print(measurement.candidate.statement)
+        print(
+            f"  workload {total_ms:.2f} ms -> {after_total:.2f} ms ({change:+.1f}%), "
+            f"index size {measurement.size_bytes / 1024 / 1024:.2f} MB"
+        )
+        for index, (before, after) in enumerate(zip(measurement.before_ms, measurement.after_ms)):
+            proposed = "*" if index in measurement.candidate.queries else " "
+            if index in measurement.candidate.queries or abs(after - before) > max(0.1 * before, 0.05):
+                plan = " / ".join(measurement.plans[index])
+                print(f"  {proposed}[{index}] {before:8.2f} ms -> {after:8.2f} ms  {plan}")
+        print()
+    print("* the index was proposed for the query")
+
+    recommended = [
+        measurement
+        for measurement in measurements
+        if total_ms and measurement.saved_ms / total_ms * 100 >= min_improvement
+    ]
+    print(f"\nIndexes that speed up the workload by at least {min_improvement:g}%:")
+    for measurement in sorted(recommended, key=lambda measurement: measurement.saved_ms, reverse=True):
+        print(f"  {measurement.candidate.statement}")
+    if not recommended:
+        print("  none")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Propose and benchmark indexes for the queries recorded in a query plan log (QUERY_PLAN_LOG)."
+    )
+    parser.add_argument("log", help="Query plan log written by the app")
+    parser.add_argument("--database", default=str(DATABASE), help="SQLite database the queries ran on")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per query; the median is reported")
+    parser.add_argument(
+        "--min-improvement", type=float, default=5.0, help="Workload speedup in percent to recommend an index"
+    )
+    parser.add_argument(
+        "--all-backends",
+        action="store_true",
+        help="Include queries answered by the rollups or the columnar store, not only those run on the table",
+    )
+    args = parser.parse_args()
+
+    workload = load_workload(Path(args.log), args.all_backends)
+    advise(Path(args.database), workload, args.repeat, args.min_improvement)
+
+
+if __name__ == "__main__":
+    main()
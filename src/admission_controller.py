@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, suppress
+from typing import AsyncIterator, Awaitable, Callable
+
+import httpx
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# The deployment's quota; 0 takes the limit from the rate limit headers of the responses
+RATE_LIMIT_TOKENS_PER_MINUTE = int(os.getenv("RATE_LIMIT_TOKENS_PER_MINUTE", "0"))
+RATE_LIMIT_REQUESTS_PER_MINUTE = int(os.getenv("RATE_LIMIT_REQUESTS_PER_MINUTE", "0"))
+MAX_CONCURRENT_RUNS = int(os.getenv("MAX_CONCURRENT_RUNS", "32"))
+# How often a queued request reports its queue position
+QUEUE_POSITION_UPDATE_SECONDS = 1.0
+
+
+class TokenBucket:
+    """A bucket refilled continuously at `per_minute / 60` per second, holding at most a minute's worth."""
+
+    def __init__(self: "TokenBucket", per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+        # Without a configured or reported limit, the limit is inferred from the remaining counts
+        self.inferred = per_minute <= 0
+
+    def _refill(self: "TokenBucket") -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60)
+        self._updated = now
+
+    def wait_time(self: "TokenBucket", amount: float) -> float:
+        """Return how long until `amount` can be taken; 0 when the bucket has no limit."""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill()
+        deficit = min(amount, self.capacity) - self.level
+        return max(0.0, deficit * 60 / self.capacity)
+
+    def take(self: "TokenBucket", amount: float) -> None:
+        if self.capacity > 0:
+            self._refill()
+            self.level -= min(amount, self.capacity)
+
+    def give_back(self: "TokenBucket", amount: float) -> None:
+        if self.capacity > 0:
+            self._refill()
+            self.level = min(self.capacity, self.level + amount)
+
+    def _resize(self: "TokenBucket", per_minute: float) -> None:
+        if per_minute != self.capacity:
+            self._refill()
+            self.level = per_minute if self.capacity <= 0 else min(self.level, per_minute)
+            self.capacity = per_minute
+
+    def set_limit(self: "TokenBucket", per_minute: float) -> None:
+        self._resize(per_minute)
+        self.inferred = False
+
+    def cap(self: "TokenBucket", remaining: float) -> None:
+        """Lower the level to what the service reports as remaining.
+
+        While the limit is inferred, the highest remaining count seen is taken as the limit. The service
+        never reports more remaining than its limit, so this is a lower bound that rises toward it.
+        """
+        if self.inferred and remaining > self.capacity:
+            self._resize(remaining)
+        if self.capacity > 0:
+            self._refill()
+            self.level = min(self.level, remaining)
+
+
+class AdmissionTicket:
+    def __init__(self: "AdmissionTicket", key: str, tokens: int) -> None:
+        self.key = key
+        self.tokens = tokens
+        # Set by the caller once the actual usage is known, so the unused estimate is given back
+        self.used_tokens: int | None = None
+        self.admitted: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class AdmissionController:
+    """Admits runs within the deployment's token and request quotas, queueing the rest fairly.
+
+    Each run reserves its estimated tokens before it starts. Queued runs are admitted round robin across
+    keys (chat sessions), so one busy session can't starve the others. The budget follows the service:
+    the remaining tokens and requests reported in the rate limit headers lower the buckets, and a 429's
+    retry-after pauses admissions.
+    """
+
+    def __init__(
+        self: "AdmissionController",
+        tokens_per_minute: int = RATE_LIMIT_TOKENS_PER_MINUTE,
+        requests_per_minute: int = RATE_LIMIT_REQUESTS_PER_MINUTE,
+        max_concurrent: int = MAX_CONCURRENT_RUNS,
+    ) -> None:
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.requests = TokenBucket(requests_per_minute)
+        self.max_concurrent = max_concurrent
+        self.running = 0
+        self._queues: OrderedDict[str, deque[AdmissionTicket]] = OrderedDict()
+        self._paused_until = 0.0
+        self._changed = asyncio.Event()
+        self._dispatcher: asyncio.Task | None = None
+
+    def observe(self: "AdmissionController", response: httpx.Response) -> None:
+        """Adapt the budget to the rate limit headers of a response."""
+        headers = response.headers
+        with suppress(ValueError):
+            # Sent by some deployments; the configured quota, or the remaining counts, are used otherwise
+            if (limit_tokens := headers.get("x-ratelimit-limit-tokens")) is not None:
+                self.tokens.set_limit(float(limit_tokens))
+            if (limit_requests := headers.get("x-ratelimit-limit-requests")) is not None:
+                self.requests.set_limit(float(limit_requests))
+            if (remaining_tokens := headers.get("x-ratelimit-remaining-tokens")) is not None:
+                self.tokens.cap(float(remaining_tokens))
+            if (remaining_requests := headers.get("x-ratelimit-remaining-requests")) is not None:
+                self.requests.cap(float(remaining_requests))
+
+        if response.status_code == 429:
+            retry_after = 1.0
+            with suppress(ValueError, TypeError):
+                if (retry_after_ms := headers.get("retry-after-ms")) is not None:
+                    retry_after = float(retry_after_ms) / 1000
+                elif (retry_after_seconds := headers.get("retry-after")) is not None:
+                    retry_after = float(retry_after_seconds)
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            logger.warning("Rate limited, pausing admissions for %.1f seconds.", retry_after)
+        self._changed.set()
+
+    def queue_depth(self: "AdmissionController") -> int:
+        """Return the number of runs waiting for admission."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def queue_position(self: "AdmissionController", ticket: AdmissionTicket) -> int:
+        """Return the ticket's 1-based place in the round robin admission order, or 0 once admitted."""
+        queues = [list(queue) for queue in self._queues.values()]
+        position = 0
+        for index in range(max((len(queue) for queue in queues), default=0)):
+            for queue in queues:
+                if index < len(queue):
+                    position += 1
+                    if queue[index] is ticket:
+                        return position
+        return 0
+
+    def _next_ticket(self: "AdmissionController") -> AdmissionTicket | None:
+        # Skips sessions whose queue emptied, and tickets cancelled while they were being admitted
+        while self._queues:
+            key, queue = next(iter(self._queues.items()))
+            if queue and not queue[0].admitted.done():
+                return queue[0]
+            if queue:
+                queue.popleft()
+            if not queue:
+                del self._queues[key]
+        return None
+
+    def _wait_time(self: "AdmissionController", ticket: AdmissionTicket) -> float:
+        if self.max_concurrent > 0 and self.running >= self.max_concurrent:
+            return math.inf
+        return max(
+            self._paused_until - time.monotonic(),
+            self.tokens.wait_time(ticket.tokens),
+            self.requests.wait_time(1),
+        )
+
+    def _admit_ready(self: "AdmissionController") -> float | None:
+        """Admit the queued runs the budget allows right now, in round robin order.
+
+        Returns how long until the next queued run may be admitted, or None when none is left waiting.
+        """
+        while (ticket := self._next_ticket()) is not None:
+            wait = self._wait_time(ticket)
+            if wait > 0:
+                return wait
+            queue = self._queues.pop(ticket.key)
+            queue.popleft()
+            if queue:
+                # The session's next request goes to the back of the round robin
+                self._queues[ticket.key] = queue
+            self.tokens.take(ticket.tokens)
+            self.requests.take(1)
+            self.running += 1
+            ticket.admitted.set_result(None)
+        return None
+
+    async def _dispatch(self: "AdmissionController") -> None:
+        while True:
+            # Cleared before the budget is checked, so a change made meanwhile still wakes the loop
+            self._changed.clear()
+            wait = self._admit_ready()
+            if wait is None:
+                return
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._changed.wait(), timeout=None if math.isinf(wait) else wait)
+
+    def _release(self: "AdmissionController", ticket: AdmissionTicket) -> None:
+        self.running -= 1
+        if ticket.used_tokens is not None and ticket.used_tokens < ticket.tokens:
+            self.tokens.give_back(ticket.tokens - ticket.used_tokens)
+        self._changed.set()
+
+    @asynccontextmanager
+    async def admit(
+        self: "AdmissionController",
+        key: str,
+        tokens: int,
+        on_queued: Callable[[int], Awaitable[None]] | None = None,
+    ) -> AsyncIterator[AdmissionTicket]:
+        """Wait for the run's turn and budget, reporting the queue position while waiting.
+
+        A run is admitted right away, without reporting a position, when the budget allows it and no
+        other run is queued ahead of it.
+        """
+        ticket = AdmissionTicket(key, tokens)
+        self._queues.setdefault(key, deque()).append(ticket)
+        self._admit_ready()
+        if not ticket.admitted.done():
+            self._changed.set()
+            if self._dispatcher is None or self._dispatcher.done():
+                self._dispatcher = asyncio.create_task(self._dispatch())
+
+        try:
+            reported = 0
+            while not ticket.admitted.done():
+                position = self.queue_position(ticket)
+                if on_queued and position and position != reported:
+                    reported = position
+                    await on_queued(position)
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(asyncio.shield(ticket.admitted), timeout=QUEUE_POSITION_UPDATE_SECONDS)
+        except BaseException:
+            if ticket.admitted.done():
+                self._release(ticket)
+            else:
+                ticket.admitted.cancel()
+                with suppress(KeyError, ValueError):
+                    self._queues[key].remove(ticket)
+                self._changed.set()
+            raise
+
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
@@ -0,0 +1,366 @@
+from pydantic import BaseModel
+
+from query_cache import SQL_KEYWORDS, tokenize_sql
+
+AGGREGATE_FUNCTIONS = frozenset({"AVG", "COUNT", "MAX", "MIN", "SUM", "TOTAL"})
+# Functions of a single row's values. Any other call, such as group_concat or json_group_array, may be an
+# aggregate, so a query with one isn't parsed.
+SCALAR_FUNCTIONS = frozenset(
+    {
+        "ABS",
+        "COALESCE",
+        "DATE",
+        "IFNULL",
+        "IIF",
+        "INSTR",
+        "LENGTH",
+        "LOWER",
+        "LTRIM",
+        "NULLIF",
+        "PRINTF",
+        "REPLACE",
+        "ROUND",
+        "RTRIM",
+        "STRFTIME",
+        "SUBSTR",
+        "SUBSTRING",
+        "TRIM",
+        "UPPER",
+    }
+)
+CLAUSES = ("SELECT", "FROM", "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT")
+# Anything with these is more than a single-table aggregate
+UNSUPPORTED_KEYWORDS = frozenset({"EXCEPT", "FILTER", "INTERSECT", "JOIN", "OVER", "UNION", "VALUES", "WINDOW", "WITH"})
+LITERAL_WORDS = frozenset({"FALSE", "TRUE"})
+
+Token = tuple[str, str, int, int]
+
+
+class AggregateCall(BaseModel):
+    """An aggregate over a single column, such as SUM(revenue), COUNT(*) or COUNT(DISTINCT region)."""
+
+    function: str
+    # None for COUNT(*)
+    column: str | None = None
+    distinct: bool = False
+    start: int
+    end: int
+
+
+class SelectItem(BaseModel):
+    start: int
+    end: int
+    alias: str | None = None
+    # Set when the item is a bare column reference
+    column: str | None = None
+    has_aggregate: bool = False
+
+
+class AggregateQuery(BaseModel):
+    """The parts of a single-table SELECT that query rewriters and alternative executors need.
+
+    Character offsets refer to `query`, so the statement can be rewritten in place. Column names are
+    lower-cased; references to select-list aliases in GROUP BY, HAVING and ORDER BY are left out.
+    """
+
+    query: str
+    table: str
+    table_start: int
+    table_end: int
+    distinct: bool = False
+    select_items: list[SelectItem]
+    aggregates: list[AggregateCall]
+    # Columns referenced outside aggregates, in any clause
+    columns: set[str]
+    # Columns referenced outside aggregates in the select list, HAVING and ORDER BY
+    output_columns: set[str]
+    group_by: set[str]
+    has_group_by: bool = False
+    # Character range of each clause after its keywords, such as the condition of WHERE
+    clauses: dict[str, tuple[int, int]]
+
+
+def _identifier(token: Token) -> str:
+    kind, text, _, _ = token
+    if kind == "quoted":
+        text = text[1:-1]
+    return text.lower()
+
+
+def _split_clauses(tokens: list[Token]) -> dict[str, tuple[int, int]] | None:
+    """Return the token range of each top-level clause, or None if the statement isn't a plain SELECT."""
+    starts = []
+    depth = 0
+    for index, (kind, text, _, _) in enumerate(tokens):
+        word = text.upper() if kind == "word" else ""
+        if text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+            if depth < 0:
+                return None
+        elif word == "SELECT" and index > 0:
+            return None
+        elif word in UNSUPPORTED_KEYWORDS:
+            return None
+        elif depth == 0 and word in CLAUSES:
+            if word in ("GROUP", "ORDER"):
+                if index + 1 >= len(tokens) or tokens[index + 1][1].upper() != "BY":
+                    return None
+            starts.append((word, index))
+
+    clause_names = [name for name, _ in starts]
+    if not clause_names or clause_names[0] != "SELECT" or starts[0][1] != 0 or depth != 0:
+        return None
+    # Each clause at most once and in order
+    if clause_names != sorted(set(clause_names), key=CLAUSES.index):
+        return None
+
+    clauses = {}
+    for position, (name, index) in enumerate(starts):
+        end = starts[position + 1][1] if position + 1 < len(starts) else len(tokens)
+        clauses[name] = (index + (2 if name in ("GROUP", "ORDER") else 1), end)
+    return clauses
+
+
+def _parse_aggregate(tokens: list[Token], index: int) -> tuple[AggregateCall | None, int]:
+    """Parse the aggregate whose name is at `index`.
+
+    Returns the call, or None if it isn't over a single column, and the index past its closing parenthesis.
+    """
+    depth = 0
+    end = index + 1
+    while end < len(tokens):
+        if tokens[end][1] == "(":
+            depth += 1
+        elif tokens[end][1] == ")":
+            depth -= 1
+            if depth == 0:
+                break
+        end += 1
+    arguments = tokens[index + 2 : end]
+    next_index = end + 1
+    if end >= len(tokens):
+        return None, next_index
+
+    function = tokens[index][1].upper()
+    distinct = bool(arguments) and arguments[0][0] == "word" and arguments[0][1].upper() == "DISTINCT"
+    if distinct:
+        arguments = arguments[1:]
+    if len(arguments) != 1:
+        return None, next_index
+
+    kind, text, _, _ = arguments[0]
+    if text == "*" and function == "COUNT" and not distinct:
+        column = None
+    elif kind == "quoted" or (kind == "word" and text.upper() not in SQL_KEYWORDS):
+        column = _identifier(arguments[0])
+    else:
+        return None, next_index
+
+    call = AggregateCall(
+        function=function, column=column, distinct=distinct, start=tokens[index][2], end=tokens[end][3]
+    )
+    return call, next_index
+
+
+def _split_list(tokens: list[Token], start: int, end: int) -> list[tuple[int, int]]:
+    """Split a comma separated list, such as the select list, into the token ranges of its items."""
+    items = []
+    depth = 0
+    item_start = start
+    for index in range(start, end):
+        text = tokens[index][1]
+        if text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+        elif text == "," and depth == 0:
+            items.append((item_start, index))
+            item_start = index + 1
+    items.append((item_start, end))
+    return items
+
+
+def _item_alias(tokens: list[Token], start: int, end: int) -> tuple[str | None, int]:
+    """Return the item's alias, if it has one, and the end of its expression."""
+    if end - start < 2:
+        return None, end
+    kind, text, _, _ = tokens[end - 1]
+    if kind not in ("word", "quoted", "string") or (kind == "word" and text.upper() in SQL_KEYWORDS):
+        return None, end
+    alias = text[1:-1] if kind in ("quoted", "string") else text
+    previous_kind, previous_text, _, _ = tokens[end - 2]
+    if previous_text.upper() == "AS":
+        return alias, end - 2
+    # An implicit alias such as `SUM(revenue) total`
+    if previous_text == ")" or previous_kind in ("word", "quoted", "number"):
+        return alias, end - 1
+    return None, end
+
+
+def _walk(tokens: list[Token], start: int, end: int) -> tuple[list[AggregateCall], set[str]] | None:
+    """Return the aggregates and the other column references in a range of tokens.
+
+    Returns None if an aggregate isn't over a single column, a column name is qualified or a function
+    is neither a known aggregate nor a known scalar function.
+    """
+    aggregates = []
+    columns = set()
+    index = start
+    while index < end:
+        kind, text, _, _ = tokens[index]
+        next_text = tokens[index + 1][1] if index + 1 < len(tokens) else ""
+        previous_text = tokens[index - 1][1].upper() if index > 0 else ""
+
+        if kind == "word" and text.upper() in AGGREGATE_FUNCTIONS and next_text == "(":
+            call, index = _parse_aggregate(tokens, index)
+            if call is None:
+                return None
+            aggregates.append(call)
+            continue
+        if next_text == "." or previous_text == ".":
+            return None
+        if kind == "word" and next_text == "(" and text.upper() not in SCALAR_FUNCTIONS | SQL_KEYWORDS:
+            return None
+
+        is_name = kind == "quoted" or (
+            kind == "word" and text.upper() not in SQL_KEYWORDS and text.upper() not in LITERAL_WORDS
+        )
+        # Function names, CAST(... AS type) and COLLATE names aren't columns
+        if is_name and next_text != "(" and previous_text not in ("AS", "COLLATE"):
+            columns.add(_identifier(tokens[index]))
+        index += 1
+    return aggregates, columns
+
+
+def _statement(query: str) -> tuple[list[Token], dict[str, tuple[int, int]]] | None:
+    """Tokenize a single plain SELECT with a FROM clause and find its clauses."""
+    tokens = tokenize_sql(query)
+    while tokens and tokens[-1][1] == ";":
+        tokens.pop()
+    if any(text == ";" for _, text, _, _ in tokens):
+        return None
+
+    clauses = _split_clauses(tokens)
+    if clauses is None or "FROM" not in clauses:
+        return None
+    return tokens, clauses
+
+
+def _clause_spans(tokens: list[Token], clauses: dict[str, tuple[int, int]]) -> dict[str, tuple[int, int]]:
+    """Return the character range of each clause from its range of tokens."""
+    return {
+        name: (tokens[start][2], tokens[end - 1][3]) if start < end else (tokens[start - 1][3], tokens[start - 1][3])
+        for name, (start, end) in clauses.items()
+    }
+
+
+def select_clauses(query: str) -> dict[str, str] | None:
+    """Return the text of each clause of a plain SELECT after its keywords, such as the condition of WHERE.
+
+    Unlike parse_aggregate_query this accepts any select list, including SELECT *.
+    """
+    query = query.strip()
+    statement = _statement(query)
+    if statement is None:
+        return None
+    return {name: query[start:end] for name, (start, end) in _clause_spans(*statement).items()}
+
+
+def parse_aggregate_query(query: str) -> AggregateQuery | None:
+    """Parse a SELECT over one table whose aggregates each take a single column.
+
+    Returns None for anything else: joins, subqueries, compound selects, window functions, qualified
+    column names, SELECT *, aggregates over expressions and calls to functions that aren't known.
+    """
+    query = query.strip()
+    statement = _statement(query)
+    if statement is None:
+        return None
+    tokens, clauses = statement
+
+    from_start, from_end = clauses["FROM"]
+    if from_end - from_start != 1 or tokens[from_start][0] not in ("word", "quoted"):
+        return None
+    table_token = tokens[from_start]
+
+    select_start, select_end = clauses["SELECT"]
+    distinct = select_start < select_end and tokens[select_start][1].upper() == "DISTINCT"
+    if select_start < select_end and tokens[select_start][1].upper() in ("DISTINCT", "ALL"):
+        select_start += 1
+
+    aggregates = []
+    columns = set()
+    output_columns = set()
+    select_items = []
+    item_columns = []
+    for item_start, item_end in _split_list(tokens, select_start, select_end):
+        if item_start == item_end or tokens[item_start][1] == "*":
+            return None
+        alias, expression_end = _item_alias(tokens, item_start, item_end)
+        walked = _walk(tokens, item_start, expression_end)
+        if walked is None:
+            return None
+        item_aggregates, item_references = walked
+        single = expression_end - item_start == 1 and tokens[item_start][0] in ("word", "quoted")
+        select_items.append(
+            SelectItem(
+                start=tokens[item_start][2],
+                end=tokens[expression_end - 1][3],
+                alias=alias,
+                column=_identifier(tokens[item_start]) if single else None,
+                has_aggregate=bool(item_aggregates),
+            )
+        )
+        item_columns.append(item_references)
+        aggregates += item_aggregates
+        columns |= item_references
+        output_columns |= item_references
+    aliases = {item.alias.lower() for item in select_items if item.alias}
+
+    if "WHERE" in clauses:
+        walked = _walk(tokens, *clauses["WHERE"])
+        if walked is None or walked[0]:
+            return None
+        columns |= walked[1]
+
+    group_by = set()
+    for item_start, item_end in _split_list(tokens, *clauses["GROUP"]) if "GROUP" in clauses else []:
+        if item_end - item_start == 1 and tokens[item_start][1].isdigit():
+            # GROUP BY 1 groups by the first result column; other numbers, such as 1.5, are constants
+            position = int(tokens[item_start][1])
+            if not 1 <= position <= len(select_items) or select_items[position - 1].has_aggregate:
+                return None
+            group_by |= item_columns[position - 1]
+            continue
+        walked = _walk(tokens, item_start, item_end)
+        if walked is None or walked[0]:
+            return None
+        # GROUP BY, HAVING and ORDER BY may name a result column by its alias
+        group_by |= walked[1] - aliases
+    columns |= group_by
+
+    for name in ("HAVING", "ORDER"):
+        if name in clauses:
+            walked = _walk(tokens, *clauses[name])
+            if walked is None:
+                return None
+            aggregates += walked[0]
+            columns |= walked[1] - aliases
+            output_columns |= walked[1] - aliases
+
+    return AggregateQuery(
+        query=query,
+        table=_identifier(table_token),
+        table_start=table_token[2],
+        table_end=table_token[3],
+        distinct=distinct,
+        select_items=select_items,
+        aggregates=aggregates,
+        columns=columns,
+        output_columns=output_columns,
+        group_by=group_by,
+        has_group_by="GROUP" in clauses,
+        clauses=_clause_spans(tokens, clauses),
+    )
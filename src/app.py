@@ -1,53 +1,93 @@
 import asyncio
+import hashlib
+import json
 import logging
 import os
+import time
 from contextlib import suppress
-from pathlib import Path
-from typing import Any, Callable, Dict
+from typing import Any, Callable, Coroutine, Dict
 
 import chainlit as cl
 import openai
 from chainlit.config import config
 from dotenv import load_dotenv
-from openai import AsyncAzureOpenAI, AzureOpenAI
 
-from event_handler import EventHandler
+from admission_controller import AdmissionController
+from attachment_uploader import AttachmentUploader
+from openai_client import get_async_openai_client, response_hooks
+from run_driver import RunDriver
 from sales_data import SalesData
+from telemetry import record, register_metric, render_metrics, span, turns
+from thread_pool import WarmThreadPool
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv("src/.env", override=True)
 
-AZURE_OPENAI_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT")
-AZURE_OPENAI_API_KEY = os.environ.get("AZURE_OPENAI_API_KEY")
-AZURE_OPENAI_API_VERSION = os.environ.get("AZURE_OPENAI_API_VERSION")
 AZURE_OPENAI_ASSISTANT_ID = os.environ.get("AZURE_OPENAI_ASSISTANT_ID")
 AZURE_OPENAI_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT")
 ASSISTANT_PASSWORD = os.getenv("ASSISTANT_PASSWORD")
 
 MAX_COMPLETION_TOKENS = 4096
 MAX_PROMPT_TOKENS = 10240
+ASSISTANT_NAME = "Contoso Sales Assistant"
+# Assistant metadata key used to skip redundant assistants.update calls
+CONFIG_FINGERPRINT_KEY = "config_fingerprint"
+# Delays before each attempt to cancel an unfinished run
+CANCEL_RETRY_DELAYS = (0, 0.25, 0.5, 1)
+# Runs rely on the instructions stored on the assistant and only send per-session additional_instructions.
+# Set to true to also re-send the full instructions with every run, as earlier versions did.
+SEND_RUN_INSTRUCTIONS = os.getenv("SEND_RUN_INSTRUCTIONS", "false").lower() == "true"
+# Create a new session's thread and its first run in one request rather than three
+CREATE_AND_RUN = os.getenv("CREATE_AND_RUN", "false").lower() == "true"
 
 sales_data = SalesData()
 cl.instrument_openai()
 ASSISTANT_READY = False
-
-sync_openai_client = AzureOpenAI(
-    azure_endpoint=AZURE_OPENAI_ENDPOINT,
-    api_key=AZURE_OPENAI_API_KEY,
-    api_version=AZURE_OPENAI_API_VERSION,
+# Serializes initialization so concurrent first messages await one in-progress initialize()
+initialize_lock = asyncio.Lock()
+assistant = None
+# Duration of the last assistants.update this process made, logged as the time saved when one is skipped
+last_update_ms: int | None = None
+
+# One client per process, so streaming runs, uploads and downloads share its connection pool
+async_openai_client = get_async_openai_client()
+
+attachment_uploader = AttachmentUploader(async_openai_client)
+thread_pool = WarmThreadPool(async_openai_client)
+# Queues runs within the deployment's rate limits, following the rate limit headers of every response
+admission_controller = AdmissionController()
+response_hooks.append(admission_controller.observe)
+
+register_metric("admission_queue_depth", "Runs waiting for admission.", admission_controller.queue_depth)
+register_metric("admission_running_runs", "Runs admitted and not yet finished.", lambda: admission_controller.running)
+register_metric("warm_threads", "Pre-created threads ready for new sessions.", lambda: thread_pool.available)
+register_metric(
+    "db_pool_idle_connections", "Idle database connections.", lambda: sales_data.pool and sales_data.pool.idle
 )
-
-assistant = sync_openai_client.beta.assistants.retrieve(
-    assistant_id=AZURE_OPENAI_ASSISTANT_ID,
+register_metric(
+    "db_snapshot_switches_total", "Database snapshots switched to.", lambda: sales_data.snapshot_switches, "counter"
 )
-
-async_openai_client = AsyncAzureOpenAI(
-    azure_endpoint=AZURE_OPENAI_ENDPOINT,
-    api_key=AZURE_OPENAI_API_KEY,
-    api_version=AZURE_OPENAI_API_VERSION,
+register_metric(
+    "query_cache_hit_rate", "Share of queries answered from the query cache.", sales_data.query_cache.hit_rate
+)
+register_metric("query_cache_entries", "Results held in the query cache.", lambda: sales_data.query_cache.stats.entries)
+register_metric(
+    "query_cache_hits_total",
+    "Queries answered from the query cache.",
+    lambda: sales_data.query_cache.stats.hits,
+    "counter",
 )
+register_metric(
+    "query_cache_misses_total",
+    "Queries run against the database.",
+    lambda: sales_data.query_cache.stats.misses,
+    "counter",
+)
+
+# References to fire-and-forget tasks, so they aren't garbage collected before they finish
+background_tasks: set[asyncio.Task] = set()
 
 function_map: Dict[str, Callable[[Any], str]] = {
     "ask_database": lambda args: sales_data.ask_database(query=args.get("query")),
@@ -65,13 +105,70 @@ async def auth_callback(username: str, password: str) -> cl.User | None:
     return None
 
 
+def run_in_background(coroutine: Coroutine) -> asyncio.Task:
+    """Run a coroutine as a task without awaiting it."""
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def get_config_fingerprint(model: str, instructions: str, tools: list) -> str:
+    """Return a content hash of everything initialize() pushes to the assistant."""
+    config_json = json.dumps(
+        {"name": ASSISTANT_NAME, "model": model, "instructions": instructions, "tools": tools}, sort_keys=True
+    )
+    return hashlib.sha256(config_json.encode("utf-8")).hexdigest()
+
+
 async def initialize() -> None:
-    """Initialize the assistant with the sales data schema and instructions."""
-    global ASSISTANT_READY
+    """Initialize the assistant with the sales data schema and instructions.
+
+    Runs as a startup task from main.py and is awaited again by the first messages. Callers that arrive
+    while initialization is in progress wait for it rather than starting another one.
+    """
     if ASSISTANT_READY:
         return
 
-    await sales_data.connect()
+    async with initialize_lock:
+        if ASSISTANT_READY:
+            return
+        await _initialize()
+
+
+async def _initialize() -> None:
+    global ASSISTANT_READY
+
+    if sales_data.pool is None:
+        await sales_data.connect()
+    if sales_data.pool is None:
+        logger.error("An error occurred initializing the assistant: the sales database is not available.")
+        return
+
+    try:
+        await configure_assistant()
+        ASSISTANT_READY = True
+        thread_pool.refill()
+    except openai.NotFoundError as e:
+        logger.error("Assistant not found: %s", str(e))
+    except Exception as e:
+        logger.error("An error occurred initializing the assistant: %s", str(e))
+
+
+async def refresh_assistant_schema() -> None:
+    """Re-send the instructions after a new database snapshot is served, if its schema digest changed them."""
+    async with initialize_lock:
+        if ASSISTANT_READY:
+            await configure_assistant()
+
+
+sales_data.on_switch = refresh_assistant_schema
+
+
+async def configure_assistant() -> None:
+    """Update the assistant's instructions, with the database schema, and tools unless they are unchanged."""
+    global assistant, last_update_ms
+
     database_schema_string = await sales_data.get_database_info()
 
     env = os.getenv("ENV", "development")
@@ -124,21 +221,38 @@ async def initialize() -> None:
         },
     ]
 
-    try:
-        sync_openai_client.beta.assistants.update(
-            assistant_id=assistant.id,
-            name="Contoso Sales Assistant",
+    fingerprint = get_config_fingerprint(AZURE_OPENAI_DEPLOYMENT, instructions, tools_list)
+    start = time.perf_counter()
+    current = await async_openai_client.beta.assistants.retrieve(assistant_id=AZURE_OPENAI_ASSISTANT_ID)
+    retrieve_ms = round((time.perf_counter() - start) * 1000)
+    metadata = dict(current.metadata or {})
+
+    if metadata.get(CONFIG_FINGERPRINT_KEY) == fingerprint:
+        # Nothing changed since the last update, so don't re-send the instructions and tools. Without an
+        # update made by this process to go by, the saving is taken to be a round trip like the retrieve.
+        assistant = current
+        logger.info(
+            "Assistant configuration unchanged, skipped assistants.update (saved ~%d ms).",
+            retrieve_ms if last_update_ms is None else last_update_ms,
+        )
+    else:
+        metadata[CONFIG_FINGERPRINT_KEY] = fingerprint
+        start = time.perf_counter()
+        assistant = await async_openai_client.beta.assistants.update(
+            assistant_id=AZURE_OPENAI_ASSISTANT_ID,
+            name=ASSISTANT_NAME,
             model=AZURE_OPENAI_DEPLOYMENT,
             instructions=instructions,
-            tools=tools_list
+            tools=tools_list,
+            metadata=metadata,
         )
+        update_seconds = time.perf_counter() - start
+        # Also in the stage duration histogram, so the cost of updates shows in /metrics
+        record("assistant_update", update_seconds)
+        last_update_ms = round(update_seconds * 1000)
+        logger.info("Assistant configuration changed, assistants.update took %d ms.", last_update_ms)
 
-        config.ui.name = assistant.name
-        ASSISTANT_READY = True
-    except openai.NotFoundError as e:
-        logger.error("Assistant not found: %s", str(e))
-    except Exception as e:
-        logger.error("An error occurred initializing the assistant: %s", str(e))
+    config.ui.name = assistant.name
 
 
 @cl.set_starters
@@ -168,111 +282,212 @@ async def set_starters() -> list[cl.Starter]:
     ]
 
 
-async def get_thread_id(async_openai_client: AsyncAzureOpenAI) -> str:
+async def get_thread_id() -> str:
     """Get the thread ID for the conversation"""
     if thread := cl.user_session.get("thread_id"):
         return thread
 
     try:
-        thread = await async_openai_client.beta.threads.create()
-        cl.user_session.set("thread_id", thread.id)
+        # Taken from the warm pool, so a new session doesn't wait on threads.create
+        thread_id = await thread_pool.take()
+        cl.user_session.set("thread_id", thread_id)
         # await cl.Message(content="New thread created.").send()
-        return thread.id
+        return thread_id
     except Exception as e:
         await cl.Message(content=str(e)).send()
         return None
 
 
-async def cancel_thread_run(thread_id: str) -> None:
-    """Cancel all runs in a thread"""
-    if not thread_id:
-        return
+def get_additional_instructions() -> str | None:
+    """Get the per-session instructions sent with each run, such as the user's locale and role"""
+    if additional_instructions := cl.user_session.get("additional_instructions"):
+        return additional_instructions
 
-    # Wait a moment for any pending runs to spin up for cleaner cancellation
-    await asyncio.sleep(2)
-    runs = await async_openai_client.beta.threads.runs.list(thread_id=thread_id)
-    for run in runs.data:
-        if run.status not in ["completed", "cancelled", "expired", "failed"]:
-            with suppress(Exception):
-                await client.beta.threads.runs.cancel(run_id=run.id, thread_id=thread_id)
+    session_instructions = []
+    # Accept-Language header from the browser, for example "nl-NL,nl;q=0.9,en;q=0.8"
+    if languages := cl.user_session.get("languages"):
+        locale = languages.split(",")[0].split(";")[0].strip()
+        if locale:
+            session_instructions.append(f"The user's locale is {locale}.")
+
+    user = cl.user_session.get("user")
+    if user and (role := user.metadata.get("role")):
+        session_instructions.append(f"The user's role is {role}.")
 
+    additional_instructions = " ".join(session_instructions) or None
+    cl.user_session.set("additional_instructions", additional_instructions)
+    return additional_instructions
+
+
+async def cancel_thread_run(thread_id: str, run_id: str | None = None) -> None:
+    """Cancel the run, or if its id isn't known yet, any active runs in the thread"""
+    if not thread_id:
+        return
 
-async def get_attachments(message: cl.Message, async_openai_client: AsyncAzureOpenAI) -> Dict:
+    for attempt, delay in enumerate(CANCEL_RETRY_DELAYS):
+        await asyncio.sleep(delay)
+        try:
+            if run_id:
+                run = await async_openai_client.beta.threads.runs.cancel(run_id=run_id, thread_id=thread_id)
+                logger.info("Run %s cancelled on attempt %d, status %s.", run_id, attempt + 1, run.status)
+                return
+
+            # The run may still be spinning up, so retry the listing a few times
+            runs = await async_openai_client.beta.threads.runs.list(thread_id=thread_id, limit=5)
+            for run in runs.data:
+                if run.status not in ["completed", "cancelled", "cancelling", "expired", "failed", "incomplete"]:
+                    with suppress(openai.BadRequestError):
+                        await async_openai_client.beta.threads.runs.cancel(run_id=run.id, thread_id=thread_id)
+                    logger.info("Run %s cancelled on attempt %d.", run.id, attempt + 1)
+                    return
+        except openai.BadRequestError:
+            # The run already finished, or is already being cancelled
+            return
+        except Exception as e:
+            logger.warning("Cancelling the run failed on attempt %d: %s", attempt + 1, str(e))
+
+
+async def get_attachments(message: cl.Message) -> Dict:
     """Upload attachments to the assistant"""
-    file_paths = [file.path for file in message.elements]
-    if not file_paths:
+    files = [(file.path, file.name) for file in message.elements if file.path]
+    if not files:
         return None
 
     await cl.Message(content="Uploading files.").send()
     message_files = []
 
-    for path in file_paths:
-        with Path(path).open("rb") as file:
-            uploaded_file = await async_openai_client.files.create(file=file, purpose="assistants")
-            message_files.append({"file_id": uploaded_file.id, "tools": [{"type": "file_search"}]})
+    # Uploads run concurrently and each one returns as soon as its file is ready
+    file_ids = await attachment_uploader.upload_all(files)
+    for (_, name), file_id in zip(files, file_ids):
+        if isinstance(file_id, BaseException):
+            logger.error("Uploading %s failed: %s", name, str(file_id))
+            await cl.Message(content=f"Uploading {name} failed: {file_id}").send()
+        else:
+            message_files.append({"file_id": file_id, "tools": [{"type": "file_search"}]})
 
-    # Wait a moment for the uploaded files to become available
-    await asyncio.sleep(2)
     await cl.Message(content="Uploading completed.").send()
-    return message_files
+    return message_files or None
+
+
+class QueueNotice:
+    """Shows the user their place in the queue while their run waits for its turn"""
+
+    def __init__(self: "QueueNotice") -> None:
+        self.message: cl.Message | None = None
+
+    async def show(self: "QueueNotice", position: int) -> None:
+        content = f"The assistant is busy. You are number {position} in the queue."
+        if self.message is None:
+            self.message = await cl.Message(content=content).send()
+        else:
+            self.message.content = content
+            await self.message.update()
+
+    async def remove(self: "QueueNotice") -> None:
+        if self.message is not None:
+            with suppress(Exception):
+                await self.message.remove()
+            self.message = None
 
 
 @cl.on_message
 async def main(message: cl.Message) -> None:
     """Handle the conversation with the assistant"""
     completed = False
+    outcome = "error"
+    turn_started = time.perf_counter()
+    run_driver = None
+    queue_notice = QueueNotice()
 
-    if assistant is None:
+    await initialize()
+
+    if not ASSISTANT_READY:
         await cl.Message(content="An error occurred initializing the assistant.").send()
         logger.error("Assistant not initialized.")
         return
 
-    await initialize()
-
-    thread_id = await get_thread_id(async_openai_client)
+    # With create-and-run, a new session's thread is created together with its first run
+    create_and_run = CREATE_AND_RUN and not cl.user_session.get("thread_id")
+    with span("thread_lookup"):
+        thread_id = None if create_and_run else await get_thread_id()
 
-    if not thread_id:
+    if not thread_id and not create_and_run:
         await cl.Message(content="A thread wa not successfully created.").send()
         logger.error("Thread not successfully created.")
         return
 
     try:
-        message_files = await get_attachments(message, async_openai_client)
-
-        # Add a Message to the Thread
-        await async_openai_client.beta.threads.messages.create(
-            thread_id=thread_id,
-            role="user",
-            content=message.content,
-            attachments=message_files,
-        )
-
-        # Create and Stream a Run
-        async with async_openai_client.beta.threads.runs.stream(
-            thread_id=thread_id,
-            assistant_id=assistant.id,
-            event_handler=EventHandler(
-                function_map=function_map,
-                assistant_name=assistant.name,
-                async_openai_client=async_openai_client,
-            ),
-            temperature=0.2,
-            max_completion_tokens=MAX_COMPLETION_TOKENS,
-            max_prompt_tokens=MAX_PROMPT_TOKENS,
-            instructions=assistant.instructions
-        ) as stream:
-            await stream.until_done()
+        with span("attachment_upload", files=len(message.elements)):
+            message_files = await get_attachments(message)
+
+        user_message = {"role": "user", "content": message.content}
+        if message_files:
+            user_message["attachments"] = message_files
+        new_thread = None
+        if create_and_run:
+            new_thread = {"messages": [user_message]}
+        else:
+            # Add a Message to the Thread
+            with span("message_create"):
+                await async_openai_client.beta.threads.messages.create(thread_id=thread_id, **user_message)
+
+        # The assistant already holds the full instructions, so only the session specific ones are sent
+        run_instructions = {}
+        additional_instructions = get_additional_instructions()
+        if create_and_run and additional_instructions:
+            # create-and-run doesn't take additional instructions, so this first run carries the full instructions
+            run_instructions["instructions"] = f"{assistant.instructions}\n{additional_instructions}"
+        elif additional_instructions:
+            run_instructions["additional_instructions"] = additional_instructions
+        if SEND_RUN_INSTRUCTIONS and "instructions" not in run_instructions:
+            run_instructions["instructions"] = assistant.instructions
+
+        # Wait for a turn within the rate limits; the run is budgeted at its prompt and completion token caps
+        queued = time.perf_counter()
+        async with admission_controller.admit(
+            cl.context.session.id, MAX_PROMPT_TOKENS + MAX_COMPLETION_TOKENS, queue_notice.show
+        ) as admission:
+            record("admission_wait", time.perf_counter() - queued)
+            await queue_notice.remove()
+
+            # Create and Stream a Run, resuming it with tool outputs until it completes
+            run_driver = RunDriver(async_openai_client, function_map, assistant.name)
+            await run_driver.run(
+                thread_id=thread_id,
+                assistant_id=assistant.id,
+                thread=new_thread,
+                temperature=0.2,
+                max_completion_tokens=MAX_COMPLETION_TOKENS,
+                max_prompt_tokens=MAX_PROMPT_TOKENS,
+                **run_instructions,
+            )
+            admission.used_tokens = run_driver.total_tokens
 
         completed = True
+        outcome = "completed"
 
     # triggered when the user stops a chat
     except asyncio.exceptions.CancelledError:
-        pass
+        outcome = "cancelled"
+
+    except openai.RateLimitError as e:
+        outcome = "rate_limited"
+        # Only reached when the client's retries ran out as well
+        await cl.Message(content="The assistant is at capacity. Please try again in a moment.").send()
+        logger.error("Rate limited calling the LLM: %s", str(e))
 
     except Exception as e:
+        outcome = "error"
         await cl.Message(content=f"An error occurred: {e}").send()
         await cl.Message(content="Please try again in a moment.").send()
         logger.error("An error calling the LLM occurred: %s", str(e))
     finally:
+        record("turn", time.perf_counter() - turn_started, outcome=outcome)
+        turns.inc(outcome)
+        await queue_notice.remove()
+        if create_and_run and run_driver and run_driver.thread_id:
+            thread_id = run_driver.thread_id
+            cl.user_session.set("thread_id", thread_id)
         if not completed:
-            await cancel_thread_run(thread_id)
+            # In the background, so the user's next message isn't held up by the cancellation
+            run_in_background(cancel_thread_run(thread_id, run_driver.run_id if run_driver else None))
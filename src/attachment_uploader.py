@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import openai
+from openai import AsyncAzureOpenAI
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+UPLOAD_READY_TIMEOUT_SECONDS = float(os.getenv("UPLOAD_READY_TIMEOUT_SECONDS", "60"))
+UPLOAD_POLL_INITIAL_SECONDS = 0.1
+UPLOAD_POLL_MAX_SECONDS = 2.0
+# Uploaded file ids remembered by content hash, so the same document isn't uploaded twice
+UPLOAD_CACHE_SIZE = 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+def file_digest(path: str) -> str:
+    """Return the sha256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AttachmentUploader:
+    """Uploads message attachments concurrently and waits until the files are ready for the assistant.
+
+    Files are identified by the sha256 of their content. A file that was uploaded before, or is being
+    uploaded by another message right now, reuses that upload's file id. Readiness is polled with
+    exponential backoff rather than waiting a fixed time.
+    """
+
+    def __init__(
+        self: "AttachmentUploader",
+        async_openai_client: AsyncAzureOpenAI,
+        concurrency: int = UPLOAD_CONCURRENCY,
+        ready_timeout_seconds: float = UPLOAD_READY_TIMEOUT_SECONDS,
+    ) -> None:
+        self.async_openai_client = async_openai_client
+        self.ready_timeout_seconds = ready_timeout_seconds
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._file_ids: OrderedDict[str, str] = OrderedDict()
+        self._uploads: dict[str, asyncio.Task] = {}
+
+    async def _wait_until_ready(self: "AttachmentUploader", file_id: str) -> None:
+        deadline = asyncio.get_running_loop().time() + self.ready_timeout_seconds
+        delay = UPLOAD_POLL_INITIAL_SECONDS
+        while True:
+            uploaded_file = await self.async_openai_client.files.retrieve(file_id)
+            if uploaded_file.status == "processed":
+                return
+            if uploaded_file.status == "error":
+                raise UploadError(uploaded_file.status_details or "The file could not be processed.")
+            if asyncio.get_running_loop().time() + delay > deadline:
+                raise UploadError(f"The file was not ready after {self.ready_timeout_seconds:g} seconds.")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, UPLOAD_POLL_MAX_SECONDS)
+
+    async def _upload(self: "AttachmentUploader", path: str, name: str, digest: str) -> str:
+        async with self._semaphore:
+            # The file handle is passed to the client, which streams the body rather than reading it whole
+            with Path(path).open("rb") as file:
+                uploaded_file = await self.async_openai_client.files.create(file=(name, file), purpose="assistants")
+            await self._wait_until_ready(uploaded_file.id)
+
+        self._file_ids[digest] = uploaded_file.id
+        while len(self._file_ids) > UPLOAD_CACHE_SIZE:
+            self._file_ids.popitem(last=False)
+        return uploaded_file.id
+
+    async def _is_available(self: "AttachmentUploader", file_id: str) -> bool:
+        try:
+            uploaded_file = await self.async_openai_client.files.retrieve(file_id)
+        except openai.NotFoundError:
+            return False
+        return uploaded_file.status == "processed"
+
+    async def upload(self: "AttachmentUploader", path: str, name: str) -> str:
+        """Upload a file, or reuse an earlier upload of the same content, and return its file id."""
+        digest = await asyncio.to_thread(file_digest, path)
+
+        if (file_id := self._file_ids.get(digest)) is not None:
+            if await self._is_available(file_id):
+                self._file_ids.move_to_end(digest)
+                logger.info("Reusing uploaded file %s for %s.", file_id, name)
+                return file_id
+            self._file_ids.pop(digest, None)
+
+        if (upload := self._uploads.get(digest)) is None:
+            upload = asyncio.create_task(self._upload(path, name, digest))
+            self._uploads[digest] = upload
+            upload.add_done_callback(lambda _: self._uploads.pop(digest, None))
+        # Shielded, so one message giving up doesn't cancel an upload another message is waiting on
+        return await asyncio.shield(upload)
+
+    async def upload_all(self: "AttachmentUploader", files: list[tuple[str, str]]) -> list[str | BaseException]:
+        """Upload (path, name) pairs concurrently, returning a file id or the exception for each one."""
+        return await asyncio.gather(*[self.upload(path, name) for path, name in files], return_exceptions=True)
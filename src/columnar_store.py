@@ -0,0 +1,663 @@
+import logging
+import os
+import re
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from aggregate_query import AggregateCall, AggregateQuery, parse_aggregate_query
+from query_cache import SQL_KEYWORDS, tokenize_sql
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Loads sales_data into memory at connect; needs about 50 bytes a row
+COLUMNAR_ENABLED = os.getenv("COLUMNAR_ENABLED", "false").lower() == "true"
+COLUMNAR_TABLE = "sales_data"
+LOAD_BATCH_SIZE = 65536
+# Integer columns spanning at most this many values are also dictionary encoded, so they can be grouped by
+INTEGER_DICTIONARY_RANGE = 1 << 16
+# Up to this many possible groups are counted in a dense array rather than by sorting the group keys
+DENSE_GROUPS_LIMIT = 1 << 20
+# Sums of whole numbers are exact in a double up to here, as they are in SQLite's 64-bit integers
+EXACT_SUM_LIMIT = 2**53
+
+TEXT = "text"
+INTEGER = "integer"
+REAL = "real"
+# Whole numbers stored as integers and the rest as reals, as in a column with INTEGER affinity
+MIXED = "mixed"
+
+COMPARISONS = {"=": "==", "==": "==", "!=": "!=", "<>": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+FLIPPED = {"==": "==", "!=": "!=", "<": ">", "<=": ">=", ">": "<", ">=": "<="}
+
+Token = tuple[str, str, int, int]
+
+
+class UnsupportedQueryError(Exception):
+    """Raised for a query the columnar store can't answer exactly as SQLite would."""
+
+
+def _affinity(declared_type: str) -> str | None:
+    """Return the column affinity SQLite gives a declared type, or None for BLOB and no type."""
+    declared_type = declared_type.upper()
+    if "INT" in declared_type:
+        return INTEGER
+    if any(name in declared_type for name in ("CHAR", "CLOB", "TEXT")):
+        return TEXT
+    if not declared_type or "BLOB" in declared_type:
+        return None
+    if any(name in declared_type for name in ("REAL", "FLOA", "DOUB")):
+        return REAL
+    # NUMERIC affinity stores values the same way as INTEGER affinity
+    return INTEGER
+
+
+def _compare(values: np.ndarray, operator: str, literal: object) -> np.ndarray:
+    if operator == "==":
+        return values == literal
+    if operator == "!=":
+        return values != literal
+    if operator == "<":
+        return values < literal
+    if operator == "<=":
+        return values <= literal
+    if operator == ">":
+        return values > literal
+    return values >= literal
+
+
+def _like_pattern(pattern: str) -> re.Pattern:
+    """Translate a LIKE pattern; like SQLite, only ASCII letters match regardless of case."""
+    expression = "".join(".*" if char == "%" else "." if char == "_" else re.escape(char) for char in pattern)
+    return re.compile(expression, re.IGNORECASE | re.ASCII | re.DOTALL)
+
+
+class _Encoder(dict):
+    """Map each distinct value to a code, numbering new values as they are first seen."""
+
+    def __missing__(self: "_Encoder", value: object) -> int:
+        code = self[value] = len(self)
+        return code
+
+
+class Vector:
+    """The values of a column or aggregate: numbers, or codes into a sorted dictionary of strings.
+
+    For MIXED values, `whole` marks the ones SQLite returns as integers.
+    """
+
+    def __init__(
+        self: "Vector",
+        kind: str,
+        values: np.ndarray | None = None,
+        codes: np.ndarray | None = None,
+        dictionary: np.ndarray | None = None,
+        whole: np.ndarray | None = None,
+    ) -> None:
+        self.kind = kind
+        self.values = values
+        self.codes = codes
+        self.dictionary = dictionary
+        self.whole = whole
+
+    def take(self: "Vector", rows: np.ndarray) -> "Vector":
+        return Vector(
+            self.kind,
+            values=None if self.values is None else self.values[rows],
+            codes=None if self.codes is None else self.codes[rows],
+            dictionary=self.dictionary,
+            whole=None if self.whole is None else self.whole[rows],
+        )
+
+    def sort_key(self: "Vector", descending: bool) -> np.ndarray:
+        # Dictionaries are sorted, so codes order like the strings they stand for
+        key = self.codes.astype(np.int64) if self.kind == TEXT else self.values
+        return -key if descending else key
+
+    def to_list(self: "Vector") -> list:
+        if self.kind == TEXT:
+            return self.dictionary[self.codes].tolist()
+        if self.kind == MIXED:
+            whole = self.whole if self.whole is not None else self.values == np.floor(self.values)
+            return [int(value) if is_whole else value for value, is_whole in zip(self.values.tolist(), whole)]
+        return self.values.tolist()
+
+
+class Column:
+    """A column of the table held as a NumPy array, with a dictionary encoding when it can be grouped by."""
+
+    def __init__(
+        self: "Column",
+        name: str,
+        kind: str,
+        values: np.ndarray | None = None,
+        codes: np.ndarray | None = None,
+        dictionary: np.ndarray | None = None,
+    ) -> None:
+        self.name = name
+        self.kind = kind
+        self.values = values
+        self.codes = codes
+        self.dictionary = dictionary
+        # Whether sums of the column are exact in a double
+        self.exact_sum = kind == TEXT or bool(np.abs(values.astype(np.float64)).sum() < EXACT_SUM_LIMIT)
+
+    @property
+    def groupable(self: "Column") -> bool:
+        return self.codes is not None
+
+    @property
+    def nbytes(self: "Column") -> int:
+        return sum(array.nbytes for array in (self.values, self.codes) if array is not None)
+
+    def vector(self: "Column") -> Vector:
+        return Vector(self.kind, values=self.values, codes=self.codes, dictionary=self.dictionary)
+
+
+class _Groups:
+    """The rows left by WHERE, split into groups numbered in the order of their GROUP BY values."""
+
+    def __init__(self: "_Groups", rows: np.ndarray | None, inverse: np.ndarray, count: int) -> None:
+        # None when every row is selected
+        self.rows = rows
+        self.inverse = inverse
+        self.count = count
+        self.keys: dict[str, Vector] = {}
+
+
+class _ConditionParser:
+    """Evaluate a WHERE or HAVING condition into a mask, by recursive descent over its tokens.
+
+    Supports AND, OR, NOT and parentheses over comparisons of an operand with literals: =, !=, <, <=, >,
+    >=, IN, BETWEEN and LIKE. The table has no NULLs, so the conditions are two-valued.
+    """
+
+    def __init__(self: "_ConditionParser", tokens: list[Token], operand: Callable[[int], tuple[Vector, int]]) -> None:
+        self.tokens = tokens
+        # Called with a token index, returns the operand's vector and the index after it
+        self.operand = operand
+        self.index = 0
+
+    def peek(self: "_ConditionParser", offset: int = 0) -> str:
+        index = self.index + offset
+        return self.tokens[index][1].upper() if index < len(self.tokens) else ""
+
+    def expect(self: "_ConditionParser", text: str) -> None:
+        if self.peek() != text:
+            raise UnsupportedQueryError(f"Expected {text} in the condition.")
+        self.index += 1
+
+    def parse(self: "_ConditionParser") -> np.ndarray:
+        mask = self.parse_or()
+        if self.index != len(self.tokens):
+            raise UnsupportedQueryError("Unsupported condition.")
+        return mask
+
+    def parse_or(self: "_ConditionParser") -> np.ndarray:
+        mask = self.parse_and()
+        while self.peek() == "OR":
+            self.index += 1
+            mask = mask | self.parse_and()
+        return mask
+
+    def parse_and(self: "_ConditionParser") -> np.ndarray:
+        mask = self.parse_not()
+        while self.peek() == "AND":
+            self.index += 1
+            mask = mask & self.parse_not()
+        return mask
+
+    def parse_not(self: "_ConditionParser") -> np.ndarray:
+        if self.peek() == "NOT":
+            self.index += 1
+            return ~self.parse_not()
+        if self.peek() == "(":
+            self.index += 1
+            mask = self.parse_or()
+            self.expect(")")
+            return mask
+        return self.parse_predicate()
+
+    def parse_literal(self: "_ConditionParser") -> object:
+        sign = 1
+        if self.peek() in ("-", "+"):
+            sign = -1 if self.peek() == "-" else 1
+            self.index += 1
+            if self.index >= len(self.tokens) or self.tokens[self.index][0] != "number":
+                raise UnsupportedQueryError("Unsupported literal.")
+        if self.index >= len(self.tokens):
+            raise UnsupportedQueryError("Missing literal.")
+        kind, text, _, _ = self.tokens[self.index]
+        self.index += 1
+        if kind == "number":
+            is_integer = not any(char in text for char in ".eE")
+            return sign * (int(text) if is_integer else float(text))
+        if kind == "string" and len(text) > 1 and text.endswith("'"):
+            return text[1:-1].replace("''", "'")
+        raise UnsupportedQueryError("Unsupported literal.")
+
+    def is_literal(self: "_ConditionParser") -> bool:
+        if self.index >= len(self.tokens):
+            return False
+        kind, text, _, _ = self.tokens[self.index]
+        return kind in ("number", "string") or text in ("-", "+")
+
+    def compare(self: "_ConditionParser", vector: Vector, operator: str, literal: object) -> np.ndarray:
+        if isinstance(literal, str) != (vector.kind == TEXT):
+            # SQLite would convert the literal to the column's affinity first
+            raise UnsupportedQueryError("Comparison between text and a number.")
+        if vector.kind == TEXT:
+            return _compare(vector.dictionary, operator, literal).astype(bool)[vector.codes]
+        return _compare(vector.values, operator, literal)
+
+    def parse_predicate(self: "_ConditionParser") -> np.ndarray:
+        if self.is_literal():
+            literal = self.parse_literal()
+            operator = COMPARISONS.get(self.peek())
+            if operator is None:
+                raise UnsupportedQueryError("Unsupported comparison.")
+            self.index += 1
+            vector, self.index = self.operand(self.index)
+            return self.compare(vector, FLIPPED[operator], literal)
+
+        vector, self.index = self.operand(self.index)
+        if operator := COMPARISONS.get(self.peek()):
+            self.index += 1
+            return self.compare(vector, operator, self.parse_literal())
+
+        negate = self.peek() == "NOT"
+        if negate:
+            self.index += 1
+        keyword = self.peek()
+        self.index += 1
+        if keyword == "BETWEEN":
+            low = self.parse_literal()
+            self.expect("AND")
+            high = self.parse_literal()
+            mask = self.compare(vector, ">=", low) & self.compare(vector, "<=", high)
+        elif keyword == "IN":
+            self.expect("(")
+            literals = [self.parse_literal()]
+            while self.peek() == ",":
+                self.index += 1
+                literals.append(self.parse_literal())
+            self.expect(")")
+            mask = np.zeros(len(vector.codes if vector.kind == TEXT else vector.values), dtype=bool)
+            for literal in literals:
+                mask |= self.compare(vector, "==", literal)
+        elif keyword == "LIKE" and vector.kind == TEXT and self.peek() != "ESCAPE":
+            pattern = self.parse_literal()
+            if not isinstance(pattern, str) or self.peek() == "ESCAPE":
+                raise UnsupportedQueryError("Unsupported LIKE pattern.")
+            like = _like_pattern(pattern)
+            # Matched once per distinct value rather than once per row
+            matches = np.array([like.fullmatch(value) is not None for value in vector.dictionary], dtype=bool)
+            mask = matches[vector.codes]
+        else:
+            raise UnsupportedQueryError("Unsupported condition.")
+        return ~mask if negate else mask
+
+
+class ColumnarStore:
+    """sales_data held in memory as NumPy columns, for aggregate queries answered with vectorized kernels.
+
+    Text columns, and integer columns over a small range, are dictionary encoded into sorted dictionaries,
+    so filters on them compare each distinct value once and grouping works on small integer codes. Queries
+    are answered only when the result matches SQLite's; anything else raises UnsupportedQueryError or
+    returns None, and should run on SQLite. Sums of fractional values may differ from SQLite's in the
+    last bits, as the rows of a group can be added in a different order.
+    """
+
+    def __init__(self: "ColumnarStore") -> None:
+        self.columns: dict[str, Column] = {}
+        self.row_count = 0
+
+    @property
+    def enabled(self: "ColumnarStore") -> bool:
+        return bool(self.columns)
+
+    @property
+    def nbytes(self: "ColumnarStore") -> int:
+        return sum(column.nbytes for column in self.columns.values())
+
+    def load(self: "ColumnarStore", db_path: str) -> None:
+        """Read the table into column arrays in one scan.
+
+        Columns with NULLs, or values of another type than their affinity stores, are left out, so
+        queries that use them run on SQLite.
+        """
+        self.columns = {}
+        with closing(sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)) as conn:
+            table_info = conn.execute(f"SELECT name, type FROM pragma_table_info('{COLUMNAR_TABLE}');").fetchall()
+            affinities = {name: _affinity(declared_type) for name, declared_type in table_info}
+            affinities = {name: affinity for name, affinity in affinities.items() if affinity}
+            if not affinities:
+                return
+
+            batches: dict[str, list[np.ndarray] | None] = {name: [] for name in affinities}
+            lookups = {name: _Encoder() for name, affinity in affinities.items() if affinity == TEXT}
+            names = list(affinities)
+            row_count = 0
+            cursor = conn.execute(f"SELECT {', '.join(names)} FROM {COLUMNAR_TABLE} ORDER BY rowid;")
+            while rows := cursor.fetchmany(LOAD_BATCH_SIZE):
+                row_count += len(rows)
+                for name, values in zip(names, zip(*rows)):
+                    if batches[name] is None:
+                        continue
+                    if name in lookups:
+                        batches[name].append(np.array(list(map(lookups[name].__getitem__, values)), dtype=np.int32))
+                        continue
+                    # NumPy infers int64 for integers, float64 once there's a real and anything else for the rest
+                    array = np.array(values)
+                    batches[name] = batches[name] + [array] if array.dtype.kind in "if" else None
+
+        for name, affinity in affinities.items():
+            if batches[name] is None:
+                continue
+            arrays = batches[name] or [np.empty(0, dtype=np.int32 if affinity == TEXT else np.int64)]
+            if affinity == TEXT:
+                words = list(lookups[name])
+                if not all(isinstance(word, str) for word in words):
+                    continue
+                order = sorted(range(len(words)), key=words.__getitem__)
+                recode = np.empty(len(words), dtype=np.int32)
+                recode[order] = np.arange(len(words), dtype=np.int32)
+                dictionary = np.array([words[index] for index in order], dtype=object)
+                codes = recode[np.concatenate(arrays)]
+                self.columns[name.lower()] = Column(name, TEXT, codes=codes, dictionary=dictionary)
+                continue
+
+            integers = all(array.dtype.kind == "i" for array in arrays)
+            kind = REAL if affinity == REAL else INTEGER if integers else MIXED
+            values = np.concatenate(arrays).astype(np.int64 if kind == INTEGER else np.float64)
+            column = Column(name, kind, values=values)
+            if kind == INTEGER and row_count:
+                low, high = int(values.min()), int(values.max())
+                if high - low < INTEGER_DICTIONARY_RANGE:
+                    column.codes = (values - low).astype(np.int32)
+                    column.dictionary = np.arange(low, high + 1, dtype=np.int64)
+            self.columns[name.lower()] = column
+
+        self.row_count = row_count
+        logger.info(
+            "Loaded %d rows of %s into %d columns (%.1f MB).",
+            row_count,
+            COLUMNAR_TABLE,
+            len(self.columns),
+            self.nbytes / 1024 / 1024,
+        )
+
+    def __column(self: "ColumnarStore", name: str) -> Column:
+        if (column := self.columns.get(name)) is None:
+            raise UnsupportedQueryError(f"Column {name} is not loaded.")
+        return column
+
+    def __filter(self: "ColumnarStore", parsed: AggregateQuery, tokens: list[Token]) -> np.ndarray | None:
+        """Return the rows matching WHERE, or None for all of them."""
+        if "WHERE" not in parsed.clauses:
+            return None
+        where = self.__clause_tokens(parsed, tokens, "WHERE")
+
+        def operand(index: int) -> tuple[Vector, int]:
+            kind, text, _, _ = where[index] if index < len(where) else ("", "", 0, 0)
+            if kind == "quoted" or (kind == "word" and text.upper() not in SQL_KEYWORDS):
+                if index + 1 < len(where) and where[index + 1][1] == "(":
+                    raise UnsupportedQueryError("Functions are not supported.")
+                name = text[1:-1].lower() if kind == "quoted" else text.lower()
+                return self.__column(name).vector(), index + 1
+            raise UnsupportedQueryError("Unsupported operand.")
+
+        mask = _ConditionParser(where, operand).parse()
+        return np.flatnonzero(mask)
+
+    @staticmethod
+    def __clause_tokens(parsed: AggregateQuery, tokens: list[Token], clause: str) -> list[Token]:
+        start, end = parsed.clauses[clause]
+        return [token for token in tokens if start <= token[2] < end]
+
+    def __group(self: "ColumnarStore", rows: np.ndarray | None, group_by: list[str]) -> _Groups:
+        """Number the groups of the selected rows in the order of their GROUP BY values."""
+        row_count = self.row_count if rows is None else len(rows)
+        if not group_by:
+            return _Groups(rows, np.zeros(row_count, dtype=np.int64), 1 if row_count else 0)
+
+        key = np.zeros(row_count, dtype=np.int64)
+        radix = 1
+        columns = [self.__column(name) for name in group_by]
+        for column in columns:
+            if not column.groupable:
+                raise UnsupportedQueryError(f"Column {column.name} can't be grouped by.")
+            codes = column.codes if rows is None else column.codes[rows]
+            key = key * len(column.dictionary) + codes
+            radix *= len(column.dictionary)
+            if radix >= 2**62:
+                raise UnsupportedQueryError("Too many possible groups.")
+
+        if radix <= DENSE_GROUPS_LIMIT:
+            present = np.flatnonzero(np.bincount(key, minlength=radix))
+            slots = np.zeros(radix, dtype=np.int64)
+            slots[present] = np.arange(len(present))
+            group_keys, inverse = present, slots[key]
+        else:
+            group_keys, inverse = np.unique(key, return_inverse=True)
+
+        groups = _Groups(rows, inverse, len(group_keys))
+        for column in reversed(columns):
+            size = len(column.dictionary)
+            codes = group_keys % size
+            group_keys = group_keys // size
+            if column.kind == TEXT:
+                groups.keys[column.name] = Vector(TEXT, codes=codes, dictionary=column.dictionary)
+            else:
+                groups.keys[column.name] = Vector(column.kind, values=column.dictionary[codes])
+        return groups
+
+    def __aggregate(self: "ColumnarStore", call: AggregateCall, groups: _Groups) -> Vector:
+        """Compute an aggregate for every group."""
+        counts = np.bincount(groups.inverse, minlength=groups.count)
+        if call.column is None or (call.function == "COUNT" and not call.distinct):
+            return Vector(INTEGER, values=counts)
+
+        column = self.__column(call.column)
+        source = column.vector() if groups.rows is None else column.vector().take(groups.rows)
+        if call.distinct:
+            if call.function != "COUNT" or not column.groupable:
+                raise UnsupportedQueryError("Unsupported DISTINCT aggregate.")
+            size = len(column.dictionary)
+            pairs = np.unique(groups.inverse * size + source.codes)
+            return Vector(INTEGER, values=np.bincount(pairs // size, minlength=groups.count))
+
+        if call.function in ("MIN", "MAX"):
+            reduce = np.minimum if call.function == "MIN" else np.maximum
+            values = source.codes if column.kind == TEXT else source.values
+            # Every group has a row, so the starting value is always replaced
+            limits = np.iinfo(values.dtype) if values.dtype.kind == "i" else np.finfo(values.dtype)
+            extremes = np.full(groups.count, limits.max if call.function == "MIN" else limits.min, dtype=values.dtype)
+            reduce.at(extremes, groups.inverse, values)
+            if column.kind == TEXT:
+                return Vector(TEXT, codes=extremes, dictionary=column.dictionary)
+            return Vector(column.kind, values=extremes)
+
+        if column.kind == TEXT:
+            raise UnsupportedQueryError("Sums of text are not supported.")
+        # bincount adds each group's weights in row order, one at a time like SQLite does
+        sums = np.bincount(groups.inverse, weights=source.values, minlength=groups.count)
+        if call.function == "AVG":
+            return Vector(REAL, values=sums / counts)
+        if call.function == "TOTAL":
+            return Vector(REAL, values=sums)
+        if column.kind == REAL:
+            return Vector(REAL, values=sums)
+        if not column.exact_sum:
+            raise UnsupportedQueryError(f"Sums of {column.name} may not be exact.")
+        if column.kind == INTEGER:
+            return Vector(INTEGER, values=sums.astype(np.int64))
+        # The sum is an integer when every value added is one
+        fractions = np.bincount(
+            groups.inverse, weights=source.values != np.floor(source.values), minlength=groups.count
+        )
+        return Vector(MIXED, values=sums, whole=fractions == 0)
+
+    @staticmethod
+    def __empty_aggregate(call: AggregateCall) -> object:
+        """Return an aggregate over no rows, as SQLite returns it for a query without GROUP BY."""
+        if call.function == "COUNT":
+            return 0
+        return 0.0 if call.function == "TOTAL" else None
+
+    def __group_by(self: "ColumnarStore", parsed: AggregateQuery, tokens: list[Token]) -> list[str]:
+        if "GROUP" not in parsed.clauses:
+            return []
+        items = self.__split(self.__clause_tokens(parsed, tokens, "GROUP"))
+        aliases = {item.alias.lower(): item for item in parsed.select_items if item.alias}
+        group_by = []
+        for item in items:
+            if len(item) != 1:
+                raise UnsupportedQueryError("Unsupported GROUP BY term.")
+            kind, text, _, _ = item[0]
+            if kind == "number":
+                position = int(text) if text.isdigit() else 0
+                if not 1 <= position <= len(parsed.select_items):
+                    raise UnsupportedQueryError("GROUP BY position out of range.")
+                name = parsed.select_items[position - 1].column
+            else:
+                name = text[1:-1].lower() if kind == "quoted" else text.lower()
+                if name not in self.columns and name in aliases:
+                    name = aliases[name].column
+            if name is None or name not in self.columns:
+                raise UnsupportedQueryError("Unsupported GROUP BY term.")
+            if name not in group_by:
+                group_by.append(name)
+        return group_by
+
+    @staticmethod
+    def __split(tokens: list[Token]) -> list[list[Token]]:
+        items = [[]]
+        depth = 0
+        for token in tokens:
+            depth += {"(": 1, ")": -1}.get(token[1], 0)
+            if token[1] == "," and depth == 0:
+                items.append([])
+            else:
+                items[-1].append(token)
+        return items
+
+    def __limit(self: "ColumnarStore", parsed: AggregateQuery, tokens: list[Token]) -> tuple[int | None, int]:
+        if "LIMIT" not in parsed.clauses:
+            return None, 0
+        texts = [text.upper() for _, text, _, _ in self.__clause_tokens(parsed, tokens, "LIMIT")]
+        numbers = texts[::2]
+        if not all(text.isdigit() for text in numbers) or len(texts) not in (1, 3):
+            raise UnsupportedQueryError("Unsupported LIMIT.")
+        if len(texts) == 1:
+            return int(texts[0]), 0
+        if texts[1] == "OFFSET":
+            return int(texts[0]), int(texts[2])
+        if texts[1] == ",":
+            return int(texts[2]), int(texts[0])
+        raise UnsupportedQueryError("Unsupported LIMIT.")
+
+    def execute(self: "ColumnarStore", query: str) -> tuple[list[str], list[tuple]] | None:
+        """Answer an aggregate query over sales_data, returning the column names and rows.
+
+        Returns None for queries that aren't single-table aggregates over sales_data, and raises
+        UnsupportedQueryError for those using something the store doesn't implement.
+        """
+        if not self.enabled:
+            return None
+        parsed = parse_aggregate_query(query)
+        if parsed is None or parsed.table != COLUMNAR_TABLE or parsed.distinct:
+            return None
+        if not (parsed.aggregates or parsed.has_group_by):
+            return None
+        if parsed.aggregates and not parsed.output_columns <= parsed.group_by:
+            return None
+        for name in parsed.columns | {call.column for call in parsed.aggregates if call.column}:
+            self.__column(name)
+
+        tokens = tokenize_sql(parsed.query)
+        group_by = self.__group_by(parsed, tokens)
+        groups = self.__group(self.__filter(parsed, tokens), group_by)
+        aggregates: dict[tuple, Vector] = {}
+        for call in parsed.aggregates:
+            key = (call.function, call.column, call.distinct)
+            if key not in aggregates:
+                aggregates[key] = self.__aggregate(call, groups)
+        by_offset = {call.start: call for call in parsed.aggregates}
+
+        def call_vector(start: int) -> Vector:
+            call = by_offset[start]
+            return aggregates[(call.function, call.column, call.distinct)]
+
+        items: list[Vector] = []
+        names = []
+        for item in parsed.select_items:
+            if item.column is not None:
+                if item.column not in groups.keys:
+                    raise UnsupportedQueryError(f"Column {item.column} is not grouped by.")
+                items.append(groups.keys[item.column])
+                names.append(item.alias or self.columns[item.column].name)
+            elif item.start in by_offset and by_offset[item.start].end == item.end:
+                items.append(call_vector(item.start))
+                names.append(item.alias or parsed.query[item.start : item.end])
+            else:
+                raise UnsupportedQueryError("Select items must be columns or aggregates.")
+
+        limit, offset = self.__limit(parsed, tokens)
+        if not group_by:
+            if "HAVING" in parsed.clauses:
+                raise UnsupportedQueryError("HAVING without GROUP BY is not supported.")
+            if groups.count == 0:
+                # An aggregate query without GROUP BY returns one row even when no rows match
+                row = tuple(self.__empty_aggregate(by_offset[item.start]) for item in parsed.select_items)
+                return names, [row][offset : None if limit is None else offset + limit]
+
+        aliases = {item.alias.lower(): index for index, item in enumerate(parsed.select_items) if item.alias}
+
+        def operand(clause: list[Token], index: int) -> tuple[Vector, int]:
+            """Resolve an aggregate, a result column alias or a grouped column in HAVING and ORDER BY."""
+            kind, text, start, _ = clause[index] if index < len(clause) else ("", "", -1, 0)
+            if start in by_offset:
+                end = by_offset[start].end
+                while index < len(clause) and clause[index][3] <= end:
+                    index += 1
+                return call_vector(start), index
+            if kind == "quoted" or (kind == "word" and text.upper() not in SQL_KEYWORDS):
+                name = text[1:-1].lower() if kind == "quoted" else text.lower()
+                if name in aliases:
+                    return items[aliases[name]], index + 1
+                if name in groups.keys:
+                    return groups.keys[name], index + 1
+            raise UnsupportedQueryError("Unsupported operand.")
+
+        selected = np.arange(groups.count)
+        if "HAVING" in parsed.clauses:
+            having = self.__clause_tokens(parsed, tokens, "HAVING")
+            selected = np.flatnonzero(_ConditionParser(having, lambda index: operand(having, index)).parse())
+
+        if "ORDER" in parsed.clauses:
+            sort_keys = []
+            for term in self.__split(self.__clause_tokens(parsed, tokens, "ORDER")):
+                descending = bool(term) and term[-1][1].upper() == "DESC"
+                if term and term[-1][1].upper() in ("ASC", "DESC"):
+                    term = term[:-1]
+                if len(term) == 1 and term[0][0] == "number":
+                    position = int(term[0][1]) if term[0][1].isdigit() else 0
+                    if not 1 <= position <= len(items):
+                        raise UnsupportedQueryError("ORDER BY position out of range.")
+                    vector = items[position - 1]
+                else:
+                    vector, end = operand(term, 0)
+                    if end != len(term):
+                        raise UnsupportedQueryError("Unsupported ORDER BY term.")
+                sort_keys.append(vector.sort_key(descending)[selected])
+            # lexsort is stable and sorts by its last key first
+            selected = selected[np.lexsort(sort_keys[::-1])]
+
+        selected = selected[offset : None if limit is None else offset + limit]
+        columns = [item.take(selected).to_list() for item in items]
+        return names, list(zip(*columns))
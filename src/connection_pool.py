@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager, suppress
+from typing import AsyncIterator, Awaitable, Callable
+
+import aiosqlite
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(min(8, os.cpu_count() or 1))))
+DB_POOL_HEALTH_CHECK_SECONDS = float(os.getenv("DB_POOL_HEALTH_CHECK_SECONDS", "30"))
+
+
+class ConnectionPool:
+    """A bounded pool of read-only aiosqlite connections.
+
+    aiosqlite runs every connection on its own worker thread, so leasing connections from a pool lets
+    concurrent queries run side by side instead of queueing behind a single connection.
+    """
+
+    def __init__(
+        self: "ConnectionPool",
+        db_uri: str,
+        size: int = DB_POOL_SIZE,
+        health_check_seconds: float = DB_POOL_HEALTH_CHECK_SECONDS,
+        on_connect: Callable[[aiosqlite.Connection], Awaitable[None]] | None = None,
+    ) -> None:
+        self.db_uri = db_uri
+        self.size = max(1, size)
+        self.health_check_seconds = health_check_seconds
+        self.on_connect = on_connect
+        # Each slot holds an open connection (or None when it needs re-opening) and when it was last used.
+        # LIFO hands out the most recently used connection first, which keeps its page cache warm.
+        self._slots: asyncio.LifoQueue[tuple[aiosqlite.Connection | None, float]] = asyncio.LifoQueue()
+        self._leased: set[aiosqlite.Connection] = set()
+        self._closed = False
+
+    @property
+    def idle(self: "ConnectionPool") -> int:
+        """The number of connections waiting to be leased."""
+        return self._slots.qsize()
+
+    async def open(self: "ConnectionPool") -> None:
+        """Open every connection in the pool, failing fast if the database can't be opened."""
+        for _ in range(self.size):
+            conn = await self._open_connection()
+            self._slots.put_nowait((conn, time.monotonic()))
+
+    async def _open_connection(self: "ConnectionPool") -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.db_uri, uri=True)
+        if self.on_connect:
+            try:
+                await self.on_connect(conn)
+            except BaseException:
+                await self._discard(conn)
+                raise
+        return conn
+
+    async def _is_healthy(self: "ConnectionPool", conn: aiosqlite.Connection) -> bool:
+        try:
+            async with conn.execute("SELECT 1;") as cursor:
+                await cursor.fetchone()
+            return True
+        except Exception as e:
+            logger.warning("Database connection failed health check: %s", str(e))
+            return False
+
+    async def _discard(self: "ConnectionPool", conn: aiosqlite.Connection) -> None:
+        with suppress(Exception):
+            await conn.close()
+
+    async def _checkout(self: "ConnectionPool") -> aiosqlite.Connection:
+        conn, last_used = await self._slots.get()
+        if self._closed:
+            # Pass the wake-up on to the next caller waiting for a connection
+            self._slots.put_nowait((None, 0.0))
+            raise aiosqlite.ProgrammingError("The connection pool is closed.")
+        try:
+            if conn is not None and time.monotonic() - last_used > self.health_check_seconds:
+                if not await self._is_healthy(conn):
+                    await self._discard(conn)
+                    conn = None
+            if conn is None:
+                conn = await self._open_connection()
+                logger.info("Database connection re-opened.")
+        except BaseException:
+            # Give the slot back so a failed re-open doesn't shrink the pool.
+            self._slots.put_nowait((None, 0.0))
+            raise
+        return conn
+
+    async def _checkin(self: "ConnectionPool", conn: aiosqlite.Connection, suspect: bool) -> None:
+        if self._closed:
+            await self._discard(conn)
+            return
+        if suspect and not await self._is_healthy(conn):
+            await self._discard(conn)
+            self._slots.put_nowait((None, 0.0))
+            return
+        self._slots.put_nowait((conn, time.monotonic()))
+
+    @asynccontextmanager
+    async def acquire(self: "ConnectionPool") -> AsyncIterator[aiosqlite.Connection]:
+        """Lease a connection for the duration of the context, waiting if all connections are busy."""
+        if self._closed:
+            raise aiosqlite.ProgrammingError("The connection pool is closed.")
+
+        conn = await self._checkout()
+        self._leased.add(conn)
+        suspect = False
+        try:
+            yield conn
+        except BaseException:
+            # A failed query may have left the connection broken; check it before reuse.
+            suspect = True
+            raise
+        finally:
+            self._leased.discard(conn)
+            await asyncio.shield(self._checkin(conn, suspect))
+
+    async def close(self: "ConnectionPool") -> None:
+        """Close the idle connections; leased connections are closed when they are returned."""
+        self._closed = True
+        while not self._slots.empty():
+            conn, _ = self._slots.get_nowait()
+            if conn is not None:
+                await self._discard(conn)
+        # Wake the callers still waiting for a connection, so they fail instead of waiting forever
+        self._slots.put_nowait((None, 0.0))
@@ -1,4 +1,11 @@
-import random
+import argparse
+import os
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+
+import numpy as np
 
 main_categories = {
     "APPAREL": {
@@ -134,44 +141,11 @@ regions = [
 
 years_growth = [(2022, .98), (2023, 1.01), (2024, 1.05)]
 
+# Fixed so a seed always generates the same rows, whatever their number
+BATCH_SIZE = 100_000
+PROGRESS_INTERVAL_SECONDS = 5
 
-def generate_sql_insert():
-    insert_statements = []
-
-    for _ in range(40000):
-        yg = random.choice(years_growth)
-        growth_factor = yg[1]
-        year = yg[0]
-        month = random.randint(1, 12)
-        region = random.choice(regions)
-
-        main_category = random.choice(list(main_categories.keys()))
-        product_category = main_categories[main_category]
-        product_type = random.choice(list(product_category.keys()))
-        price_range = product_category[product_type]
-
-        number_of_orders = int(random.randint(1, 20) * growth_factor)
-        revenue = random.randint(price_range[0], price_range[1]) * number_of_orders
-
-        shipping_cost_percentage = random.randint(10, 20) / 100.0
-        shipping_cost = shipping_cost_percentage * revenue
-
-        discount_percentage = random.randint(0, 15)
-        discount_decimal = discount_percentage / 100.0
-        discount = discount_decimal * revenue
-
-        month_date = f"{year}-{str(month).zfill(2)}"
-
-        insert_statements.append(
-            f"INSERT INTO sales_data (main_category, product_type, revenue, shipping_cost, number_of_orders, year, month, discount, region, month_date) "
-            f"VALUES ('{main_category}', '{product_type}', {revenue}, {shipping_cost}, {number_of_orders}, {year}, {month}, {discount}, '{region}', '{month_date}');"
-        )
-
-    return "\n".join(insert_statements)
-
-
-sql_script = f"""
--- Create the table
+CREATE_TABLE = """
 CREATE TABLE IF NOT EXISTS sales_data (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     main_category TEXT,
@@ -185,19 +159,152 @@ CREATE TABLE IF NOT EXISTS sales_data (
     region TEXT,
     month_date TEXT
 );
+"""
 
-CREATE INDEX idx_main_category ON sales_data(main_category);
-CREATE INDEX idx_product_type ON sales_data(product_type);
-CREATE INDEX idx_region ON sales_data(region);
-CREATE INDEX idx_year ON sales_data(year);
-CREATE INDEX idx_month_date ON sales_data(month_date);
+CREATE_INDEXES = [
+    "CREATE INDEX idx_main_category ON sales_data(main_category);",
+    "CREATE INDEX idx_product_type ON sales_data(product_type);",
+    "CREATE INDEX idx_region ON sales_data(region);",
+    "CREATE INDEX idx_year ON sales_data(year);",
+    "CREATE INDEX idx_month_date ON sales_data(month_date);",
+]
 
--- Insert random records into the table
-{generate_sql_insert()}
-"""
+INSERT_ROW = (
+    "INSERT INTO sales_data (main_category, product_type, revenue, shipping_cost, number_of_orders, year, month, "
+    "discount, region, month_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"
+)
+
+# Nothing has to survive a crash during the load, so skip the rollback journal and fsyncs. Temporary
+# files are left on disk, so sorting rows to build the indexes spills there rather than into memory.
+BULK_LOAD_PRAGMAS = [
+    "PRAGMA journal_mode = OFF;",
+    "PRAGMA synchronous = OFF;",
+    "PRAGMA locking_mode = EXCLUSIVE;",
+    "PRAGMA cache_size = -65536;",
+]
+
+# Every product type with its category and price range, so a row's product is one index into these
+product_categories = np.array([category for category, types in main_categories.items() for _ in types], dtype=object)
+product_types = np.array([product for types in main_categories.values() for product in types], dtype=object)
+product_prices = np.array([price_range for types in main_categories.values() for price_range in types.values()])
+category_offsets = np.cumsum([0] + [len(types) for types in main_categories.values()])[:-1]
+category_sizes = np.array([len(types) for types in main_categories.values()])
+
+
+def generate_batch(rng: np.random.Generator, size: int, years_growth: list[tuple[int, float]]) -> list[tuple]:
+    """Generate a batch of sales rows with the same distributions as the original row-by-row generator."""
+    years = np.array([year for year, _ in years_growth])
+    growth_factors = np.array([growth_factor for _, growth_factor in years_growth])
+
+    year_index = rng.integers(0, len(years_growth), size)
+    year = years[year_index]
+    month = rng.integers(1, 13, size)
+    region = np.array(regions, dtype=object)[rng.integers(0, len(regions), size)]
+
+    category = rng.integers(0, len(main_categories), size)
+    product = category_offsets[category] + rng.integers(0, category_sizes[category])
+    price = rng.integers(product_prices[product, 0], product_prices[product, 1] + 1)
+
+    number_of_orders = (rng.integers(1, 21, size) * growth_factors[year_index]).astype(np.int64)
+    revenue = price * number_of_orders
+    shipping_cost = rng.integers(10, 21, size) / 100.0 * revenue
+    discount = rng.integers(0, 16, size) / 100.0 * revenue
+    # Looked up rather than formatted per row
+    month_dates = np.array([f"{year}-{month:02d}" for year in years for month in range(1, 13)], dtype=object)
+    month_date = month_dates[year_index * 12 + month - 1]
+
+    return list(
+        zip(
+            product_categories[product].tolist(),
+            product_types[product].tolist(),
+            revenue.tolist(),
+            shipping_cost.tolist(),
+            number_of_orders.tolist(),
+            year.tolist(),
+            month.tolist(),
+            discount.tolist(),
+            region.tolist(),
+            month_date.tolist(),
+        )
+    )
+
+
+def generate_database(path: Path, rows: int, years_growth: list[tuple[int, float]], seed: int) -> float:
+    """Write `rows` generated sales rows to a new SQLite database at `path`, returning the rows per second.
+
+    Rows are generated and inserted a batch at a time, so memory use doesn't grow with the number of rows.
+    The database is built under a temporary name and moved into place when it is complete.
+    """
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temp_path.unlink(missing_ok=True)
+    rng = np.random.default_rng(seed)
+    start = last_report = time.perf_counter()
+
+    with closing(sqlite3.connect(temp_path, isolation_level=None)) as conn:
+        for pragma in BULK_LOAD_PRAGMAS:
+            conn.execute(pragma)
+        conn.execute(CREATE_TABLE)
+
+        written = 0
+        while written < rows:
+            batch = generate_batch(rng, min(BATCH_SIZE, rows - written), years_growth)
+            conn.execute("BEGIN;")
+            conn.executemany(INSERT_ROW, batch)
+            conn.execute("COMMIT;")
+            written += len(batch)
+
+            if time.perf_counter() - last_report >= PROGRESS_INTERVAL_SECONDS:
+                last_report = time.perf_counter()
+                print(f"{written:,} rows written, {written / (last_report - start):,.0f} rows/s")
+
+        # Building the indexes once over the loaded table is much faster than updating them on every insert
+        print("Creating indexes...")
+        for statement in CREATE_INDEXES:
+            conn.execute(statement)
+        conn.execute("PRAGMA journal_mode = DELETE;")
+
+    temp_path.replace(path)
+    return rows / (time.perf_counter() - start)
+
+
+def parse_years_growth(start_year: int, end_year: int, growth: str) -> list[tuple[int, float]]:
+    """Pair each year of the range with its growth factor; a single factor applies to every year."""
+    years = list(range(start_year, end_year + 1))
+    factors = [float(factor) for factor in growth.split(",")]
+    if not years:
+        raise ValueError("The end year must not be before the start year.")
+    if len(factors) == 1:
+        factors *= len(years)
+    if len(factors) != len(years):
+        raise ValueError(f"Expected 1 or {len(years)} growth factors for {start_year}-{end_year}, got {len(factors)}.")
+    return list(zip(years, factors))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate the Contoso sales database.")
+    parser.add_argument("--rows", type=int, default=40_000, help="Number of sales rows to generate")
+    parser.add_argument("--start-year", type=int, default=years_growth[0][0], help="First year of sales")
+    parser.add_argument("--end-year", type=int, default=years_growth[-1][0], help="Last year of sales")
+    parser.add_argument(
+        "--growth",
+        default=",".join(str(growth_factor) for _, growth_factor in years_growth),
+        help="Comma separated order growth factor for each year, or one factor for all of them",
+    )
+    parser.add_argument("--seed", type=int, default=42, help="Random seed; the same seed generates the same rows")
+    parser.add_argument("--output", default="contoso-sales.db", help="Path of the SQLite database to write")
+    args = parser.parse_args()
+
+    try:
+        years = parse_years_growth(args.start_year, args.end_year, args.growth)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.rows <= 0:
+        parser.error("--rows must be positive.")
+
+    output = Path(args.output)
+    rows_per_second = generate_database(output, args.rows, years, args.seed)
+    print(f"Wrote {args.rows:,} rows to {output} at {rows_per_second:,.0f} rows/s")
 
-# Write the SQL script to a file
-with open("populate_sales_data.sql", "w") as file:
-    file.write(sql_script)
 
-print("SQL script has been written to 'populate_sales_data.sql'")
+if __name__ == "__main__":
+    main()
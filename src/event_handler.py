@@ -1,6 +1,12 @@
-import json
+import asyncio
 import logging
-import re
+import mimetypes
+import os
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO
 
 import chainlit as cl
 from literalai.helper import utc_now
@@ -8,70 +14,180 @@ from openai import AsyncAssistantEventHandler
 from openai.types.beta.threads.runs.function_tool_call import FunctionToolCall
 from typing_extensions import override
 
-from sales_data import QueryResults
+from telemetry import record, span
+from text_stream import TextStream
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-markdown_link_pattern = re.compile(r"\[(.*?)\]\s*\(\s*.*?\s*\)")
-citation_pattern = re.compile(r"【.*?】")
+FILE_NAME_CACHE_SIZE = int(os.getenv("FILE_NAME_CACHE_SIZE", "1024"))
+
+
+def open_download(path: Path) -> BinaryIO:
+    """Create the file a download is written to, and its directory; blocking, so run it in a worker thread."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path.open("wb")
+
+
+class FileNameCache:
+    """LRU cache of file_id -> filename for cited files, shared by all sessions as file names don't change."""
+
+    def __init__(self: "FileNameCache", max_entries: int = FILE_NAME_CACHE_SIZE) -> None:
+        self.max_entries = max_entries
+        self._file_names: OrderedDict[str, str] = OrderedDict()
+
+    def get(self: "FileNameCache", file_id: str) -> str | None:
+        if (file_name := self._file_names.get(file_id)) is not None:
+            self._file_names.move_to_end(file_id)
+        return file_name
+
+    def put(self: "FileNameCache", file_id: str, file_name: str) -> None:
+        self._file_names[file_id] = file_name
+        self._file_names.move_to_end(file_id)
+        while len(self._file_names) > self.max_entries:
+            self._file_names.popitem(last=False)
+
+
+file_names = FileNameCache()
+
+
+class RunState:
+    """State shared by the event handlers of every stream in a run, from the first stream to the last tool round."""
+
+    def __init__(self: "RunState", function_map: dict, assistant_name: str, async_openai_client) -> None:
+        self.function_map = function_map
+        self.assistant_name = assistant_name
+        self.async_openai_client = async_openai_client
+        self.current_message: cl.Message = None
+        self.citations_index = 1
+        # Known from the run's first event, so the run can be cancelled while it is still streaming
+        self.run_id: str | None = None
+        self.thread_id: str | None = None
+        # When the run was started, for the time to the first token
+        self.started: float | None = None
+        self.first_token_recorded = False
 
 
 class EventHandler(AsyncAssistantEventHandler):
-    def __init__(self, function_map: dict, assistant_name: str, async_openai_client) -> None:
+    """Renders the events of one stream. The SDK needs a new handler per stream, so run state lives in RunState."""
+
+    def __init__(self, state: RunState) -> None:
         super().__init__()
-        self.current_message: cl.Message = None
+        self.state = state
+        self.text_stream: TextStream = None
         self.current_step: cl.Step = None
         self.current_tool_call = None
-        self.assistant_name = assistant_name
-        self.async_openai_client = async_openai_client
-        self.function_map = function_map
-        self.citations_index = 1
 
-    async def get_file_annotation(self, file_path, annotation) -> tuple:
+    @property
+    def current_message(self) -> cl.Message:
+        return self.state.current_message
+
+    @current_message.setter
+    def current_message(self, message: cl.Message) -> None:
+        self.state.current_message = message
+
+    @property
+    def citations_index(self) -> int:
+        return self.state.citations_index
+
+    @citations_index.setter
+    def citations_index(self, index: int) -> None:
+        self.state.citations_index = index
+
+    @property
+    def assistant_name(self) -> str:
+        return self.state.assistant_name
+
+    @property
+    def async_openai_client(self):
+        return self.state.async_openai_client
+
+    async def get_file_name(self, file_id: str) -> str:
+        if (file_name := file_names.get(file_id)) is None:
+            with span("citation_lookup", file_id=file_id):
+                cited_file = await self.async_openai_client.files.retrieve(file_id)
+            file_name = cited_file.filename
+            file_names.put(file_id, file_name)
+        return file_name
+
+    async def get_file_annotation(self, file_path, annotation) -> cl.File:
+        """Download a generated file in chunks to the session's files directory, which Chainlit cleans up.
+
+        Chunks are written on a worker thread, so the file is never held in memory or touched on the event
+        loop. Chainlit's persist_file would read the whole file and copy it, so the file is registered with
+        the session the way persist_file does in the pinned Chainlit version; if the session doesn't keep
+        its files that way, persist_file is used instead.
+        """
         file_name = annotation.text.split("/")[-1]
-        content = await self.async_openai_client.files.content(file_path.file_id)
-        return content.content, file_name
+        mime = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+        session = cl.context.session
+        file_id = str(uuid.uuid4())
+        download_path = Path(session.files_dir) / file_id
+        size = 0
+        with span("file_download", file_id=file_path.file_id):
+            async with self.async_openai_client.files.with_streaming_response.content(file_path.file_id) as response:
+                file = await asyncio.to_thread(open_download, download_path)
+                try:
+                    async for chunk in response.iter_bytes():
+                        await asyncio.to_thread(file.write, chunk)
+                        size += len(chunk)
+                finally:
+                    await asyncio.to_thread(file.close)
+
+        if not isinstance(getattr(session, "files", None), dict):
+            persisted = await session.persist_file(name=file_name, mime=mime, path=str(download_path))
+            await asyncio.to_thread(download_path.unlink, missing_ok=True)
+            return cl.File(name=file_name, chainlit_key=persisted["id"], mime=mime, display="inline")
+
+        session.files[file_id] = {"id": file_id, "path": download_path, "name": file_name, "type": mime, "size": size}
+        return cl.File(name=file_name, path=str(download_path), chainlit_key=file_id, mime=mime, display="inline")
+
+    @override
+    async def on_event(self: "EventHandler", event) -> None:
+        if event.event == "thread.run.created":
+            self.state.run_id = event.data.id
+            self.state.thread_id = event.data.thread_id
 
     @override
     async def on_text_created(self: "EventHandler", text) -> None:
         self.current_message = await cl.Message(author=self.assistant_name, content="").send()
+        self.text_stream = TextStream(self.current_message, self.citations_index)
 
     @override
     async def on_text_delta(self: "EventHandler", delta, snapshot):
-        if snapshot.value and markdown_link_pattern.search(snapshot.value):
-            await self.current_message.remove()
-            snapshot.value = markdown_link_pattern.sub(r"\1", snapshot.value)
-            await cl.Message(content=snapshot.value).send()
-        if snapshot.value and citation_pattern.search(snapshot.value):
-            await self.current_message.stream_token(delta.value)
-            snapshot.value = citation_pattern.sub(f"[{self.citations_index}]", snapshot.value)
-            await self.current_message.stream_token(f"[{self.citations_index}]")
-            self.citations_index += 1
-        elif delta.value:
-            await self.current_message.stream_token(delta.value)
+        if not self.state.first_token_recorded and self.state.started is not None:
+            self.state.first_token_recorded = True
+            record("time_to_first_token", time.perf_counter() - self.state.started, run_id=self.state.run_id)
+        # Deltas are batched, and markdown links and citations are rewritten as the text streams
+        await self.text_stream.add(delta.value)
 
     @override
     async def on_text_done(self: "EventHandler", text: str) -> None:
-        citations = []
-        index = 0
-        for annotation in text.annotations:
-            if file_citation := getattr(annotation, "file_citation", None):
-                cited_file = await self.async_openai_client.files.retrieve(file_citation.file_id)
-                index += 1
-                citations.append(f"[{index}] from {cited_file.filename}")
-
-            elif file_path := getattr(annotation, "file_path", None):
-                format_text, file_name = await self.get_file_annotation(file_path, annotation)
-                elements = [
-                    cl.File(
-                        name=file_name,
-                        content=format_text,
-                        display="inline",
-                    ),
-                ]
-                await cl.Message(content="", elements=elements).send()
-
+        await self.text_stream.close()
+        self.citations_index = self.text_stream.citations_index
+
+        # Resolve the cited file names and download the generated files concurrently
+        cited_file_ids = [
+            annotation.file_citation.file_id
+            for annotation in text.annotations
+            if getattr(annotation, "file_citation", None)
+        ]
+        file_paths = [
+            (file_path, annotation)
+            for annotation in text.annotations
+            if not getattr(annotation, "file_citation", None) and (file_path := getattr(annotation, "file_path", None))
+        ]
+        unique_file_ids = list(dict.fromkeys(cited_file_ids))
+        resolved_names, downloads = await asyncio.gather(
+            asyncio.gather(*[self.get_file_name(file_id) for file_id in unique_file_ids]),
+            asyncio.gather(*[self.get_file_annotation(file_path, annotation) for file_path, annotation in file_paths]),
+        )
+        cited_file_names = dict(zip(unique_file_ids, resolved_names))
+
+        for download in downloads:
+            await cl.Message(content="", elements=[download]).send()
+
+        citations = [f"[{index}] from {cited_file_names[file_id]}" for index, file_id in enumerate(cited_file_ids, 1)]
         if citations:
             await cl.Message(content="\n".join(citations)).send()
 
@@ -105,7 +221,8 @@ class EventHandler(AsyncAssistantEventHandler):
 
     async def on_image_file_done(self, image_file) -> None:
         image_id = image_file.file_id
-        response = await self.async_openai_client.files.with_raw_response.content(image_id)
+        with span("image_download", file_id=image_id):
+            response = await self.async_openai_client.files.with_raw_response.content(image_id)
         image_element = cl.Image(name=image_id, content=response.content, display="inline", size="large")
         await self.async_openai_client.files.delete(image_id)
         if not self.current_message.elements:
@@ -113,58 +230,10 @@ class EventHandler(AsyncAssistantEventHandler):
         self.current_message.elements.append(image_element)
         await self.current_message.update()
 
-    async def update_chainlit_function_ui(self, language: str, tool_call, result: QueryResults) -> None:
-        # Update the UI with the step function output
-        current_step = cl.Step(name="function", type="tool")
-        current_step.language = language
-        await current_step.stream_token(f"Function Name: {tool_call.function.name}\n")
-        await current_step.stream_token(f"Function Arguments: {tool_call.function.arguments}\n\n")
-        await current_step.stream_token(result.display_format)
-        current_step.start = utc_now()
-        await current_step.send()
-        self.current_message = await cl.Message(author=self.assistant_name, content="").send()
-
     @override
     async def on_tool_call_done(self, tool_call: FunctionToolCall) -> None:
-        """This method is called when a tool call is done."""
-        """ Parallel tool calling is enabled by default and it's important to iterate through the tool calls. """
-
-        if tool_call.type == "function" and self.current_run.status == "requires_action":
-            tool_calls = self.current_run.required_action.submit_tool_outputs.tool_calls
-            function_tool_calls = [call for call in tool_calls if call.type == "function"]
-            tool_outputs = []
-
-            for submit_tool_call in function_tool_calls:
-                function = self.function_map.get(submit_tool_call.function.name)
-
-                try:
-                    arguments = json.loads(submit_tool_call.function.arguments)
-                    result: QueryResults = await function(arguments)
-                except json.JSONDecodeError as e:
-                    result = QueryResults(
-                        display_format=submit_tool_call.function.arguments,
-                        json_format=str(e),
-                    )
-
-                tool_outputs.append({"tool_call_id": submit_tool_call.id, "output": result.json_format})
-                await self.update_chainlit_function_ui("sql", submit_tool_call, result)
-
-            if tool_outputs:
-                async with self.async_openai_client.beta.threads.runs.submit_tool_outputs_stream(
-                    thread_id=self.current_run.thread_id,
-                    run_id=self.current_run.id,
-                    tool_outputs=tool_outputs,
-                    event_handler=EventHandler(
-                        self.function_map,
-                        self.assistant_name,
-                        self.async_openai_client,
-                    ),
-                ) as stream:
-                    await stream.until_done()
-
-                await self.current_message.update()
-
-        elif tool_call.type == "code_interpreter":
+        """This method is called when a tool call is done. Function calls are run by the RunDriver."""
+        if tool_call.type == "code_interpreter":
             self.current_step.end = utc_now()
             await self.current_step.update()
         elif tool_call.type == "file_search":
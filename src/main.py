@@ -1,11 +1,50 @@
+import asyncio
 import os
+import sys
+from contextlib import asynccontextmanager, suppress
+from types import ModuleType
+from typing import AsyncIterator
 
 from chainlit.utils import mount_chainlit
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 # Map environment to target path
 env = os.getenv("ENV", "development")
 target = {"development": "src/app.py", "production": "app.py"}.get(env)
 
-app = FastAPI()
+
+def assistant_app() -> ModuleType:
+    """Return the Chainlit app module; Chainlit loads it by path and registers it under the target name."""
+    return sys.modules[target]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Initialize in the background so the server accepts connections (and readiness probes) right away
+    startup = asyncio.create_task(assistant_app().initialize())
+    yield
+    startup.cancel()
+    with suppress(asyncio.CancelledError):
+        await startup
+    await assistant_app().thread_pool.close()
+    await assistant_app().sales_data.close()
+    await assistant_app().async_openai_client.close()
+
+
+app = FastAPI(lifespan=lifespan)
 mount_chainlit(app=app, target=target, path="/sales")
+
+
+@app.get("/ready")
+async def ready() -> JSONResponse:
+    """Readiness probe: 200 once the assistant is initialized, 503 until then."""
+    if assistant_app().ASSISTANT_READY:
+        return JSONResponse({"status": "ready"})
+    return JSONResponse({"status": "initializing"}, status_code=503)
+
+
+@app.get("/metrics")
+async def metrics() -> PlainTextResponse:
+    """Prometheus metrics: stage latency histograms, queue depths and cache hit rates."""
+    return PlainTextResponse(assistant_app().render_metrics(), media_type="text/plain; version=0.0.4")
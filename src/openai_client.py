@@ -0,0 +1,57 @@
+import importlib.util
+import os
+from typing import Callable
+
+import httpx
+from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient
+
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY_SECONDS", "60"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "5"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "600"))
+# Retries use the client's exponential backoff with jitter, from 0.5 up to 8 seconds
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+# HTTP/2 multiplexes concurrent requests over one connection; it needs the h2 package (pip install httpx[http2])
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "true").lower() == "true" and importlib.util.find_spec("h2") is not None
+
+_async_openai_client: AsyncAzureOpenAI | None = None
+# Called with every response of the shared client, for example to read the rate limit headers
+response_hooks: list[Callable[[httpx.Response], None]] = []
+
+
+async def _on_response(response: httpx.Response) -> None:
+    for hook in response_hooks:
+        hook(response)
+
+
+def create_async_openai_client() -> AsyncAzureOpenAI:
+    """Create an Azure OpenAI client with an explicitly sized, keep-alive connection pool."""
+    http_client = DefaultAsyncHttpxClient(
+        http2=OPENAI_HTTP2,
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS),
+        event_hooks={"response": [_on_response]},
+    )
+    return AsyncAzureOpenAI(
+        azure_endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
+        api_key=os.environ.get("AZURE_OPENAI_API_KEY"),
+        api_version=os.environ.get("AZURE_OPENAI_API_VERSION"),
+        max_retries=OPENAI_MAX_RETRIES,
+        http_client=http_client,
+    )
+
+
+def get_async_openai_client() -> AsyncAzureOpenAI:
+    """Return the process wide client, so runs, uploads and downloads share one connection pool.
+
+    The client is created on first use, after the caller has loaded its environment.
+    """
+    global _async_openai_client
+    if _async_openai_client is None:
+        _async_openai_client = create_async_openai_client()
+    return _async_openai_client
@@ -0,0 +1,351 @@
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from pydantic import BaseModel
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "256"))
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "3600"))
+
+SQL_KEYWORDS = frozenset(
+    {
+        "ABORT",
+        "ALL",
+        "ALTER",
+        "ALWAYS",
+        "ANALYZE",
+        "AND",
+        "AS",
+        "ASC",
+        "ATTACH",
+        "AUTOINCREMENT",
+        "BETWEEN",
+        "BY",
+        "CASE",
+        "CAST",
+        "COLLATE",
+        "CROSS",
+        "CURRENT",
+        "CURRENT_DATE",
+        "CURRENT_TIME",
+        "CURRENT_TIMESTAMP",
+        "DEFAULT",
+        "DESC",
+        "DISTINCT",
+        "ELSE",
+        "END",
+        "ESCAPE",
+        "EXCEPT",
+        "EXISTS",
+        "EXPLAIN",
+        "FILTER",
+        "FIRST",
+        "FOLLOWING",
+        "FROM",
+        "FULL",
+        "GLOB",
+        "GROUP",
+        "GROUPS",
+        "HAVING",
+        "IF",
+        "IN",
+        "INDEXED",
+        "INNER",
+        "INTERSECT",
+        "INTO",
+        "IS",
+        "ISNULL",
+        "JOIN",
+        "LAST",
+        "LEFT",
+        "LIKE",
+        "LIMIT",
+        "MATCH",
+        "MATERIALIZED",
+        "NATURAL",
+        "NOT",
+        "NOTHING",
+        "NOTNULL",
+        "NULL",
+        "NULLS",
+        "OF",
+        "OFFSET",
+        "ON",
+        "OR",
+        "ORDER",
+        "OTHERS",
+        "OUTER",
+        "OVER",
+        "PARTITION",
+        "PRECEDING",
+        "QUERY",
+        "PLAN",
+        "RANGE",
+        "RECURSIVE",
+        "REGEXP",
+        "RIGHT",
+        "ROW",
+        "ROWS",
+        "SELECT",
+        "THEN",
+        "TIES",
+        "TO",
+        "UNBOUNDED",
+        "UNION",
+        "USING",
+        "VALUES",
+        "WHEN",
+        "WHERE",
+        "WINDOW",
+        "WITH",
+        "WITHOUT",
+    }
+)
+
+# Strings, quoted identifiers, comments, numbers, words and punctuation, in that order of precedence.
+_TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<string>'(?:[^']|'')*'?)
+    | (?P<quoted>"(?:[^"]|"")*"?|`(?:[^`]|``)*`?|\[[^\]]*\]?)
+    | (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+    | (?P<space>\s+)
+    | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    | (?P<op>\|\||<<|>>|<=|>=|==|!=|<>|.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def tokenize_sql(query: str) -> list[tuple[str, str, int, int]]:
+    """Split a SQL statement into (kind, text, start, end) tokens, dropping whitespace and comments."""
+    return [
+        (match.lastgroup, match.group(), match.start(), match.end())
+        for match in _TOKEN_PATTERN.finditer(query)
+        if match.lastgroup not in ("space", "comment")
+    ]
+
+
+def _is_column_reference(item: list[tuple[str, str, int, int]]) -> bool:
+    """True for `col`, `t.col`, `*` and `t.*`, whose result column names don't depend on how they were written."""
+    texts = [text for _, text, _, _ in item]
+    kinds = [kind for kind, _, _, _ in item]
+    if len(item) == 1:
+        return kinds[0] in ("word", "quoted") or texts[0] == "*"
+    return (
+        len(item) == 3
+        and kinds[0] in ("word", "quoted")
+        and texts[1] == "."
+        and (kinds[2] in ("word", "quoted") or texts[2] == "*")
+    )
+
+
+def _has_alias(item: list[tuple[str, str, int, int]]) -> bool:
+    if len(item) < 2:
+        return False
+    last_kind, last_text, _, _ = item[-1]
+    _, previous_text, _, _ = item[-2]
+    if last_kind not in ("word", "quoted", "string") or (last_kind == "word" and last_text.upper() in SQL_KEYWORDS):
+        return False
+    # `expr AS alias` or an implicit alias such as `SUM(revenue) total`
+    return previous_text.upper() == "AS" or previous_text == ")" or item[-2][0] in ("word", "quoted", "number")
+
+
+def _verbatim_select_items(tokens: list[tuple[str, str, int, int]]) -> set[int]:
+    """Return the token indexes of unaliased select-list expressions in the outermost SELECT.
+
+    SQLite names those result columns after the expression text exactly as written, so their case and
+    spacing must survive normalization or a cache hit could return the wrong column headers.
+    """
+    depth = 0
+    start = None
+    for index, (kind, text, _, _) in enumerate(tokens):
+        if text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+        elif depth == 0 and kind == "word" and text.upper() == "SELECT":
+            start = index + 1
+            break
+    if start is None:
+        return set()
+
+    while start < len(tokens) and tokens[start][1].upper() in ("DISTINCT", "ALL"):
+        start += 1
+
+    items = []
+    current: list[int] = []
+    depth = 0
+    for index in range(start, len(tokens)):
+        kind, text, _, _ = tokens[index]
+        if text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+        end_of_list = depth == 0 and kind == "word" and text.upper() in ("FROM", "WHERE", "GROUP", "ORDER", "LIMIT")
+        if depth < 0 or end_of_list:
+            break
+        if depth == 0 and text == ",":
+            items.append(current)
+            current = []
+        else:
+            current.append(index)
+    items.append(current)
+
+    verbatim = set()
+    for item in items:
+        item_tokens = [tokens[index] for index in item]
+        if item_tokens and not _is_column_reference(item_tokens) and not _has_alias(item_tokens):
+            verbatim.update(item)
+    return verbatim
+
+
+def normalize_sql(query: str) -> str:
+    """Canonicalize a SQL statement so trivially different spellings of the same query share a cache key.
+
+    Whitespace and comments are collapsed, keywords and function names are upper-cased and trailing semicolons
+    are removed. String literals, identifiers and unaliased select-list expressions are kept as written.
+    """
+    query = query.strip()
+    tokens = tokenize_sql(query)
+    while tokens and tokens[-1][1] == ";":
+        tokens.pop()
+
+    verbatim = _verbatim_select_items(tokens)
+    parts = []
+    index = 0
+    while index < len(tokens):
+        if index in verbatim:
+            # Keep the whole expression exactly as the model wrote it
+            end = index
+            while end + 1 in verbatim:
+                end += 1
+            parts.append(query[tokens[index][2] : tokens[end][3]])
+            index = end + 1
+            continue
+
+        kind, text, _, _ = tokens[index]
+        is_function = index + 1 < len(tokens) and tokens[index + 1][1] == "("
+        if kind == "word" and (text.upper() in SQL_KEYWORDS or is_function):
+            text = text.upper()
+        parts.append(text)
+        index += 1
+
+    return " ".join(parts)
+
+
+class QueryCacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+    entries: int = 0
+    size_bytes: int = 0
+
+
+class QueryCache:
+    """An in-process LRU/TTL cache of query results keyed on normalized SQL.
+
+    The database is opened read-only, so results only change when the database file itself is replaced;
+    the whole cache is dropped when the file's inode, size or modification time changes.
+    """
+
+    def __init__(
+        self: "QueryCache",
+        source_path: str | None = None,
+        max_entries: int = QUERY_CACHE_MAX_ENTRIES,
+        max_bytes: int = QUERY_CACHE_MAX_BYTES,
+        ttl_seconds: float = QUERY_CACHE_TTL_SECONDS,
+    ) -> None:
+        self.source_path = source_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.stats = QueryCacheStats()
+        self._entries: OrderedDict[str, tuple[BaseModel, float, int]] = OrderedDict()
+        self._source_signature = self._get_source_signature()
+
+    @property
+    def enabled(self: "QueryCache") -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def _get_source_signature(self: "QueryCache") -> tuple | None:
+        if not self.source_path:
+            return None
+        try:
+            stat = Path(self.source_path).stat()
+        except OSError:
+            return None
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _check_source(self: "QueryCache") -> None:
+        signature = self._get_source_signature()
+        if signature != self._source_signature:
+            if self._entries:
+                logger.info("Database file changed, clearing %d cached query results.", len(self._entries))
+                self.stats.invalidations += 1
+            self.clear()
+            self._source_signature = signature
+
+    def _remove(self: "QueryCache", key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self.stats.size_bytes -= size
+        self.stats.entries = len(self._entries)
+
+    def hit_rate(self: "QueryCache") -> float | None:
+        """Return the share of lookups answered from the cache, or None before the first lookup."""
+        lookups = self.stats.hits + self.stats.misses
+        return self.stats.hits / lookups if lookups else None
+
+    def get(self: "QueryCache", query: str) -> BaseModel | None:
+        """Return a copy of the cached result for the query, or None on a miss."""
+        if not self.enabled:
+            return None
+
+        self._check_source()
+        key = normalize_sql(query)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+
+        result, expires_at, _ = entry
+        if time.monotonic() >= expires_at:
+            self._remove(key)
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return result.model_copy()
+
+    def put(self: "QueryCache", query: str, result: BaseModel, size: int) -> None:
+        """Cache a result, evicting the least recently used entries to stay within the size limits."""
+        if not self.enabled or size > self.max_bytes:
+            return
+
+        self._check_source()
+        key = normalize_sql(query)
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (result.model_copy(), time.monotonic() + self.ttl_seconds, size)
+        self.stats.size_bytes += size
+        while len(self._entries) > self.max_entries or self.stats.size_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.stats.evictions += 1
+        self.stats.entries = len(self._entries)
+
+    def clear(self: "QueryCache") -> None:
+        self._entries.clear()
+        self.stats.entries = 0
+        self.stats.size_bytes = 0
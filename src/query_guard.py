@@ -0,0 +1,67 @@
+import os
+import time
+
+ASK_DATABASE_TIMEOUT_SECONDS = float(os.getenv("ASK_DATABASE_TIMEOUT_SECONDS", "10"))
+ASK_DATABASE_MAX_VM_STEPS = int(os.getenv("ASK_DATABASE_MAX_VM_STEPS", "500000000"))
+# SQLite calls the progress handler every this many virtual machine instructions
+PROGRESS_HANDLER_INTERVAL = 10_000
+
+
+class QueryGuard:
+    """SQLite progress handler that aborts the running statement when it runs out of budget or is cancelled.
+
+    One guard is installed per connection. It is armed for each query with `start()`; SQLite then calls it
+    from the connection's worker thread every `PROGRESS_HANDLER_INTERVAL` instructions, and a non-zero
+    return value makes SQLite abort the statement with an "interrupted" error.
+    """
+
+    def __init__(
+        self: "QueryGuard",
+        timeout_seconds: float = ASK_DATABASE_TIMEOUT_SECONDS,
+        max_vm_steps: int = ASK_DATABASE_MAX_VM_STEPS,
+    ) -> None:
+        self.timeout_seconds = timeout_seconds
+        self.max_vm_steps = max_vm_steps
+        self.reason: str | None = None
+        self._armed = False
+        self._deadline: float | None = None
+        self._steps = 0
+
+    def start(self: "QueryGuard") -> None:
+        """Arm the guard for a new query."""
+        self.reason = None
+        self._steps = 0
+        self._deadline = time.monotonic() + self.timeout_seconds if self.timeout_seconds > 0 else None
+        self._armed = True
+
+    def stop(self: "QueryGuard") -> None:
+        """Disarm the guard once the query has finished."""
+        self._armed = False
+
+    def cancel(self: "QueryGuard") -> None:
+        """Abort the running query at the next progress check.
+
+        The guard stays armed, so a query still queued on the worker thread is aborted as soon as it starts.
+        """
+        self.reason = "The query was cancelled."
+
+    def __call__(self: "QueryGuard") -> int:
+        if not self._armed:
+            return 0
+        if self.reason:
+            return 1
+
+        self._steps += PROGRESS_HANDLER_INTERVAL
+        if self.max_vm_steps > 0 and self._steps > self.max_vm_steps:
+            self.reason = (
+                f"The query was stopped after {self.max_vm_steps:,} SQLite instructions. "
+                "Simplify the query, for example by avoiding self-joins or adding filters."
+            )
+            return 1
+        if self._deadline is not None and time.monotonic() > self._deadline:
+            self.reason = (
+                f"The query was stopped after running for {self.timeout_seconds:g} seconds. "
+                "Simplify the query, for example by avoiding self-joins or adding filters."
+            )
+            return 1
+        return 0
@@ -0,0 +1,118 @@
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+from pydantic import BaseModel, ValidationError
+
+from query_cache import normalize_sql
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# JSON lines file recording the plan and timing of each distinct query; unset to not record them
+QUERY_PLAN_LOG = os.getenv("QUERY_PLAN_LOG")
+
+
+class QueryPlanEntry(BaseModel):
+    query: str
+    normalized: str
+    # EXPLAIN QUERY PLAN details, indented two spaces per level
+    plan: list[str]
+    elapsed_ms: float
+    row_count: int
+    # Which backend answered the query: sqlite, rollups or columnar
+    backend: str
+    logged_at: str
+
+
+def format_query_plan(rows: list[tuple]) -> list[str]:
+    """Indent the detail of each EXPLAIN QUERY PLAN row (id, parent, notused, detail) by its depth."""
+    depths = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depths[node_id] = depths.get(parent, -1) + 1
+        lines.append(f"{'  ' * depths[node_id]}{detail}")
+    return lines
+
+
+def read_query_plan_log(path: str | Path) -> list[QueryPlanEntry]:
+    """Read the entries of a query plan log, skipping lines that can't be parsed."""
+    entries = []
+    with Path(path).open("r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                entries.append(QueryPlanEntry.model_validate_json(line))
+            except ValidationError:
+                continue
+    return entries
+
+
+class QueryPlanLog:
+    """Appends the query plan and execution time of the first run of each distinct normalized query.
+
+    The log is read by the offline index advisor, benchmark/query_advisor.py. Queries already in the log
+    when the app starts aren't recorded again; call load, off the event loop, to read them at startup.
+    """
+
+    def __init__(self: "QueryPlanLog", path: str | None = QUERY_PLAN_LOG) -> None:
+        self.path = Path(path) if path else None
+        self._seen: set[str] | None = None
+        # Entries are written from worker threads
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self: "QueryPlanLog") -> bool:
+        return self.path is not None
+
+    def _load_seen(self: "QueryPlanLog") -> set[str]:
+        if self._seen is None:
+            try:
+                self._seen = {entry.normalized for entry in read_query_plan_log(self.path)}
+            except OSError:
+                self._seen = set()
+        return self._seen
+
+    def load(self: "QueryPlanLog") -> None:
+        """Read the queries already in the log; blocking, so run it in a worker thread."""
+        if self.enabled:
+            with self._lock:
+                self._load_seen()
+
+    def is_new(self: "QueryPlanLog", query: str) -> bool:
+        """Return whether the query isn't in the log yet, without reading the file.
+
+        Until load has run every query counts as new; record still skips those already logged.
+        """
+        if not self.enabled:
+            return False
+        with self._lock:
+            return self._seen is None or normalize_sql(query) not in self._seen
+
+    def record(
+        self: "QueryPlanLog", query: str, plan: list[str], elapsed_ms: float, row_count: int, backend: str
+    ) -> None:
+        """Append an entry for the query unless it is already logged; failures are logged and ignored."""
+        normalized = normalize_sql(query)
+        entry = QueryPlanEntry(
+            query=query,
+            normalized=normalized,
+            plan=plan,
+            elapsed_ms=round(elapsed_ms, 3),
+            row_count=row_count,
+            backend=backend,
+            logged_at=datetime.now(timezone.utc).isoformat(),
+        )
+        with self._lock:
+            seen = self._load_seen()
+            if normalized in seen:
+                return
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with self.path.open("a", encoding="utf-8") as file:
+                    file.write(entry.model_dump_json() + "\n")
+            except OSError as e:
+                logger.warning("Unable to write the query plan log %s: %s", self.path, str(e))
+                return
+            seen.add(normalized)
@@ -0,0 +1,223 @@
+import re
+from typing import Iterable
+
+# Matches pandas' display defaults: display.precision = 6 and display.colheader_justify = "right"
+FLOAT_DIGITS = 6
+JSON_DOUBLE_PRECISION = 10
+
+_JSON_ESCAPE_PATTERN = re.compile(r'[\\"/\x00-\x1f\u0080-\U0010ffff]')
+_JSON_ESCAPES = {"\\": "\\\\", '"': '\\"', "/": "\\/", "\b": "\\b", "\f": "\\f", "\n": "\\n", "\r": "\\r", "\t": "\\t"}
+_DECIMAL_NUMBER_PATTERN = re.compile(r"^\s*[\+-]?[0-9]+\.[0-9]*$")
+_INT64_MIN, _INT64_MAX = -(2**63), 2**63 - 1
+
+# Column kinds, named after the dtype pandas would infer for the column
+INT64 = "int64"
+FLOAT64 = "float64"
+OBJECT = "object"
+
+
+def _escape_display(value: object) -> str:
+    return "None" if value is None else str(value).replace("\t", r"\t").replace("\n", r"\n").replace("\r", r"\r")
+
+
+def _trim_zeros_float(strings: list[str]) -> list[str]:
+    """Trim trailing zeros equally from all decimal numbers, leaving at least one digit after the point."""
+
+    def is_decimal(text: str) -> bool:
+        return _DECIMAL_NUMBER_PATTERN.match(text) is not None
+
+    def should_trim(values: list[str]) -> bool:
+        numbers = [text for text in values if is_decimal(text)]
+        return len(numbers) > 0 and all(text.endswith("0") for text in numbers)
+
+    while should_trim(strings):
+        strings = [text[:-1] if is_decimal(text) else text for text in strings]
+    return [text + "0" if is_decimal(text) and text.endswith(".") else text for text in strings]
+
+
+def _format_float_column(values: list) -> list[str]:
+    def format_with(spec: str) -> list[str]:
+        return _trim_zeros_float(["NaN" if value is None else format(value, spec) for value in values])
+
+    formatted = format_with(f".{FLOAT_DIGITS}f")
+    too_long = max(len(text) for text in formatted) > FLOAT_DIGITS + 6
+    magnitudes = [abs(value) for value in values if value is not None]
+    has_large_values = any(value > 1e6 for value in magnitudes)
+    has_small_values = any(0 < value < 10**-FLOAT_DIGITS for value in magnitudes)
+    if has_small_values or (too_long and has_large_values):
+        formatted = format_with(f".{FLOAT_DIGITS}e")
+    return formatted
+
+
+def _json_float(value: float | None) -> str:
+    """Encode a double the way pandas' bundled ujson does with double_precision=10."""
+    if value is None or value != value or value in (float("inf"), float("-inf")):
+        return "null"
+
+    negative = value < 0
+    value = -value if negative else value
+    if value > 1e16 - 1 or (value != 0.0 and value < 1e-15):
+        return format(-value if negative else value, f".{JSON_DOUBLE_PRECISION}g")
+
+    pow10 = 10**JSON_DOUBLE_PRECISION
+    whole = int(value)
+    scaled = (value - whole) * pow10
+    frac = int(scaled)
+    diff = scaled - frac
+    if diff > 0.5 or (diff == 0.5 and (frac == 0 or frac & 1)):
+        frac += 1
+    if frac >= pow10:
+        frac = 0
+        whole += 1
+
+    if frac:
+        digits = str(frac).rjust(JSON_DOUBLE_PRECISION, "0").rstrip("0")
+        text = f"{whole}.{digits}"
+    else:
+        text = f"{whole}.0"
+    return f"-{text}" if negative else text
+
+
+def _json_escape(match: re.Match) -> str:
+    char = match.group()
+    if char in _JSON_ESCAPES:
+        return _JSON_ESCAPES[char]
+    code = ord(char)
+    if code > 0xFFFF:
+        code -= 0x10000
+        return f"\\u{0xD800 | (code >> 10):04x}\\u{0xDC00 | (code & 0x3FF):04x}"
+    return f"\\u{code:04x}"
+
+
+def _json_string(value: str | None) -> str:
+    """Encode a string the way pandas' bundled ujson does: ASCII-only, with forward slashes escaped."""
+    return "null" if value is None else f'"{_JSON_ESCAPE_PATTERN.sub(_json_escape, value)}"'
+
+
+class ResultFormatter:
+    """Formats query rows as pandas would with `to_string(index=False)` and `to_json(orient="split")`.
+
+    Rows are consumed once and stored by column; each column's kind is tracked as rows arrive so both
+    outputs can be rendered without building a DataFrame. Columns that pandas would hold as mixed object
+    data (for example text mixed with numbers, or blobs) fall back to pandas, imported only then.
+
+    Rows beyond `max_rows`, or that would take the JSON past `max_json_bytes`, are dropped and the
+    formatter is marked as truncated so the caller can stop fetching.
+    """
+
+    def __init__(
+        self: "ResultFormatter",
+        columns: list[str],
+        max_rows: int | None = None,
+        max_json_bytes: int | None = None,
+    ) -> None:
+        self.columns = columns
+        self.max_rows = max_rows
+        self.max_json_bytes = max_json_bytes
+        self.row_count = 0
+        self.truncated = False
+        # Running estimate of the JSON size; the JSON is ASCII-only, so characters are bytes.
+        # Ints in a column that later turns out to be float grow by ".0" when rendered.
+        self.json_size = len('{"columns":[],"data":[]}') + sum(len(_json_string(column)) + 1 for column in columns)
+        self._values: list[list] = [[] for _ in columns]
+        self._seen: list[set[str]] = [set() for _ in columns]
+
+    def _estimate_json_size(self: "ResultFormatter", row: tuple) -> int:
+        size = len(row) + 2
+        for value in row:
+            if isinstance(value, str):
+                size += len(_json_string(value))
+            elif isinstance(value, float):
+                size += len(_json_float(value))
+            else:
+                size += len(str(value)) if value is not None else 4
+        return size
+
+    def add_rows(self: "ResultFormatter", rows: Iterable[tuple]) -> bool:
+        """Add rows, returning False once a row or size limit has been reached."""
+        for row in rows:
+            if self.truncated or (self.max_rows is not None and self.row_count >= self.max_rows):
+                self.truncated = True
+                return False
+
+            if self.max_json_bytes is not None:
+                row_size = self._estimate_json_size(row)
+                if self.json_size + row_size > self.max_json_bytes:
+                    self.truncated = True
+                    return False
+                self.json_size += row_size
+
+            for value, values, seen in zip(row, self._values, self._seen):
+                values.append(value)
+                if value is None:
+                    seen.add("none")
+                elif isinstance(value, int) and _INT64_MIN <= value <= _INT64_MAX:
+                    seen.add("int")
+                elif isinstance(value, float):
+                    seen.add("float")
+                elif isinstance(value, str):
+                    seen.add("str")
+                else:
+                    seen.add("other")
+            self.row_count += 1
+        return not self.truncated
+
+    def _column_kind(self: "ResultFormatter", index: int) -> str | None:
+        """Return the dtype pandas would infer for a column, or None if the column needs pandas."""
+        seen = self._seen[index]
+        if "other" in seen or ("str" in seen and seen & {"int", "float"}):
+            return None
+        if "str" in seen or seen <= {"none"}:
+            return OBJECT
+        if seen == {"int"}:
+            return INT64
+        return FLOAT64
+
+    def _format_with_pandas(self: "ResultFormatter") -> tuple[str, str]:
+        import pandas as pd
+
+        data = pd.DataFrame(list(zip(*self._values)), columns=self.columns)
+        return data.to_string(index=False), data.to_json(index=False, orient="split")
+
+    def format(self: "ResultFormatter") -> tuple[str, str]:
+        """Return the (display, json) renderings of the rows added so far."""
+        kinds = [self._column_kind(index) for index in range(len(self.columns))]
+        if None in kinds:
+            return self._format_with_pandas()
+
+        json_columns = []
+        display_columns = []
+        for values, kind in zip(self._values, kinds):
+            if kind == FLOAT64:
+                values = [None if value is None else float(value) for value in values]
+                json_columns.append([_json_float(value) for value in values])
+                display_columns.append(_format_float_column(values))
+            elif kind == INT64:
+                json_columns.append([str(value) for value in values])
+                display_columns.append([str(value) for value in values])
+            else:
+                json_columns.append([_json_string(value) for value in values])
+                display_columns.append([_escape_display(value) for value in values])
+
+        # Headers are trimmed of their common leading space, then numeric columns get a leading space
+        labels = [" " + _escape_display(column) for column in self.columns]
+        while all(labels) and all(label[0] == " " for label in labels):
+            labels = [label[1:] for label in labels]
+        is_numeric = dict(zip(labels, [kind != OBJECT for kind in kinds]))
+        headers = [" " + label if is_numeric[label] else label for label in labels]
+
+        text_columns = []
+        for header, cells in zip(headers, display_columns):
+            width = max([len(header)] + [len(cell) for cell in cells])
+            text_columns.append([header.rjust(width)] + [cell.rjust(width) for cell in cells])
+
+        # Columns are separated by a single space
+        widths = [len(column[0]) + 1 for column in text_columns[:-1]] + [len(text_columns[-1][0])]
+        display_format = "\n".join(
+            "".join(column[line].ljust(width) for column, width in zip(text_columns, widths))
+            for line in range(self.row_count + 1)
+        )
+
+        json_rows = ",".join("[" + ",".join(row) + "]" for row in zip(*json_columns))
+        json_format = '{"columns":[' + ",".join(map(_json_string, self.columns)) + '],"data":[' + json_rows + "]}"
+        return display_format, json_format
@@ -0,0 +1,281 @@
+import json
+import logging
+import os
+import sqlite3
+from contextlib import closing, suppress
+from pathlib import Path
+
+from aggregate_query import AggregateQuery, parse_aggregate_query
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "true").lower() == "true"
+# Directory for the rollup sidecar database; defaults to the database's own directory
+ROLLUP_DIR = os.getenv("ROLLUP_DIR")
+ROLLUP_VERSION = 2
+ROLLUP_SCHEMA = "rollups"
+
+ROLLUP_TABLE = "sales_data"
+ROLLUP_DIMENSIONS = ("region", "main_category", "product_type", "year", "month")
+# Coarser grains built besides the finest one, which groups by every dimension and answers the rest
+ROLLUP_GRAINS = (
+    (),
+    ("region",),
+    ("main_category",),
+    ("product_type",),
+    ("year",),
+    ("region", "year"),
+    ("main_category", "year"),
+    ("region", "main_category"),
+    ("main_category", "product_type"),
+    ("year", "month"),
+    ("region", "year", "month"),
+    ("region", "main_category", "year"),
+)
+ROLLUP_MEASURES = ("revenue", "shipping_cost", "discount", "number_of_orders")
+# Columns fixed by other dimensions, carried in every rollup grouped by all of them
+DEPENDENT_DIMENSIONS = {"month_date": ("year", "month")}
+# Sums are only exact, whatever the order of addition, for whole numbers within a double's integer range
+EXACT_SUM_LIMIT = 2**53
+
+
+def rollup_path(db_path: str) -> Path:
+    path = Path(db_path)
+    directory = Path(ROLLUP_DIR) if ROLLUP_DIR else path.parent
+    return directory / f"{path.name}.rollups.db"
+
+
+def _grain_columns(dimensions: tuple[str, ...]) -> tuple[str, ...]:
+    dependent = [
+        column for column, determinants in DEPENDENT_DIMENSIONS.items() if set(determinants) <= set(dimensions)
+    ]
+    return (*dimensions, *dependent)
+
+
+def _table_name(dimensions: tuple[str, ...]) -> str:
+    return f"rollup_{'_'.join(dimensions) or 'total'}"
+
+
+def source_version(db_path: str) -> str:
+    """Return a version of the database that changes with every write to it.
+
+    Combines the file size, its modification time and the change counter SQLite increments in the header
+    on each committed transaction. In WAL mode writes land in the -wal file until a checkpoint, so its size
+    and modification time are included too.
+    """
+    path = Path(db_path)
+    with path.open("rb") as file:
+        file.seek(24)
+        change_counter = int.from_bytes(file.read(4), "big")
+    parts = []
+    for file_path in (path, Path(f"{db_path}-wal")):
+        with suppress(FileNotFoundError):
+            stat = file_path.stat()
+            parts.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+    return ":".join([*parts, str(change_counter)])
+
+
+def build_rollups(db_path: str, path: Path, version: str) -> None:
+    """Build rollups of the table at its finest grain and at ROLLUP_GRAINS into a sidecar database.
+
+    The finest rollup is aggregated from the table and the coarser ones from the finest, so the table is
+    scanned once. The file is written under a temporary name and moved into place when it is complete.
+    """
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path.unlink(missing_ok=True)
+    try:
+        with closing(sqlite3.connect(f"{temp_path.resolve().as_uri()}", uri=True)) as conn:
+            conn.execute("PRAGMA journal_mode = OFF;")
+            conn.execute("PRAGMA synchronous = OFF;")
+            conn.execute("ATTACH DATABASE ? AS source;", (f"{Path(db_path).resolve().as_uri()}?mode=ro",))
+
+            exact_measures = []
+            for measure in ROLLUP_MEASURES:
+                fractional, magnitude = conn.execute(
+                    f"SELECT COUNT(*) FILTER (WHERE {measure} != CAST({measure} AS INTEGER)), "
+                    f"COALESCE(SUM(ABS({measure})), 0) FROM source.{ROLLUP_TABLE};"
+                ).fetchone()
+                if fractional == 0 and magnitude < EXACT_SUM_LIMIT:
+                    exact_measures.append(measure)
+
+            def measures(finest: bool) -> str:
+                parts = ["SUM(row_count) AS row_count" if not finest else "COUNT(*) AS row_count"]
+                for measure in ROLLUP_MEASURES:
+                    source = {name: f"{name}_{measure}" for name in ("sum", "count", "min", "max")}
+                    if finest:
+                        source = {name: measure for name in source}
+                    if measure in exact_measures:
+                        parts.append(f"SUM({source['sum']}) AS sum_{measure}")
+                    parts.append(f"{'COUNT' if finest else 'SUM'}({source['count']}) AS count_{measure}")
+                    parts.append(f"MIN({source['min']}) AS min_{measure}")
+                    parts.append(f"MAX({source['max']}) AS max_{measure}")
+                return ", ".join(parts)
+
+            finest = _grain_columns(ROLLUP_DIMENSIONS)
+            finest_table = _table_name(ROLLUP_DIMENSIONS)
+            conn.execute(
+                f"CREATE TABLE {finest_table} AS SELECT {', '.join(finest)}, {measures(True)} "
+                f"FROM source.{ROLLUP_TABLE} GROUP BY {', '.join(finest)};"
+            )
+
+            catalog = [(finest_table, finest)]
+            for dimensions in ROLLUP_GRAINS:
+                columns = _grain_columns(dimensions)
+                group_by = f" GROUP BY {', '.join(columns)}" if columns else ""
+                select = f"{', '.join(columns)}, " if columns else ""
+                conn.execute(
+                    f"CREATE TABLE {_table_name(dimensions)} AS SELECT {select}{measures(False)} "
+                    f"FROM {finest_table}{group_by};"
+                )
+                catalog.append((_table_name(dimensions), columns))
+
+            conn.execute("CREATE TABLE rollup_catalog (name TEXT PRIMARY KEY, columns TEXT, row_count INTEGER);")
+            for name, columns in catalog:
+                (row_count,) = conn.execute(f"SELECT COUNT(*) FROM {name};").fetchone()
+                conn.execute("INSERT INTO rollup_catalog VALUES (?, ?, ?);", (name, json.dumps(columns), row_count))
+            conn.execute("CREATE TABLE rollup_info (key TEXT PRIMARY KEY, value TEXT);")
+            conn.executemany(
+                "INSERT INTO rollup_info VALUES (?, ?);",
+                [
+                    ("version", str(ROLLUP_VERSION)),
+                    ("source_version", version),
+                    ("exact_measures", json.dumps(exact_measures)),
+                ],
+            )
+            conn.commit()
+            conn.execute("DETACH DATABASE source;")
+        # Atomic, so other replicas never open a partially written file
+        temp_path.replace(path)
+    finally:
+        with suppress(OSError):
+            temp_path.unlink(missing_ok=True)
+
+
+class RollupStore:
+    """Summary tables of sales_data at the common grains of its dimensions, in a sidecar database next to it.
+
+    Aggregate queries over the dimensions are rewritten to the smallest rollup that can answer them, so
+    their cost depends on the number of groups rather than the number of rows. A query is only rewritten
+    when the rollup gives the same result: sums and averages only of measures whose values are whole
+    numbers, which add up exactly in any order, and counts, minimums and maximums of any measure.
+    """
+
+    def __init__(self: "RollupStore") -> None:
+        self.path: Path | None = None
+        # (grain columns, table name, row count), smallest first
+        self.rollups: list[tuple[frozenset[str], str, int]] = []
+        self.exact_measures: set[str] = set()
+
+    @property
+    def enabled(self: "RollupStore") -> bool:
+        return self.path is not None and bool(self.rollups)
+
+    @property
+    def uri(self: "RollupStore") -> str:
+        # The sidecar is only ever replaced, never modified in place, so it can be opened as immutable
+        return f"{self.path.resolve().as_uri()}?mode=ro&immutable=1"
+
+    def _load(self: "RollupStore", path: Path, version: str) -> bool:
+        if not path.exists():
+            return False
+        try:
+            with closing(sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True)) as conn:
+                info = dict(conn.execute("SELECT key, value FROM rollup_info;").fetchall())
+                if info.get("version") != str(ROLLUP_VERSION) or info.get("source_version") != version:
+                    return False
+                catalog = conn.execute("SELECT name, columns, row_count FROM rollup_catalog;").fetchall()
+        except sqlite3.Error:
+            return False
+
+        self.rollups = sorted(
+            [(frozenset(json.loads(columns)), name, row_count) for name, columns, row_count in catalog],
+            key=lambda rollup: rollup[2],
+        )
+        self.exact_measures = set(json.loads(info["exact_measures"]))
+        self.path = path
+        return True
+
+    def load(self: "RollupStore", db_path: str) -> None:
+        """Open the database's rollups, building them first if they are missing or out of date.
+
+        Failures are logged and leave rollups disabled, so queries go to the table.
+        """
+        self.path = None
+        self.rollups = []
+        path = rollup_path(db_path)
+        try:
+            version = source_version(db_path)
+            if not self._load(path, version):
+                build_rollups(db_path, path, version)
+                self._load(path, version)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Rollups are disabled, they could not be built at %s: %s", path, str(e))
+            return
+        logger.info("Loaded %d rollups from %s.", len(self.rollups), path)
+
+    def _replacement(self: "RollupStore", function: str, column: str | None) -> str:
+        if column is None:
+            return "COALESCE(SUM(row_count), 0)"
+        if function == "AVG":
+            return f"(CAST(SUM(sum_{column}) AS REAL) / SUM(count_{column}))"
+        if function == "COUNT":
+            return f"COALESCE(SUM(count_{column}), 0)"
+        return f"{function}({'sum' if function in ('SUM', 'TOTAL') else function.lower()}_{column})"
+
+    def _dimensions(self: "RollupStore", parsed: AggregateQuery) -> set[str] | None:
+        """Return the dimensions a rollup needs to answer the query, or None if no rollup can."""
+        dimensions = set(parsed.columns)
+        for call in parsed.aggregates:
+            if call.column is None:
+                continue
+            if call.column in ROLLUP_MEASURES and not call.distinct:
+                if call.function in ("SUM", "TOTAL", "AVG") and call.column not in self.exact_measures:
+                    return None
+            elif call.function in ("MIN", "MAX") or call.distinct:
+                # Unchanged on the rollup, whose rows carry the same dimension values
+                dimensions.add(call.column)
+            else:
+                return None
+        return dimensions
+
+    def rewrite(self: "RollupStore", query: str) -> str | None:
+        """Return the query rewritten to read from the smallest rollup that gives the same result.
+
+        Returns None when no rollup can answer the query exactly. Rows that tie on the ORDER BY may come
+        back in a different order.
+        """
+        if not self.enabled:
+            return None
+        parsed = parse_aggregate_query(query)
+        if parsed is None or parsed.table != ROLLUP_TABLE:
+            return None
+        # Without aggregation every row of the table is a row of the result
+        if not (parsed.aggregates or parsed.has_group_by or parsed.distinct):
+            return None
+        # With aggregates or GROUP BY, columns outside aggregates are only well defined when grouped by
+        if (parsed.aggregates or parsed.has_group_by) and not parsed.output_columns <= parsed.group_by:
+            return None
+
+        dimensions = self._dimensions(parsed)
+        if dimensions is None:
+            return None
+        table = next((name for columns, name, _ in self.rollups if dimensions <= columns), None)
+        if table is None:
+            return None
+
+        edits = [(parsed.table_start, parsed.table_end, f"{ROLLUP_SCHEMA}.{table}")]
+        for call in parsed.aggregates:
+            if call.column is None or (call.column in ROLLUP_MEASURES and not call.distinct):
+                edits.append((call.start, call.end, self._replacement(call.function, call.column)))
+        for item in parsed.select_items:
+            if item.has_aggregate and item.alias is None:
+                # Keep the result column named after the expression as it was written
+                name = parsed.query[item.start : item.end].replace('"', '""')
+                edits.append((item.end, item.end, f' AS "{name}"'))
+
+        rewritten = parsed.query
+        for start, end, text in sorted(edits, key=lambda edit: (edit[0], edit[1]), reverse=True):
+            rewritten = rewritten[:start] + text + rewritten[end:]
+        return rewritten
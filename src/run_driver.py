@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import suppress
+
+import chainlit as cl
+from literalai.helper import utc_now
+from openai import AsyncAzureOpenAI
+from pydantic import BaseModel
+
+from event_handler import EventHandler, RunState
+from sales_data import QueryResults
+from telemetry import span
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Function tool calls from one requires_action run concurrently, bounded by this limit
+TOOL_CALL_CONCURRENCY = int(os.getenv("TOOL_CALL_CONCURRENCY", "4"))
+TOOL_CALL_TIMEOUT_SECONDS = float(os.getenv("TOOL_CALL_TIMEOUT_SECONDS", "30"))
+# Most rounds of tool outputs submitted for a single user message before the run is cancelled
+MAX_TOOL_ROUNDS = int(os.getenv("MAX_TOOL_ROUNDS", "8"))
+
+
+class RoundTiming(BaseModel):
+    round: int
+    stream_ms: float = 0.0
+    tool_ms: float = 0.0
+    tool_calls: int = 0
+
+
+class RunDriver:
+    """Drives a run through its lifecycle: stream, run the tool calls, submit their outputs and resume.
+
+    Every round's stream is finished before the next one is opened, so tool rounds run in a flat loop
+    rather than as streams nested inside each other's event handlers. The handlers of all the streams
+    share one RunState.
+    """
+
+    def __init__(
+        self: "RunDriver",
+        async_openai_client: AsyncAzureOpenAI,
+        function_map: dict,
+        assistant_name: str,
+        max_tool_rounds: int = MAX_TOOL_ROUNDS,
+    ) -> None:
+        self.async_openai_client = async_openai_client
+        self.function_map = function_map
+        self.max_tool_rounds = max_tool_rounds
+        self.state = RunState(function_map, assistant_name, async_openai_client)
+        self.rounds: list[RoundTiming] = []
+        # Total tokens the run used, reported once it has finished
+        self.total_tokens: int | None = None
+
+    @property
+    def run_id(self: "RunDriver") -> str | None:
+        return self.state.run_id
+
+    @property
+    def thread_id(self: "RunDriver") -> str | None:
+        return self.state.thread_id
+
+    async def update_chainlit_function_ui(
+        self: "RunDriver", language: str, tool_calls: list, results: list[QueryResults], follow_up: cl.Message
+    ) -> None:
+        # Update the UI with the step function outputs, then the message the resumed run continues in
+        for tool_call, result in zip(tool_calls, results):
+            current_step = cl.Step(name="function", type="tool")
+            current_step.output = (
+                f"Function Name: {tool_call.function.name}\n"
+                f"Function Arguments: {tool_call.function.arguments}\n\n"
+                f"{result.display_format}"
+            )
+            current_step.language = language
+            current_step.start = utc_now()
+            await current_step.send()
+        await follow_up.send()
+
+    async def cancel_run(self: "RunDriver", notice: str) -> None:
+        """Cancel the run and tell the user why."""
+        with suppress(Exception):
+            await self.async_openai_client.beta.threads.runs.cancel(run_id=self.run_id, thread_id=self.thread_id)
+        await cl.Message(content=notice).send()
+
+    async def call_function(self: "RunDriver", tool_call, semaphore: asyncio.Semaphore) -> QueryResults:
+        """Run one function tool call, returning an error result rather than raising."""
+        function_name = tool_call.function.name
+        function = self.function_map.get(function_name)
+        if function is None:
+            error = f"Unknown function: {function_name}"
+            return QueryResults(display_format=error, json_format=json.dumps({"error": error}))
+
+        try:
+            arguments = json.loads(tool_call.function.arguments)
+        except json.JSONDecodeError as e:
+            error = f"Invalid {function_name} arguments: {e}"
+            return QueryResults(display_format=tool_call.function.arguments, json_format=json.dumps({"error": error}))
+
+        try:
+            async with semaphore:
+                return await asyncio.wait_for(function(arguments), timeout=TOOL_CALL_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            error = f"{function_name} did not finish within {TOOL_CALL_TIMEOUT_SECONDS:g} seconds."
+        except Exception as e:
+            error = f"{function_name} failed with error: {e}"
+        logger.error("Tool call %s: %s", tool_call.id, error)
+        return QueryResults(display_format=error, json_format=json.dumps({"error": error}))
+
+    async def run_tool_calls(self: "RunDriver", function_tool_calls: list) -> list[QueryResults]:
+        """Run the calls side by side, so the outputs are ready when the slowest call finishes."""
+        semaphore = asyncio.Semaphore(TOOL_CALL_CONCURRENCY)
+        return await asyncio.gather(
+            *[self.call_function(submit_tool_call, semaphore) for submit_tool_call in function_tool_calls]
+        )
+
+    def open_stream(
+        self: "RunDriver",
+        handler: EventHandler,
+        thread_id: str | None,
+        assistant_id: str,
+        thread: dict | None,
+        tool_outputs: list | None,
+        **run_params,
+    ):
+        """Open the stream for a round: a new run for the first round, then the run resumed with tool outputs."""
+        if tool_outputs is None and thread_id is None:
+            return self.async_openai_client.beta.threads.create_and_run_stream(
+                assistant_id=assistant_id, thread=thread, event_handler=handler, **run_params
+            )
+        if tool_outputs is None:
+            return self.async_openai_client.beta.threads.runs.stream(
+                thread_id=thread_id, assistant_id=assistant_id, event_handler=handler, **run_params
+            )
+        return self.async_openai_client.beta.threads.runs.submit_tool_outputs_stream(
+            thread_id=self.thread_id, run_id=self.run_id, tool_outputs=tool_outputs, event_handler=handler
+        )
+
+    async def run(
+        self: "RunDriver", thread_id: str | None, assistant_id: str, thread: dict | None = None, **run_params
+    ) -> None:
+        """Stream a new run on the thread, running tool calls until the run no longer requires action.
+
+        Without a thread_id, a new thread is created from `thread` together with the run.
+        """
+        tool_outputs = None
+        self.state.started = time.perf_counter()
+        ui_task: asyncio.Task | None = None
+
+        try:
+            for round_index in range(self.max_tool_rounds + 1):
+                timing = RoundTiming(round=round_index)
+                self.rounds.append(timing)
+
+                handler = EventHandler(self.state)
+                start = time.perf_counter()
+                stream_manager = self.open_stream(handler, thread_id, assistant_id, thread, tool_outputs, **run_params)
+                with span("run_stream" if tool_outputs is None else "tool_outputs_submit", round=round_index):
+                    async with stream_manager as stream:
+                        await stream.until_done()
+                timing.stream_ms = round((time.perf_counter() - start) * 1000, 1)
+
+                current_run = handler.current_run
+                if current_run is None:
+                    return
+                self.state.run_id = current_run.id
+                self.state.thread_id = current_run.thread_id
+                if current_run.status != "requires_action":
+                    if current_run.usage:
+                        self.total_tokens = current_run.usage.total_tokens
+                    logger.info("Run %s round %d: stream %.1f ms.", self.run_id, round_index, timing.stream_ms)
+                    return
+
+                if round_index == self.max_tool_rounds:
+                    logger.warning("Run %s stopped after %d tool rounds.", self.run_id, self.max_tool_rounds)
+                    await self.cancel_run(f"The assistant stopped after {self.max_tool_rounds} rounds of tool calls.")
+                    return
+
+                tool_calls = current_run.required_action.submit_tool_outputs.tool_calls
+                function_tool_calls = [call for call in tool_calls if call.type == "function"]
+                if not function_tool_calls:
+                    # There would be no outputs to submit, which the service rejects
+                    logger.warning("Run %s requires action without function tool calls.", self.run_id)
+                    await self.cancel_run("The assistant requested an action it can't take here.")
+                    return
+
+                start = time.perf_counter()
+                with span("tool_calls", tool_calls=len(function_tool_calls)):
+                    results = await self.run_tool_calls(function_tool_calls)
+                timing.tool_ms = round((time.perf_counter() - start) * 1000, 1)
+                timing.tool_calls = len(function_tool_calls)
+                logger.info(
+                    "Run %s round %d: stream %.1f ms, %d tool calls %.1f ms.",
+                    self.run_id,
+                    round_index,
+                    timing.stream_ms,
+                    timing.tool_calls,
+                    timing.tool_ms,
+                )
+
+                tool_outputs = [
+                    {"tool_call_id": submit_tool_call.id, "output": result.json_format}
+                    for submit_tool_call, result in zip(function_tool_calls, results)
+                ]
+
+                if ui_task:
+                    await ui_task
+                # The follow-up message is made current before the run resumes, so the next stream's images go
+                # to it, while the steps are sent alongside the submission rather than ahead of it
+                follow_up = cl.Message(author=self.state.assistant_name, content="")
+                self.state.current_message = follow_up
+                ui_task = asyncio.create_task(
+                    self.update_chainlit_function_ui("sql", function_tool_calls, results, follow_up)
+                )
+        finally:
+            if ui_task:
+                await ui_task
+            if self.state.current_message:
+                await self.state.current_message.update()
@@ -1,123 +1,376 @@
+import asyncio
 import json
 import os
+import time
+import weakref
+from contextlib import suppress
+from typing import Awaitable, Callable
 
 import aiosqlite
-import pandas as pd
 from pydantic import BaseModel
 
+from columnar_store import UnsupportedQueryError
+from connection_pool import DB_POOL_SIZE, ConnectionPool
+from query_cache import QueryCache
+from query_guard import (
+    ASK_DATABASE_MAX_VM_STEPS,
+    ASK_DATABASE_TIMEOUT_SECONDS,
+    PROGRESS_HANDLER_INTERVAL,
+    QueryGuard,
+)
+from query_plan_log import QueryPlanLog, format_query_plan
+from result_formatter import ResultFormatter
+from schema_cache import database_fingerprint, load_schema_digest, save_schema_digest
+from snapshot_store import (
+    SNAPSHOT_DIR,
+    SNAPSHOT_DRAIN_SECONDS,
+    SNAPSHOT_POLL_SECONDS,
+    DatabaseSnapshot,
+    latest_snapshot,
+)
+from telemetry import span
+
 DATA_BASE = "database/contoso-sales.db"
+FETCH_BATCH_SIZE = 256
+ASK_DATABASE_MAX_ROWS = int(os.getenv("ASK_DATABASE_MAX_ROWS", "30"))
+ASK_DATABASE_MAX_JSON_BYTES = int(os.getenv("ASK_DATABASE_MAX_JSON_BYTES", str(16 * 1024)))
 
 
 class QueryResults(BaseModel):
     display_format: str = ""
     json_format: str = ""
+    row_count: int = 0
+    truncated: bool = False
+
+
+class QueryAbortedError(Exception):
+    """Raised when a query is stopped for exceeding its time or instruction budget."""
 
 
 class SalesData:
-    def __init__(self: "SalesData") -> None:
-        self.conn = None
+    def __init__(
+        self: "SalesData",
+        pool_size: int = DB_POOL_SIZE,
+        max_rows: int = ASK_DATABASE_MAX_ROWS,
+        max_json_bytes: int = ASK_DATABASE_MAX_JSON_BYTES,
+        timeout_seconds: float = ASK_DATABASE_TIMEOUT_SECONDS,
+        max_vm_steps: int = ASK_DATABASE_MAX_VM_STEPS,
+    ) -> None:
+        self.pool_size = pool_size
+        self.max_rows = max_rows
+        self.max_json_bytes = max_json_bytes
+        self.timeout_seconds = timeout_seconds
+        self.max_vm_steps = max_vm_steps
+        self.__guards: weakref.WeakKeyDictionary[aiosqlite.Connection, QueryGuard] = weakref.WeakKeyDictionary()
+        # The database version queries are routed to; replaced when a new snapshot arrives
+        self.snapshot: DatabaseSnapshot | None = None
+        self.snapshot_switches = 0
+        # Called after switching to a new snapshot, whose schema digest may differ from the last one's
+        self.on_switch: Callable[[], Awaitable[None]] | None = None
+        self.__watcher: asyncio.Task | None = None
+        self.query_cache = QueryCache()
+        self.plan_log = QueryPlanLog()
+
+    @property
+    def pool(self: "SalesData") -> ConnectionPool | None:
+        return self.snapshot.pool if self.snapshot else None
 
     async def connect(self: "SalesData") -> None:
+        """Open the newest snapshot in SNAPSHOT_DIR, or the bundled database until there is one.
+
+        With SNAPSHOT_DIR set, the directory is then watched for new snapshots.
+        """
         env = os.getenv("ENV", "development")
-        db_uri = f"file:{'src/' if env == 'development' else ''}{DATA_BASE}?mode=ro"
+        db_path = f"{'src/' if env == 'development' else ''}{DATA_BASE}"
+        await asyncio.to_thread(self.plan_log.load)
+        if SNAPSHOT_DIR:
+            try:
+                db_path = await asyncio.to_thread(latest_snapshot, SNAPSHOT_DIR) or db_path
+            except OSError as e:
+                print(f"Unable to read the snapshot directory {SNAPSHOT_DIR}: {e}")
 
+        snapshot = DatabaseSnapshot(db_path)
         try:
-            self.conn = await aiosqlite.connect(db_uri, uri=True)
-            print("Database connection opened.")
+            await snapshot.open(self.pool_size, self.__prepare_connection)
         except aiosqlite.Error as e:
             print(f"An error occurred: {e}")
-            self.conn = None
+            return
+        self.__route_to(snapshot)
+        print(f"Database connection pool opened with {snapshot.pool.size} connections on {db_path}.")
+
+        if SNAPSHOT_DIR and self.__watcher is None:
+            self.__watcher = asyncio.create_task(self.__watch_snapshots())
+
+    async def __prepare_connection(self: "SalesData", conn: aiosqlite.Connection) -> None:
+        """Install a progress handler so runaway queries on this connection can be stopped."""
+        guard = QueryGuard(timeout_seconds=self.timeout_seconds, max_vm_steps=self.max_vm_steps)
+        await conn.set_progress_handler(guard, PROGRESS_HANDLER_INTERVAL)
+        self.__guards[conn] = guard
+
+    def __route_to(self: "SalesData", snapshot: DatabaseSnapshot) -> None:
+        """Send new queries to the snapshot; results cached from the previous one are dropped."""
+        self.snapshot = snapshot
+        self.query_cache.source_path = snapshot.path
+        self.query_cache.clear()
+
+    async def __watch_snapshots(self: "SalesData") -> None:
+        """Switch to each newer snapshot that arrives in SNAPSHOT_DIR, so data refreshes need no restart."""
+        failed_path = None
+        while True:
+            await asyncio.sleep(SNAPSHOT_POLL_SECONDS)
+            try:
+                db_path = await asyncio.to_thread(latest_snapshot, SNAPSHOT_DIR)
+            except OSError as e:
+                print(f"Unable to read the snapshot directory {SNAPSHOT_DIR}: {e}")
+                continue
+            if db_path is None or db_path in (self.snapshot.path, failed_path):
+                continue
+            try:
+                await self.switch_snapshot(db_path)
+            except aiosqlite.Error as e:
+                # Not retried until a newer snapshot arrives
+                print(f"Database snapshot {db_path} could not be opened, still serving {self.snapshot.path}: {e}")
+                failed_path = db_path
+
+    async def switch_snapshot(self: "SalesData", db_path: str) -> None:
+        """Open a database snapshot and route new queries to it, then close the previous one.
+
+        Queries already running on the previous snapshot finish on it, for up to SNAPSHOT_DRAIN_SECONDS.
+        Raises aiosqlite.Error, and keeps serving the current snapshot, if the new one can't be opened.
+        """
+        snapshot = DatabaseSnapshot(db_path)
+        await snapshot.open(self.pool_size, self.__prepare_connection)
+        previous = self.snapshot
+        self.__route_to(snapshot)
+        self.snapshot_switches += 1
+        print(f"Switched to database snapshot {db_path}.")
+
+        if self.on_switch:
+            try:
+                await self.on_switch()
+            except Exception as e:
+                print(f"An error occurred after switching database snapshots: {e}")
+        if previous:
+            await previous.close(SNAPSHOT_DRAIN_SECONDS)
+            print(f"Database snapshot {previous.path} closed.")
 
     async def close(self: "SalesData") -> None:
-        if self.conn:
-            await self.conn.close()
-            print("Database connection closed.")
-
-    async def __get_table_names(self: "SalesData") -> list:
-        """Return a list of table names."""
-        table_names = []
-        async with self.conn.execute("SELECT name FROM sqlite_master WHERE type='table';") as tables:
-            async for table in tables:
-                if table[0] != "sqlite_sequence":
-                    table_names.append(table[0])
-        return table_names
-
-    async def __get_column_info(self: "SalesData", table_name: str) -> list:
-        """Return a list of tuples containing column names and their types."""
-        column_info = []
-        async with self.conn.execute(f"PRAGMA table_info('{table_name}');") as columns:
-            async for col in columns:
-                column_info.append(f"{col[1]}: {col[2]}")  # col[1] is the column name, col[2] is the column type
+        if self.__watcher:
+            self.__watcher.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.__watcher
+            self.__watcher = None
+        if self.snapshot:
+            await self.snapshot.close()
+            self.snapshot = None
+            print("Database connection pool closed.")
+
+    async def __get_column_info(self: "SalesData", conn: aiosqlite.Connection) -> dict[str, list]:
+        """Return the column names and types of every table, read from the schema in one query."""
+        column_info: dict[str, list] = {}
+        async with conn.execute(
+            "SELECT m.name, p.name, p.type FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p "
+            "WHERE m.type = 'table' AND m.name != 'sqlite_sequence' ORDER BY m.rowid, p.cid;"
+        ) as columns:
+            async for table_name, column_name, column_type in columns:
+                column_info.setdefault(table_name, []).append(f"{column_name}: {column_type}")
         return column_info
 
-    async def __get_regions(self: "SalesData") -> list:
-        """Return a list of unique regions in the database."""
-        async with self.conn.execute("SELECT DISTINCT region FROM sales_data;") as regions:
-            result = await regions.fetchall()
-        return [region[0] for region in result]
-
-    async def __get_product_types(self: "SalesData") -> list:
-        """Return a list of unique product types in the database."""
-        async with self.conn.execute("SELECT DISTINCT product_type FROM sales_data;") as product_types:
-            result = await product_types.fetchall()
-        return [product_type[0] for product_type in result]
-
-    async def __get_product_categories(self: "SalesData") -> list:
-        """Return a list of unique product categories in the database."""
-        async with self.conn.execute("SELECT DISTINCT main_category FROM sales_data;") as product_categories:
-            result = await product_categories.fetchall()
-        return [product_category[0] for product_category in result]
-
-    async def __get_reporting_years(self: "SalesData") -> list:
-        """Return a list of unique reporting years in the database."""
-        async with self.conn.execute("SELECT DISTINCT year FROM sales_data ORDER BY year;") as reporting_years:
-            result = await reporting_years.fetchall()
-        return [str(reporting_year[0]) for reporting_year in result]
+    async def __get_query_field_values(self: "SalesData", conn: aiosqlite.Connection) -> dict[str, list]:
+        """Return the unique regions, product types, product categories and reporting years.
+
+        One statement; each column has its own index, so every part is a covering index scan.
+        """
+        field_values: dict[str, list] = {"region": [], "product_type": [], "main_category": [], "year": []}
+        query = " UNION ALL ".join(
+            f"SELECT '{field}', {field} FROM (SELECT DISTINCT {field} FROM sales_data ORDER BY {field})"
+            for field in field_values
+        )
+        async with conn.execute(f"{query};") as values:
+            async for field, value in values:
+                field_values[field].append(str(value))
+        return field_values
 
     async def get_database_info(self: "SalesData") -> str:
-        """Return a string containing the database schema information and common query fields."""
-        table_dicts = []
-        for table_name in await self.__get_table_names():
-            columns_names = await self.__get_column_info(table_name)
-            table_dicts.append({"table_name": table_name, "column_names": columns_names})
+        """Return a string containing the database schema information and common query fields.
+
+        The result is cached in a sidecar file keyed by the database fingerprint, so restarts and other
+        replicas serving the same data don't need to query the database for it.
+        """
+        snapshot = self.snapshot
+        fingerprint = await asyncio.to_thread(database_fingerprint, snapshot.path)
+        if database_info := await asyncio.to_thread(load_schema_digest, snapshot.path, fingerprint):
+            return database_info
+
+        with snapshot.use():
+            async with snapshot.pool.acquire() as conn:
+                column_info = await self.__get_column_info(conn)
+                field_values = await self.__get_query_field_values(conn)
 
         database_info = "\n".join(
             [
-                f"Table {table['table_name']} Schema: Columns: {', '.join(table['column_names'])}"
-                for table in table_dicts
+                f"Table {table_name} Schema: Columns: {', '.join(column_names)}"
+                for table_name, column_names in column_info.items()
             ]
         )
-        regions = await self.__get_regions()
-        product_types = await self.__get_product_types()
-        product_categories = await self.__get_product_categories()
-        reporting_years = await self.__get_reporting_years()
-
-        database_info += f"\nRegions: {', '.join(regions)}"
-        database_info += f"\nProduct Types: {', '.join(product_types)}"
-        database_info += f"\nProduct Categories: {', '.join(product_categories)}"
-        database_info += f"\nReporting Years: {', '.join(reporting_years)}"
+        database_info += f"\nRegions: {', '.join(field_values['region'])}"
+        database_info += f"\nProduct Types: {', '.join(field_values['product_type'])}"
+        database_info += f"\nProduct Categories: {', '.join(field_values['main_category'])}"
+        database_info += f"\nReporting Years: {', '.join(field_values['year'])}"
         database_info += "\n\n"
 
+        await asyncio.to_thread(save_schema_digest, snapshot.path, fingerprint, database_info)
         return database_info
 
+    async def __execute(self: "SalesData", conn: aiosqlite.Connection, query: str) -> ResultFormatter:
+        """Run the query under the connection's guard and stream its rows into a formatter."""
+        guard = self.__guards[conn]
+        guard.start()
+        try:
+            async with conn.execute(query) as cursor:
+                formatter = ResultFormatter(
+                    [description[0] for description in cursor.description],
+                    max_rows=self.max_rows,
+                    max_json_bytes=self.max_json_bytes,
+                )
+                # Stream the rows once and stop as soon as the row or size limit is reached,
+                # fetching one row past the row limit to tell whether the result was cut short
+                batch_size = min(FETCH_BATCH_SIZE, self.max_rows + 1)
+                while rows := await cursor.fetchmany(batch_size):
+                    if not formatter.add_rows(rows):
+                        break
+        except asyncio.CancelledError:
+            # The chat run was stopped: abort the statement on the worker thread rather than let it run on
+            guard.cancel()
+            await conn.interrupt()
+            raise
+        except Exception as e:
+            guard.stop()
+            if guard.reason and isinstance(e, aiosqlite.OperationalError):
+                raise QueryAbortedError(guard.reason) from e
+            raise
+
+        guard.stop()
+        return formatter
+
+    async def __execute_columnar(self: "SalesData", snapshot: DatabaseSnapshot, query: str) -> ResultFormatter | None:
+        """Answer the query from the in-memory columns, or return None if it has to run on SQLite."""
+        try:
+            result = await asyncio.to_thread(snapshot.columnar.execute, query)
+        except UnsupportedQueryError:
+            return None
+        except Exception as e:
+            # A bug in the columnar executor must not fail a query SQLite can answer
+            print(f"Columnar query failed, falling back to SQLite: {e}")
+            return None
+        if result is None:
+            return None
+
+        column_names, rows = result
+        formatter = ResultFormatter(column_names, max_rows=self.max_rows, max_json_bytes=self.max_json_bytes)
+        formatter.add_rows(rows)
+        return formatter
+
+    async def __execute_with_rollups(
+        self: "SalesData", snapshot: DatabaseSnapshot, conn: aiosqlite.Connection, query: str
+    ) -> tuple[ResultFormatter, str]:
+        """Run the query against the rollups when they can answer it, and against the table otherwise.
+
+        Returns the formatter and which of the two answered the query.
+        """
+        try:
+            rollup_query = snapshot.rollups.rewrite(query)
+        except Exception as e:
+            # A bug in the rewriter must not fail a query the table can answer
+            print(f"Unable to rewrite the query for the rollups, running it on the table: {e}")
+            rollup_query = None
+        if rollup_query:
+            try:
+                return await self.__execute(conn, rollup_query), "rollups"
+            except aiosqlite.Error as e:
+                # The query is answered from the table instead, with any error it has there
+                print(f"Rollup query failed, falling back to the table: {e}")
+        return await self.__execute(conn, query), "sqlite"
+
+    async def __record_query_plan(
+        self: "SalesData", snapshot: DatabaseSnapshot, query: str, backend: str, elapsed_ms: float, row_count: int
+    ) -> None:
+        """Log the query's plan on the table with its execution time, for the offline index advisor."""
+        try:
+            async with snapshot.pool.acquire() as conn:
+                async with conn.execute(f"EXPLAIN QUERY PLAN {query}") as cursor:
+                    plan = format_query_plan(await cursor.fetchall())
+        except aiosqlite.Error as e:
+            print(f"Unable to record the query plan: {e}")
+            return
+        await asyncio.to_thread(self.plan_log.record, query, plan, elapsed_ms, row_count, backend)
+
+    def __mark_truncated(self: "SalesData", data_results: QueryResults) -> None:
+        """Tell the model the result was cut short so it can refine the query."""
+        message = (
+            f"Results truncated to the first {data_results.row_count} rows "
+            f"(limit {self.max_rows} rows, {self.max_json_bytes} bytes). "
+            "Aggregate, filter or add a LIMIT to the query to get complete results."
+        )
+        data_results.truncated = True
+        data_results.display_format += f"\n\n{message}"
+        # Bounded by max_json_bytes, so parsing it again is cheap
+        payload = {**json.loads(data_results.json_format), "truncated": True, "message": message}
+        data_results.json_format = json.dumps(payload, separators=(",", ":"))
+
     async def ask_database(self: "SalesData", query: str) -> QueryResults:
         """Function to query SQLite database with a provided SQL query."""
+        with span("ask_database") as attributes:
+            cached_results = self.query_cache.get(query)
+            attributes["cache_hit"] = cached_results is not None
+            data_results = cached_results if cached_results is not None else await self.__query_database(query)
+            attributes["row_count"] = data_results.row_count
+            attributes["truncated"] = data_results.truncated
+            return data_results
+
+    async def __query_database(self: "SalesData", query: str) -> QueryResults:
         data_results = QueryResults()
 
         try:
-            # Perform the query asynchronously
-            async with self.conn.execute(query) as cursor:
-                rows = await cursor.fetchall()
-                columns = [description[0] for description in cursor.description]
-
-            if not rows:  # No need to create DataFrame if there are no rows
-                data_results.display_format = "The query returned no results. Try a different query."
-                data_results.json_format = ""
-            else:
-                # Only create DataFrame if there are rows
-                data = pd.DataFrame(rows, columns=columns)
-                data_results.display_format = data.to_string(index=False)
-                data_results.json_format = data.to_json(index=False, orient="split")
+            snapshot = self.snapshot
+            if snapshot is None:
+                raise aiosqlite.ProgrammingError("The database is not connected.")
+
+            # The whole query runs on the snapshot it started on, even if a newer one takes over meanwhile
+            with snapshot.use():
+                start = time.perf_counter()
+                formatter = await self.__execute_columnar(snapshot, query) if snapshot.columnar.enabled else None
+                backend = "columnar"
+                if formatter is None:
+                    # Lease a pooled connection so concurrent queries don't queue behind each other
+                    async with snapshot.pool.acquire() as conn:
+                        start = time.perf_counter()
+                        formatter, backend = await self.__execute_with_rollups(snapshot, conn, query)
+                elapsed_ms = (time.perf_counter() - start) * 1000
+
+                if formatter.row_count == 0 and not formatter.truncated:
+                    data_results.display_format = "The query returned no results. Try a different query."
+                    data_results.json_format = ""
+                else:
+                    data_results.display_format, data_results.json_format = formatter.format()
+                    data_results.row_count = formatter.row_count
+
+                if formatter.truncated:
+                    self.__mark_truncated(data_results)
+
+                # A result from a snapshot that has since been replaced would be stale in the cache
+                if snapshot is self.snapshot:
+                    self.query_cache.put(
+                        query, data_results, size=len(data_results.display_format) + len(data_results.json_format)
+                    )
+
+                if self.plan_log.is_new(query):
+                    await self.__record_query_plan(snapshot, query, backend, elapsed_ms, formatter.row_count)
+
+        except QueryAbortedError as e:
+            error_message = f"Query stopped: {e}"
+            data_results.display_format = error_message
+            data_results.json_format = json.dumps({"error": str(e), "query": query})
 
         except Exception as e:
             error_message = f"Query failed with error: {e}"
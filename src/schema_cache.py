@@ -0,0 +1,77 @@
+import hashlib
+import json
+import logging
+import os
+from contextlib import suppress
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Directory for the schema digest sidecar; defaults to the database's own directory.
+# Point replicas at a shared directory to compute the digest once for all of them.
+SCHEMA_CACHE_DIR = os.getenv("SCHEMA_CACHE_DIR")
+SCHEMA_CACHE_VERSION = 1
+
+FINGERPRINT_PAGE_SIZE = 4096
+FINGERPRINT_SAMPLE_PAGES = 32
+
+
+def database_fingerprint(db_path: str) -> str:
+    """Return a content fingerprint of a SQLite file that doesn't require reading all of it.
+
+    The file size, the first page (which holds the SQLite header and schema root) and a fixed sample of
+    pages spread over the file are hashed. Copies of the same file on other replicas get the same
+    fingerprint regardless of their modification times.
+    """
+    path = Path(db_path)
+    size = path.stat().st_size
+    digest = hashlib.sha256(str(size).encode())
+    with path.open("rb") as file:
+        pages = max(1, size // FINGERPRINT_PAGE_SIZE)
+        offsets = {0} | {
+            (pages - 1) * index // max(1, FINGERPRINT_SAMPLE_PAGES - 1) * FINGERPRINT_PAGE_SIZE
+            for index in range(FINGERPRINT_SAMPLE_PAGES)
+        }
+        for offset in sorted(offsets):
+            file.seek(offset)
+            digest.update(file.read(FINGERPRINT_PAGE_SIZE))
+    return digest.hexdigest()
+
+
+def _sidecar_path(db_path: str) -> Path:
+    path = Path(db_path)
+    directory = Path(SCHEMA_CACHE_DIR) if SCHEMA_CACHE_DIR else path.parent
+    return directory / f"{path.name}.schema.json"
+
+
+def load_schema_digest(db_path: str, fingerprint: str) -> str | None:
+    """Return the cached schema digest for the database, or None if it is missing or stale."""
+    sidecar = _sidecar_path(db_path)
+    try:
+        with sidecar.open("r", encoding="utf-8") as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if cached.get("version") != SCHEMA_CACHE_VERSION or cached.get("fingerprint") != fingerprint:
+        return None
+    return cached.get("database_info")
+
+
+def save_schema_digest(db_path: str, fingerprint: str, database_info: str) -> None:
+    """Persist the schema digest next to the database; failures are logged and otherwise ignored."""
+    sidecar = _sidecar_path(db_path)
+    temp_path = sidecar.with_name(f"{sidecar.name}.{os.getpid()}.tmp")
+    try:
+        sidecar.parent.mkdir(parents=True, exist_ok=True)
+        with temp_path.open("w", encoding="utf-8") as file:
+            json.dump(
+                {"version": SCHEMA_CACHE_VERSION, "fingerprint": fingerprint, "database_info": database_info}, file
+            )
+        # Atomic, so other replicas never read a partially written file
+        temp_path.replace(sidecar)
+    except OSError as e:
+        logger.warning("Unable to save the schema digest to %s: %s", sidecar, str(e))
+        with suppress(OSError):
+            temp_path.unlink(missing_ok=True)
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Awaitable, Callable, Iterator
+
+import aiosqlite
+
+from columnar_store import COLUMNAR_ENABLED, ColumnarStore
+from connection_pool import DB_POOL_SIZE, ConnectionPool
+from rollup_store import ROLLUP_SCHEMA, ROLLUPS_ENABLED, RollupStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Directory of versioned database snapshots, one subdirectory per version holding SNAPSHOT_FILE.
+# The version whose name sorts last is served, and newer versions are switched to as they arrive.
+# Unset to serve the database bundled with the app.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR")
+SNAPSHOT_FILE = "contoso-sales.db"
+SNAPSHOT_POLL_SECONDS = float(os.getenv("SNAPSHOT_POLL_SECONDS", "10"))
+# How long queries still running on a replaced snapshot get to finish before its connections are closed
+SNAPSHOT_DRAIN_SECONDS = float(os.getenv("SNAPSHOT_DRAIN_SECONDS", "30"))
+# Bytes of the database file each connection reads through a memory map rather than read() calls
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Page cache of each connection in KiB
+DB_CACHE_SIZE_KIB = int(os.getenv("DB_CACHE_SIZE_KIB", str(64 * 1024)))
+
+
+def database_uri(db_path: str) -> str:
+    """Return the URI that opens a database file as immutable.
+
+    SQLite then takes no locks and doesn't check the file for changes by other processes on every read.
+    The file must never be modified while it is open; new data is published as a new file or snapshot.
+    """
+    return f"{Path(db_path).resolve().as_uri()}?mode=ro&immutable=1"
+
+
+def latest_snapshot(directory: str) -> str | None:
+    """Return the database file of the newest snapshot version in the directory, or None if there is none.
+
+    Directories starting with a dot are ignored, so a version can be written under a hidden name and
+    renamed into place once it is complete.
+    """
+    versions = sorted(
+        entry
+        for entry in Path(directory).iterdir()
+        if entry.is_dir() and not entry.name.startswith(".") and (entry / SNAPSHOT_FILE).is_file()
+    )
+    return str(versions[-1] / SNAPSHOT_FILE) if versions else None
+
+
+class DatabaseSnapshot:
+    """One version of the database, with its connection pool and the rollups and columns built from it.
+
+    Queries hold the snapshot while they run, so a newer snapshot can take over new queries while the
+    ones already running finish on this one.
+    """
+
+    def __init__(self: "DatabaseSnapshot", db_path: str) -> None:
+        self.path = db_path
+        self.pool: ConnectionPool | None = None
+        self.rollups = RollupStore()
+        self.columnar = ColumnarStore()
+        self._active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def active(self: "DatabaseSnapshot") -> int:
+        """The number of queries using the snapshot."""
+        return self._active
+
+    async def open(
+        self: "DatabaseSnapshot",
+        pool_size: int = DB_POOL_SIZE,
+        on_connect: Callable[[aiosqlite.Connection], Awaitable[None]] | None = None,
+    ) -> None:
+        """Build the rollups, load the columns and open the connection pool.
+
+        Raises aiosqlite.Error, with nothing left open, if the file can't be opened as a database.
+        """
+        if ROLLUPS_ENABLED:
+            # Built before the pool opens, so every connection can attach them
+            await asyncio.to_thread(self.rollups.load, self.path)
+        if COLUMNAR_ENABLED:
+            try:
+                await asyncio.to_thread(self.columnar.load, self.path)
+            except sqlite3.Error as e:
+                logger.warning("Columnar store not loaded, queries will run on SQLite: %s", str(e))
+
+        async def prepare_connection(conn: aiosqlite.Connection) -> None:
+            await conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE};")
+            await conn.execute(f"PRAGMA cache_size = {-DB_CACHE_SIZE_KIB};")
+            # Reads the schema, so a file that isn't a database fails here rather than on the first query
+            async with conn.execute("SELECT COUNT(*) FROM sqlite_master;") as cursor:
+                await cursor.fetchone()
+            if self.rollups.enabled:
+                await conn.execute(f"ATTACH DATABASE ? AS {ROLLUP_SCHEMA};", (self.rollups.uri,))
+            if on_connect:
+                await on_connect(conn)
+
+        pool = ConnectionPool(database_uri(self.path), size=pool_size, on_connect=prepare_connection)
+        try:
+            await pool.open()
+        except BaseException:
+            await pool.close()
+            raise
+        self.pool = pool
+
+    @contextmanager
+    def use(self: "DatabaseSnapshot") -> Iterator["DatabaseSnapshot"]:
+        """Hold the snapshot open for the duration of the context."""
+        self._active += 1
+        self._idle.clear()
+        try:
+            yield self
+        finally:
+            self._active -= 1
+            if self._active == 0:
+                self._idle.set()
+
+    async def close(self: "DatabaseSnapshot", drain_seconds: float = 0) -> None:
+        """Wait up to `drain_seconds` for the queries using the snapshot to finish, then close its pool."""
+        if drain_seconds > 0:
+            try:
+                await asyncio.wait_for(self._idle.wait(), drain_seconds)
+            except asyncio.TimeoutError:
+                logger.warning("Closing database snapshot %s with %d queries still running.", self.path, self._active)
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
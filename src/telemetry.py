@@ -0,0 +1,151 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+# Spans go to the OpenTelemetry tracer, which is a no-op until an SDK and exporter are configured
+TELEMETRY_TRACING = os.getenv("TELEMETRY_TRACING", "true").lower() == "true" and trace is not None
+METRICS_PREFIX = "contoso_sales"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_tracer = trace.get_tracer("contoso-sales-assistant") if TELEMETRY_TRACING else None
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in sorted(labels.items())) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """A Prometheus style histogram with one series per label value."""
+
+    def __init__(self: "Histogram", name: str, help_text: str, label: str, buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series: dict[str, list] = {}
+        # Observations come from the event loop and from worker threads
+        self._lock = threading.Lock()
+
+    def observe(self: "Histogram", label_value: str, value: float) -> None:
+        with self._lock:
+            counts, totals = self._series.setdefault(label_value, [[0] * len(self.buckets), [0, 0.0]])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            totals[0] += 1
+            totals[1] += value
+
+    def render(self: "Histogram") -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, (counts, (count, total)) in sorted(self._series.items()):
+                labels = {self.label: label_value}
+                for bound, bucket_count in zip(self.buckets, counts):
+                    bucket_labels = _format_labels({**labels, "le": _format_value(bound)})
+                    lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Counter:
+    """A Prometheus style counter with one series per label value."""
+
+    def __init__(self: "Counter", name: str, help_text: str, label: str) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self: "Counter", label_value: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self: "Counter") -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_value, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels({self.label: label_value})} {_format_value(value)}")
+        return lines
+
+
+stage_duration = Histogram(
+    f"{METRICS_PREFIX}_stage_duration_seconds", "Duration of each stage of a chat turn.", label="stage"
+)
+turns = Counter(f"{METRICS_PREFIX}_turns_total", "Chat turns by outcome.", "outcome")
+_collected: dict[str, tuple[str, str, Callable[[], float | None]]] = {}
+
+
+def register_metric(
+    name: str, help_text: str, callback: Callable[[], float | None], metric_type: str = "gauge"
+) -> None:
+    """Report `callback()` when metrics are scraped, for values kept elsewhere; None leaves the metric out."""
+    _collected[f"{METRICS_PREFIX}_{name}"] = (help_text, metric_type, callback)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[dict]:
+    """Time a stage of a turn as a tracing span and in the stage duration histogram.
+
+    The yielded dict can be filled with more attributes while the stage runs.
+    """
+    start = time.perf_counter()
+    if _tracer is None:
+        try:
+            yield attributes
+        finally:
+            stage_duration.observe(name, time.perf_counter() - start)
+        return
+
+    with _tracer.start_as_current_span(name) as current_span:
+        try:
+            yield attributes
+        finally:
+            stage_duration.observe(name, time.perf_counter() - start)
+            for key, value in attributes.items():
+                if value is not None:
+                    current_span.set_attribute(key, value)
+
+
+def record(name: str, seconds: float, **attributes) -> None:
+    """Record a stage measured elsewhere, such as the time to the first token of a run."""
+    stage_duration.observe(name, seconds)
+    if _tracer is not None:
+        end = time.time_ns()
+        current_span = _tracer.start_span(name, start_time=end - int(seconds * 1e9), attributes=attributes)
+        current_span.end(end_time=end)
+
+
+def render_metrics() -> str:
+    """Render all metrics in the Prometheus text exposition format."""
+    lines = stage_duration.render() + turns.render()
+    for name, (help_text, metric_type, callback) in sorted(_collected.items()):
+        try:
+            value = callback()
+        except Exception:
+            value = None
+        if value is not None:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}", f"{name} {_format_value(value)}"]
+    return "\n".join(lines) + "\n"
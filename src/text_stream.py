@@ -0,0 +1,102 @@
+import asyncio
+import os
+import re
+
+import chainlit as cl
+
+TEXT_STREAM_FLUSH_MS = float(os.getenv("TEXT_STREAM_FLUSH_MS", "30"))
+TEXT_STREAM_FLUSH_CHARS = int(os.getenv("TEXT_STREAM_FLUSH_CHARS", "256"))
+# Longest text held back waiting for a markdown link or citation to complete before it is sent as is
+TEXT_STREAM_MAX_HELD_CHARS = 1024
+
+# Neither pattern spans lines, so text before the last newline is final
+markdown_link_pattern = re.compile(r"\[(.*?)\][ \t]*\([ \t]*.*?[ \t]*\)")
+citation_pattern = re.compile(r"【.*?】")
+
+
+class TextStream:
+    """Streams assistant text to a Chainlit message in batches, rewriting links and citations on the way.
+
+    Deltas are added to a pending buffer. Text that can no longer become part of a markdown link or a
+    citation is rewritten and moved to the outgoing buffer, which is sent as a single token once it holds
+    `flush_chars` characters or `flush_ms` after the first unsent text. Only new text is scanned, so the
+    work per delta doesn't grow with the length of the answer.
+    """
+
+    def __init__(
+        self: "TextStream",
+        message: cl.Message,
+        citations_index: int = 1,
+        flush_ms: float = TEXT_STREAM_FLUSH_MS,
+        flush_chars: int = TEXT_STREAM_FLUSH_CHARS,
+    ) -> None:
+        self.message = message
+        self.citations_index = citations_index
+        self.flush_ms = flush_ms
+        self.flush_chars = flush_chars
+        self._pending = ""
+        self._unlinked = ""
+        self._outgoing = ""
+        self._flush_task: asyncio.Task | None = None
+        # Keeps tokens in order when a scheduled flush and an immediate flush overlap
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _open_from(text: str, opening: str, pattern: re.Pattern) -> int:
+        """Return the index of the first opening character that may still start a match, or len(text)."""
+        search_start = text.rfind("\n") + 1
+        # Matches start at the leftmost opening character they can, so only one after the last match is open
+        for match in pattern.finditer(text, search_start):
+            search_start = match.end()
+        open_start = text.find(opening, search_start)
+        if open_start == -1 or len(text) - open_start > TEXT_STREAM_MAX_HELD_CHARS:
+            return len(text)
+        return open_start
+
+    def _next_citation(self: "TextStream", match: re.Match) -> str:
+        citation = f"[{self.citations_index}]"
+        self.citations_index += 1
+        return citation
+
+    def _release(self: "TextStream", final: bool = False) -> None:
+        # Links are rewritten first and citations are found in the rewritten text, so each stage holds back
+        # its own incomplete tail
+        held = len(self._pending) if final else self._open_from(self._pending, "[", markdown_link_pattern)
+        text, self._pending = self._pending[:held], self._pending[held:]
+        self._unlinked += markdown_link_pattern.sub(r"\1", text)
+
+        held = len(self._unlinked) if final else self._open_from(self._unlinked, "【", citation_pattern)
+        text, self._unlinked = self._unlinked[:held], self._unlinked[held:]
+        self._outgoing += citation_pattern.sub(self._next_citation, text)
+
+    async def _flush_later(self: "TextStream") -> None:
+        await asyncio.sleep(self.flush_ms / 1000)
+        self._flush_task = None
+        await self.flush()
+
+    async def add(self: "TextStream", text: str | None) -> None:
+        """Add a text delta, sending the outgoing buffer if it is full."""
+        if not text:
+            return
+        self._pending += text
+        self._release()
+
+        if len(self._outgoing) >= self.flush_chars:
+            await self.flush()
+        elif self._outgoing and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def flush(self: "TextStream") -> None:
+        """Send the outgoing buffer now."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        async with self._lock:
+            token, self._outgoing = self._outgoing, ""
+            if token:
+                await self.message.stream_token(token)
+
+    async def close(self: "TextStream") -> None:
+        """Rewrite and send all remaining text, including text held back for an incomplete link or citation."""
+        self._release(final=True)
+        await self.flush()
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import suppress
+
+from openai import AsyncAzureOpenAI
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Empty threads kept ready for new chat sessions; 0 creates every thread on demand
+THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", "2"))
+# Pooled threads older than this are deleted rather than handed out
+THREAD_POOL_MAX_AGE_SECONDS = float(os.getenv("THREAD_POOL_MAX_AGE_SECONDS", "3600"))
+
+
+class WarmThreadPool:
+    """A small pool of pre-created, empty assistant threads.
+
+    New sessions take a thread from the pool without waiting on the API, and the pool is refilled in
+    the background. Threads left in the pool at shutdown are deleted.
+    """
+
+    def __init__(
+        self: "WarmThreadPool",
+        async_openai_client: AsyncAzureOpenAI,
+        size: int = THREAD_POOL_SIZE,
+        max_age_seconds: float = THREAD_POOL_MAX_AGE_SECONDS,
+    ) -> None:
+        self.async_openai_client = async_openai_client
+        self.size = max(0, size)
+        self.max_age_seconds = max_age_seconds
+        self._threads: deque[tuple[str, float]] = deque()
+        self._refill_task: asyncio.Task | None = None
+        self._deletions: set[asyncio.Task] = set()
+        self._closed = False
+
+    @property
+    def available(self: "WarmThreadPool") -> int:
+        return len(self._threads)
+
+    async def _create(self: "WarmThreadPool") -> str:
+        thread = await self.async_openai_client.beta.threads.create()
+        return thread.id
+
+    async def _delete(self: "WarmThreadPool", thread_id: str) -> None:
+        with suppress(Exception):
+            await self.async_openai_client.beta.threads.delete(thread_id)
+
+    async def _refill(self: "WarmThreadPool") -> None:
+        while not self._closed and len(self._threads) < self.size:
+            try:
+                thread_id = await self._create()
+            except Exception as e:
+                logger.warning("Unable to pre-create a thread: %s", str(e))
+                return
+            if self._closed:
+                await self._delete(thread_id)
+                return
+            self._threads.append((thread_id, time.monotonic()))
+
+    def refill(self: "WarmThreadPool") -> None:
+        """Top the pool up in the background, unless a refill is already running."""
+        if self.size and not self._closed and (self._refill_task is None or self._refill_task.done()):
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def take(self: "WarmThreadPool") -> str:
+        """Return a new, empty thread id, from the pool when one is ready."""
+        while self._threads:
+            thread_id, created = self._threads.popleft()
+            if time.monotonic() - created <= self.max_age_seconds:
+                self.refill()
+                return thread_id
+            deletion = asyncio.create_task(self._delete(thread_id))
+            self._deletions.add(deletion)
+            deletion.add_done_callback(self._deletions.discard)
+
+        self.refill()
+        return await self._create()
+
+    async def close(self: "WarmThreadPool") -> None:
+        """Stop refilling and delete the threads that were never handed out."""
+        self._closed = True
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._refill_task
+        while self._threads:
+            thread_id, _ = self._threads.popleft()
+            await self._delete(thread_id)
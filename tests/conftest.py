@@ -0,0 +1,30 @@
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+import pytest
+from generate_sql import generate_database, years_growth
+
+TEST_ROWS = 20_000
+SEED = 42
+
+
+@pytest.fixture(scope="session")
+def sales_db(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """A generated sales database, the same on every run, shared by the whole session."""
+    path = tmp_path_factory.mktemp("database") / "contoso-sales.db"
+    generate_database(path, TEST_ROWS, years_growth, SEED)
+    return path
+
+
+@pytest.fixture
+def sales_conn(sales_db: Path) -> sqlite3.Connection:
+    """A read-only connection to the generated database, for reference results."""
+    with closing(sqlite3.connect(f"{sales_db.resolve().as_uri()}?mode=ro", uri=True)) as conn:
+        yield conn
+
+
+def run_query(conn: sqlite3.Connection, query: str) -> tuple[list[str], list[tuple]]:
+    """Return the column names and rows of a query."""
+    cursor = conn.execute(query)
+    return [description[0] for description in cursor.description], cursor.fetchall()
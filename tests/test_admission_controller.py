@@ -0,0 +1,127 @@
+import asyncio
+
+import httpx
+
+from admission_controller import AdmissionController
+
+
+async def admit_and_release(controller: AdmissionController, key: str, tokens: int) -> None:
+    async with controller.admit(key, tokens=tokens):
+        pass
+
+
+async def admit_in_order(controller: AdmissionController, requests: list[str]) -> list[str]:
+    """Queue a run for each key while another run holds the only slot, and return the order they run in."""
+    admitted = []
+
+    async def run(name: str) -> None:
+        async with controller.admit(name.split("-")[0], tokens=1):
+            admitted.append(name)
+
+    async with controller.admit("holder", tokens=1):
+        tasks = []
+        for name in requests:
+            tasks.append(asyncio.create_task(run(name)))
+            # Queued in the order listed
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        assert admitted == []
+    await asyncio.wait_for(asyncio.gather(*tasks), 1)
+    return admitted
+
+
+async def test_queued_runs_admitted_round_robin_across_sessions() -> None:
+    controller = AdmissionController(max_concurrent=1)
+
+    order = await admit_in_order(controller, ["a-1", "a-2", "a-3", "b-1", "c-1", "b-2"])
+
+    assert order == ["a-1", "b-1", "c-1", "a-2", "b-2", "a-3"]
+    assert controller.running == 0
+    assert controller.queue_depth() == 0
+
+
+async def test_idle_controller_admits_without_queueing() -> None:
+    controller = AdmissionController(max_concurrent=2)
+    positions = []
+
+    async def on_queued(position: int) -> None:
+        positions.append(position)
+
+    async with controller.admit("a", tokens=1, on_queued=on_queued), controller.admit("b", 1, on_queued):
+        assert controller.running == 2
+        assert controller.queue_depth() == 0
+    assert positions == []
+
+
+async def test_queue_position_reported_while_waiting() -> None:
+    controller = AdmissionController(max_concurrent=1)
+    positions = []
+
+    async def on_queued(position: int) -> None:
+        positions.append(position)
+
+    async def wait_for_turn() -> None:
+        async with controller.admit("other", tokens=1, on_queued=on_queued):
+            pass
+
+    async with controller.admit("holder", tokens=1):
+        waiting = asyncio.create_task(wait_for_turn())
+        await asyncio.sleep(0.01)
+        assert positions == [1]
+        assert controller.queue_depth() == 1
+    await asyncio.wait_for(waiting, 1)
+    assert controller.running == 0
+
+
+async def test_token_budget_limits_admissions() -> None:
+    controller = AdmissionController(tokens_per_minute=100, max_concurrent=0)
+
+    async with controller.admit("a", tokens=80):
+        waiting = asyncio.create_task(admit_and_release(controller, "b", 80))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        assert controller.queue_depth() == 1
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+
+
+async def test_limit_inferred_from_remaining_headers() -> None:
+    controller = AdmissionController(tokens_per_minute=0, requests_per_minute=0, max_concurrent=0)
+    controller.observe(httpx.Response(200, headers={"x-ratelimit-remaining-tokens": "100"}))
+    assert controller.tokens.capacity == 100
+
+    async with controller.admit("a", tokens=80):
+        waiting = asyncio.create_task(admit_and_release(controller, "b", 80))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+
+    # A higher remaining count raises the inferred limit, a reported limit replaces it
+    controller.observe(httpx.Response(200, headers={"x-ratelimit-remaining-tokens": "500"}))
+    assert controller.tokens.capacity == 500
+    controller.observe(httpx.Response(200, headers={"x-ratelimit-limit-tokens": "400"}))
+    controller.observe(httpx.Response(200, headers={"x-ratelimit-remaining-tokens": "450"}))
+    assert controller.tokens.capacity == 400
+
+
+async def test_rate_limited_response_pauses_admissions() -> None:
+    controller = AdmissionController(max_concurrent=0)
+    controller.observe(httpx.Response(429, headers={"retry-after-ms": "100"}))
+
+    waiting = asyncio.create_task(admit_and_release(controller, "a", 1))
+    await asyncio.sleep(0.02)
+    assert not waiting.done()
+    await asyncio.wait_for(waiting, 1)
+
+
+async def test_cancelled_waiter_leaves_queue() -> None:
+    controller = AdmissionController(max_concurrent=1)
+
+    async with controller.admit("holder", tokens=1):
+        waiting = asyncio.create_task(admit_and_release(controller, "a", 1))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert controller.queue_depth() == 0
+    assert controller.running == 0
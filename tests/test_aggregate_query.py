@@ -0,0 +1,64 @@
+import pytest
+
+from aggregate_query import parse_aggregate_query, select_clauses
+
+
+def test_parse_grouped_aggregate() -> None:
+    parsed = parse_aggregate_query(
+        "SELECT region, SUM(revenue) AS total FROM sales_data WHERE year = 2023 GROUP BY region ORDER BY total DESC"
+    )
+
+    assert parsed.table == "sales_data"
+    assert [(call.function, call.column) for call in parsed.aggregates] == [("SUM", "revenue")]
+    assert parsed.columns == {"region", "year"}
+    assert parsed.output_columns == {"region"}
+    assert parsed.group_by == {"region"}
+    assert parsed.query[slice(*parsed.clauses["WHERE"])] == "year = 2023"
+
+
+def test_group_by_position_and_alias() -> None:
+    parsed = parse_aggregate_query("SELECT month_date AS month, COUNT(*) FROM sales_data GROUP BY 1 ORDER BY month")
+
+    assert parsed.group_by == {"month_date"}
+    assert parsed.aggregates[0].column is None
+
+
+@pytest.mark.parametrize("position", ["1.5", "1e400", "1e0"])
+def test_group_by_non_integer_number_is_a_constant(position: str) -> None:
+    parsed = parse_aggregate_query(f"SELECT region, SUM(revenue) FROM sales_data GROUP BY {position}")
+
+    assert parsed.has_group_by
+    assert parsed.group_by == set()
+
+
+def test_scalar_functions_allowed() -> None:
+    parsed = parse_aggregate_query("SELECT UPPER(region), ROUND(AVG(revenue), 2) FROM sales_data GROUP BY region")
+
+    assert parsed is not None
+    assert parsed.output_columns == {"region"}
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "SELECT region, group_concat(product_type) FROM sales_data GROUP BY region",
+        "SELECT json_group_array(region) FROM sales_data",
+        "SELECT region, string_agg(product_type, ',') FROM sales_data GROUP BY region",
+        "SELECT * FROM sales_data",
+        "SELECT s.region, SUM(revenue) FROM sales_data AS s GROUP BY s.region",
+        "SELECT SUM(revenue * 2) FROM sales_data",
+        "SELECT region FROM sales_data UNION SELECT region FROM sales_data",
+        "SELECT COUNT(*) FROM sales_data; SELECT 1 FROM sales_data",
+    ],
+)
+def test_unsupported_queries_not_parsed(query: str) -> None:
+    assert parse_aggregate_query(query) is None
+
+
+def test_select_clauses_accepts_any_select_list() -> None:
+    assert select_clauses("SELECT * FROM sales_data WHERE year = 2023 ORDER BY id;") == {
+        "SELECT": "*",
+        "FROM": "sales_data",
+        "WHERE": "year = 2023",
+        "ORDER": "id",
+    }
@@ -0,0 +1,79 @@
+import math
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from columnar_store import ColumnarStore, UnsupportedQueryError
+from tests.conftest import run_query
+
+SUPPORTED_QUERIES = [
+    "SELECT COUNT(*) FROM sales_data",
+    "SELECT COUNT(*) FROM sales_data WHERE region = 'NOWHERE'",
+    "SELECT SUM(revenue), AVG(revenue), TOTAL(number_of_orders), MIN(discount) FROM sales_data WHERE region = 'X'",
+    "SELECT region, SUM(revenue) FROM sales_data GROUP BY region",
+    "SELECT region, SUM(revenue) AS total FROM sales_data WHERE year = 2023 GROUP BY region ORDER BY total DESC",
+    "SELECT main_category, AVG(revenue) FROM sales_data GROUP BY 1 ORDER BY 2 DESC LIMIT 3",
+    "SELECT month_date, SUM(revenue) FROM sales_data GROUP BY month_date ORDER BY month_date",
+    "SELECT year, MIN(discount), MAX(shipping_cost), COUNT(discount), SUM(discount), AVG(discount) "
+    "FROM sales_data GROUP BY year",
+    "SELECT region, COUNT(DISTINCT product_type) FROM sales_data WHERE region = 'EUROPE' GROUP BY region",
+    "SELECT region, SUM(revenue) FROM sales_data GROUP BY region HAVING SUM(revenue) > 3000000",
+    "SELECT SUM(shipping_cost), AVG(shipping_cost) FROM sales_data",
+    "SELECT region, main_category, year, SUM(shipping_cost) s FROM sales_data "
+    "WHERE discount > 0.1 AND revenue BETWEEN 100 AND 5000 GROUP BY region, main_category, year "
+    "ORDER BY s DESC LIMIT 10 OFFSET 2",
+    "SELECT product_type, COUNT(*) FROM sales_data WHERE product_type LIKE '%ski%' OR region IN ('EUROPE', 'CHINA') "
+    "GROUP BY product_type",
+    "SELECT region, MIN(product_type), MAX(month_date) FROM sales_data WHERE NOT (year < 2023) GROUP BY region",
+    "SELECT month, year, SUM(revenue) FROM sales_data WHERE month >= 6 GROUP BY year, month ORDER BY year DESC, month",
+    "SELECT region FROM sales_data GROUP BY region",
+    'select Region, sum("revenue") from SALES_DATA group by region;',
+    "SELECT region, SUM(revenue) FROM sales_data WHERE 2023 = year GROUP BY region",
+]
+
+UNSUPPORTED_QUERIES = [
+    "SELECT region, SUM(revenue) FROM sales_data WHERE year = '2023' GROUP BY region",
+    "SELECT region, UPPER(region), SUM(revenue) FROM sales_data GROUP BY region",
+    "SELECT region, product_type FROM sales_data GROUP BY region",
+]
+
+
+@pytest.fixture(scope="module")
+def columnar(sales_db: Path) -> ColumnarStore:
+    columnar = ColumnarStore()
+    columnar.load(str(sales_db))
+    assert columnar.enabled
+    return columnar
+
+
+def assert_same_rows(expected: list[tuple], actual: list[tuple]) -> None:
+    """Compare rows value by value and type by type, allowing rounding differences in float sums."""
+    assert len(actual) == len(expected)
+    for expected_row, actual_row in zip(expected, actual):
+        assert len(actual_row) == len(expected_row)
+        for expected_value, actual_value in zip(expected_row, actual_row):
+            assert type(actual_value) is type(expected_value)
+            if isinstance(expected_value, float):
+                assert math.isclose(actual_value, expected_value, rel_tol=1e-12)
+            else:
+                assert actual_value == expected_value
+
+
+@pytest.mark.parametrize("query", SUPPORTED_QUERIES)
+def test_matches_sqlite(columnar: ColumnarStore, sales_conn: sqlite3.Connection, query: str) -> None:
+    expected_columns, expected_rows = run_query(sales_conn, query)
+
+    columns, rows = columnar.execute(query)
+    assert columns == expected_columns
+    assert_same_rows(expected_rows, rows)
+
+
+@pytest.mark.parametrize("query", UNSUPPORTED_QUERIES)
+def test_unsupported_query(columnar: ColumnarStore, query: str) -> None:
+    with pytest.raises(UnsupportedQueryError):
+        columnar.execute(query)
+
+
+def test_non_aggregate_query_left_to_sqlite(columnar: ColumnarStore) -> None:
+    assert columnar.execute("SELECT region, revenue FROM sales_data LIMIT 3") is None
@@ -0,0 +1,65 @@
+import asyncio
+from pathlib import Path
+
+import aiosqlite
+import pytest
+
+from connection_pool import ConnectionPool
+
+
+def pool_for(sales_db: Path, size: int) -> ConnectionPool:
+    return ConnectionPool(f"{sales_db.resolve().as_uri()}?mode=ro", size=size)
+
+
+async def test_leases_distinct_connections(sales_db: Path) -> None:
+    pool = pool_for(sales_db, 2)
+    await pool.open()
+    try:
+        async with pool.acquire() as first, pool.acquire() as second:
+            assert first is not second
+            assert pool.idle == 0
+        assert pool.idle == 2
+    finally:
+        await pool.close()
+
+
+async def test_waits_for_a_returned_connection(sales_db: Path) -> None:
+    pool = pool_for(sales_db, 1)
+    await pool.open()
+
+    async def lease() -> aiosqlite.Connection:
+        async with pool.acquire() as conn:
+            return conn
+
+    try:
+        async with pool.acquire() as leased:
+            waiter = asyncio.create_task(lease())
+            await asyncio.sleep(0.05)
+            assert not waiter.done()
+        assert await asyncio.wait_for(waiter, 1) is leased
+    finally:
+        await pool.close()
+
+
+async def test_connection_kept_after_failed_query(sales_db: Path) -> None:
+    pool = pool_for(sales_db, 1)
+    await pool.open()
+    try:
+        with pytest.raises(aiosqlite.OperationalError):
+            async with pool.acquire() as failed:
+                await failed.execute("SELECT missing FROM sales_data;")
+        async with pool.acquire() as conn, conn.execute("SELECT COUNT(*) FROM sales_data;") as cursor:
+            assert conn is failed
+            assert (await cursor.fetchone())[0] > 0
+    finally:
+        await pool.close()
+
+
+async def test_acquire_after_close_fails(sales_db: Path) -> None:
+    pool = pool_for(sales_db, 1)
+    await pool.open()
+    await pool.close()
+
+    with pytest.raises(aiosqlite.ProgrammingError):
+        async with pool.acquire():
+            pass
@@ -0,0 +1,95 @@
+import time
+from pathlib import Path
+
+import pytest
+from pydantic import BaseModel
+
+from query_cache import QueryCache, normalize_sql
+
+
+class Result(BaseModel):
+    value: str = ""
+
+
+@pytest.mark.parametrize(
+    ("first", "second"),
+    [
+        ("SELECT region FROM sales_data", "select region from sales_data;"),
+        ("SELECT region\n  FROM sales_data -- regions\n", "SELECT region FROM sales_data"),
+        ("SELECT SUM(revenue) AS total FROM sales_data", "SELECT sum(revenue) as total FROM sales_data"),
+        ("SELECT a FROM t /* note */ WHERE b = 1;;", "SELECT a FROM t WHERE b = 1"),
+    ],
+)
+def test_normalize_sql_same_key(first: str, second: str) -> None:
+    assert normalize_sql(first) == normalize_sql(second)
+
+
+@pytest.mark.parametrize(
+    ("first", "second"),
+    [
+        # String literals are compared as written
+        ("SELECT * FROM t WHERE region = 'EUROPE'", "SELECT * FROM t WHERE region = 'europe'"),
+        # The result column is named after the unaliased expression as written
+        ("SELECT sum(revenue) FROM sales_data", "SELECT SUM(revenue) FROM sales_data"),
+        ("SELECT a FROM t WHERE year = 2022", "SELECT a FROM t WHERE year = 2023"),
+    ],
+)
+def test_normalize_sql_different_key(first: str, second: str) -> None:
+    assert normalize_sql(first) != normalize_sql(second)
+
+
+def test_get_returns_copy_of_cached_result() -> None:
+    cache = QueryCache()
+    cache.put("SELECT 1", Result(value="one"), size=3)
+
+    cached = cache.get("select 1;")
+    assert cached == Result(value="one")
+    cached.value = "changed"
+    assert cache.get("SELECT 1") == Result(value="one")
+    assert (cache.stats.hits, cache.stats.misses) == (2, 0)
+
+
+def test_least_recently_used_entry_evicted() -> None:
+    cache = QueryCache(max_entries=2)
+    cache.put("SELECT 1", Result(value="1"), size=1)
+    cache.put("SELECT 2", Result(value="2"), size=1)
+    cache.get("SELECT 1")
+    cache.put("SELECT 3", Result(value="3"), size=1)
+
+    assert cache.get("SELECT 2") is None
+    assert cache.get("SELECT 1") is not None
+    assert cache.stats.evictions == 1
+
+
+def test_size_limit() -> None:
+    cache = QueryCache(max_bytes=10)
+    cache.put("SELECT 1", Result(), size=11)
+    assert cache.get("SELECT 1") is None
+
+    cache.put("SELECT 1", Result(), size=6)
+    cache.put("SELECT 2", Result(), size=6)
+    assert cache.get("SELECT 1") is None
+    assert cache.stats.size_bytes == 6
+
+
+def test_expired_entry_is_a_miss() -> None:
+    cache = QueryCache(ttl_seconds=0.01)
+    cache.put("SELECT 1", Result(), size=1)
+    time.sleep(0.02)
+
+    assert cache.get("SELECT 1") is None
+    assert cache.stats.expirations == 1
+
+
+def test_replaced_source_clears_cache(tmp_path: Path) -> None:
+    source = tmp_path / "contoso-sales.db"
+    source.write_bytes(b"first")
+    cache = QueryCache(source_path=str(source))
+    cache.put("SELECT 1", Result(), size=1)
+
+    replacement = tmp_path / "new.db"
+    replacement.write_bytes(b"second version")
+    replacement.replace(source)
+
+    assert cache.get("SELECT 1") is None
+    assert cache.stats.invalidations == 1
@@ -0,0 +1,45 @@
+from pathlib import Path
+
+from query_plan_log import QueryPlanLog, read_query_plan_log
+
+QUERY = "SELECT region, SUM(revenue) FROM sales_data GROUP BY region"
+
+
+def test_first_run_of_each_query_recorded(tmp_path: Path) -> None:
+    plan_log = QueryPlanLog(str(tmp_path / "plans.jsonl"))
+    plan_log.load()
+
+    assert plan_log.is_new(QUERY)
+    plan_log.record(QUERY, ["SCAN sales_data"], 1.5, 5, "sqlite")
+    assert not plan_log.is_new("select region, SUM(revenue)\n  from sales_data group by region;")
+    assert plan_log.is_new("SELECT region, SUM(revenue) FROM sales_data WHERE year = 2023 GROUP BY region")
+
+    [entry] = read_query_plan_log(plan_log.path)
+    assert entry.query == QUERY
+    assert entry.backend == "sqlite"
+
+
+def test_is_new_does_not_read_the_log(tmp_path: Path) -> None:
+    QueryPlanLog(str(tmp_path / "plans.jsonl")).record(QUERY, [], 1.0, 1, "sqlite")
+    plan_log = QueryPlanLog(str(tmp_path / "plans.jsonl"))
+
+    assert plan_log.is_new(QUERY)
+    # Until the log is loaded, record still skips the queries already in it
+    plan_log.record(QUERY, [], 1.0, 1, "sqlite")
+    assert len(read_query_plan_log(plan_log.path)) == 1
+
+
+def test_queries_logged_before_startup_not_new(tmp_path: Path) -> None:
+    QueryPlanLog(str(tmp_path / "plans.jsonl")).record(QUERY, [], 1.0, 1, "sqlite")
+    plan_log = QueryPlanLog(str(tmp_path / "plans.jsonl"))
+    plan_log.load()
+
+    assert not plan_log.is_new(QUERY)
+
+
+def test_disabled_without_a_path() -> None:
+    plan_log = QueryPlanLog(None)
+    plan_log.load()
+
+    assert not plan_log.enabled
+    assert not plan_log.is_new(QUERY)
@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+
+from result_formatter import ResultFormatter
+
+# (columns, rows) pairs, each rendered by the formatter and by pandas as ask_database used to
+RESULTS = {
+    "ints": (["year", "orders"], [(2022, 18300), (2023, -5), (2024, 9_007_199_254_740_993)]),
+    "floats": (["region", "revenue"], [("EUROPE", 1234.5), ("ASIA", 0.1 + 0.2), ("AFRICA", 2.0)]),
+    "large floats": (["total"], [(123456789.123,), (1.5,), (98765432.0,)]),
+    "small floats": (["share"], [(0.0000001234,), (0.5,)]),
+    "float precision": (["value"], [(1 / 3,), (2 / 3,), (123.4567891234567,), (-0.0,)]),
+    "float json rounding": (["value"], [(0.12345678905,), (9.99999999999,), (1e16,), (1e-16,), (-2.5e-7,)]),
+    "ints and floats": (["mixed_number"], [(1,), (2.5,), (3,)]),
+    "nulls": (["region", "revenue", "orders"], [("EUROPE", None, 1), (None, 3.5, 2), ("ASIA", 1.25, 3)]),
+    "null ints": (["orders"], [(1,), (None,), (3,)]),
+    "all null": (["missing"], [(None,), (None,)]),
+    "unicode": (["name"], [("Café crème",), ("東京",), ("emoji 🏔",), ("ñ/á\\b",)]),
+    "escapes": (["text"], [('quote " and / slash',), ("tab\there",), ("line\nbreak",), ("\x01 control",)]),
+    "wide": (
+        ["product_type", "a_much_longer_column_name", "n"],
+        [("Ski Jackets and Insulated Outerwear " * 3, 1.0, 1), ("Tents", 123456.789, 22)],
+    ),
+    "short header": (["x"], [("a long text value",), ("b",)]),
+    "mixed text and numbers": (["value"], [("EUROPE",), (1,), (2.5,)]),
+    "blobs": (["data"], [(b"\x00\x01",), (b"abc",)]),
+    "int64 overflow": (["big"], [(2**63,), (1,)]),
+}
+
+
+def format_with_pandas(columns: list[str], rows: list[tuple]) -> tuple[str, str]:
+    data = pd.DataFrame(rows, columns=columns)
+    return data.to_string(index=False), data.to_json(index=False, orient="split")
+
+
+@pytest.mark.parametrize("columns, rows", RESULTS.values(), ids=RESULTS.keys())
+def test_matches_pandas(columns: list[str], rows: list[tuple]) -> None:
+    formatter = ResultFormatter(columns)
+    assert formatter.add_rows(rows)
+
+    display_format, json_format = formatter.format()
+    expected_display, expected_json = format_with_pandas(columns, rows)
+    assert display_format == expected_display
+    assert json_format == expected_json
+
+
+def test_rows_added_in_batches_match_pandas() -> None:
+    columns, rows = RESULTS["nulls"]
+    formatter = ResultFormatter(columns)
+    for row in rows:
+        formatter.add_rows([row])
+
+    assert formatter.format() == format_with_pandas(columns, rows)
+
+
+def test_truncated_rows_dropped() -> None:
+    columns, rows = RESULTS["ints"]
+    formatter = ResultFormatter(columns, max_rows=2)
+
+    assert not formatter.add_rows(rows)
+    assert formatter.truncated
+    assert formatter.format() == format_with_pandas(columns, rows[:2])
@@ -0,0 +1,113 @@
+import shutil
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+import pytest
+
+from rollup_store import ROLLUP_DIMENSIONS, ROLLUP_SCHEMA, RollupStore, source_version
+from tests.conftest import run_query
+
+REWRITTEN_QUERIES = [
+    "SELECT SUM(revenue), COUNT(*) FROM sales_data",
+    "SELECT region, SUM(revenue) AS revenue FROM sales_data GROUP BY region",
+    'select Region, sum("revenue") from SALES_DATA group by region;',
+    "SELECT year, month, SUM(number_of_orders) FROM sales_data WHERE region = 'EUROPE' GROUP BY year, month",
+    "SELECT main_category, AVG(revenue) FROM sales_data WHERE year IN (2022, 2023) GROUP BY 1 ORDER BY 2 DESC",
+    "SELECT month_date, COUNT(*) FROM sales_data GROUP BY month_date ORDER BY month_date LIMIT 5",
+    "SELECT region, MAX(shipping_cost), MIN(discount) FROM sales_data GROUP BY region",
+    "SELECT region, COUNT(DISTINCT product_type) FROM sales_data GROUP BY region HAVING SUM(revenue) > 1000",
+    "SELECT DISTINCT main_category FROM sales_data ORDER BY main_category",
+    "SELECT region, ROUND(SUM(revenue) / 1000, 1) AS thousands FROM sales_data GROUP BY region",
+]
+
+NOT_REWRITTEN_QUERIES = [
+    # No aggregation: every row of the table is a row of the result
+    "SELECT region, revenue FROM sales_data LIMIT 3",
+    # Float sums depend on the order they are added in
+    "SELECT SUM(shipping_cost) FROM sales_data",
+    "SELECT region, AVG(discount) FROM sales_data GROUP BY region",
+    # Filters on a measure need the individual rows
+    "SELECT region, SUM(revenue) FROM sales_data WHERE revenue > 100 GROUP BY region",
+    "SELECT COUNT(*) FROM sales_data AS s JOIN sales_data AS t ON s.id = t.id",
+    "SELECT COUNT(*) FROM (SELECT region FROM sales_data)",
+]
+
+# Aggregates other than the ones the rewriter knows, and columns that aren't grouped by
+UNKNOWN_AGGREGATE_QUERIES = [
+    "SELECT region, group_concat(product_type) FROM sales_data GROUP BY region",
+    "SELECT region, json_group_array(year) FROM sales_data GROUP BY region",
+    "SELECT region, group_concat(product_type), SUM(revenue) FROM sales_data GROUP BY region",
+    "SELECT region, product_type FROM sales_data GROUP BY region",
+]
+
+
+@pytest.fixture(scope="module")
+def rollups(sales_db: Path) -> RollupStore:
+    rollups = RollupStore()
+    rollups.load(str(sales_db))
+    assert rollups.enabled
+    return rollups
+
+
+@pytest.fixture
+def conn(sales_db: Path, rollups: RollupStore) -> sqlite3.Connection:
+    conn = sqlite3.connect(f"{sales_db.resolve().as_uri()}?mode=ro", uri=True)
+    conn.execute(f"ATTACH DATABASE ? AS {ROLLUP_SCHEMA};", (rollups.uri,))
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("query", REWRITTEN_QUERIES)
+def test_rewritten_query_gives_same_result(rollups: RollupStore, conn: sqlite3.Connection, query: str) -> None:
+    rewritten = rollups.rewrite(query)
+    assert rewritten is not None
+    assert f"{ROLLUP_SCHEMA}." in rewritten
+
+    expected_columns, expected_rows = run_query(conn, query)
+    columns, rows = run_query(conn, rewritten)
+    assert columns == expected_columns
+    # Rows that tie on the ORDER BY may come back in another order
+    assert sorted(rows) == sorted(expected_rows)
+
+
+@pytest.mark.parametrize("query", NOT_REWRITTEN_QUERIES)
+def test_query_not_rewritten(rollups: RollupStore, query: str) -> None:
+    assert rollups.rewrite(query) is None
+
+
+def test_smallest_rollup_chosen(rollups: RollupStore) -> None:
+    rewritten = rollups.rewrite("SELECT year, COUNT(*) FROM sales_data GROUP BY year")
+    assert f"{ROLLUP_SCHEMA}.rollup_year " in rewritten
+
+
+def test_grain_not_built_answered_from_finest_rollup(rollups: RollupStore) -> None:
+    rewritten = rollups.rewrite("SELECT product_type, year, COUNT(*) FROM sales_data GROUP BY product_type, year")
+    assert f"{ROLLUP_SCHEMA}.rollup_{'_'.join(ROLLUP_DIMENSIONS)} " in rewritten
+
+
+def test_rollups_rebuilt_after_the_database_changes(sales_db: Path, tmp_path: Path) -> None:
+    db_path = tmp_path / sales_db.name
+    shutil.copy(sales_db, db_path)
+    query = "SELECT region, SUM(number_of_orders) FROM sales_data GROUP BY region"
+    rollups = RollupStore()
+    rollups.load(str(db_path))
+    version = source_version(str(db_path))
+
+    # Same size, so only the modification time and the change counter show the write
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.execute("UPDATE sales_data SET number_of_orders = number_of_orders + 1 WHERE id = 1;")
+        conn.commit()
+    assert source_version(str(db_path)) != version
+
+    rollups.load(str(db_path))
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.execute(f"ATTACH DATABASE ? AS {ROLLUP_SCHEMA};", (rollups.uri,))
+        assert run_query(conn, rollups.rewrite(query)) == run_query(conn, query)
+
+
+@pytest.mark.parametrize("query", UNKNOWN_AGGREGATE_QUERIES)
+def test_unknown_aggregate_gives_same_result(rollups: RollupStore, conn: sqlite3.Connection, query: str) -> None:
+    executed = rollups.rewrite(query) or query
+
+    assert run_query(conn, executed) == run_query(conn, query)
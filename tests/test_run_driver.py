@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import pytest
+from openai.types.beta.threads.required_action_function_tool_call import Function, RequiredActionFunctionToolCall
+
+import run_driver
+from run_driver import RunDriver
+from sales_data import QueryResults
+
+
+def tool_call(call_id: str, name: str, arguments: str = '{"query": "SELECT 1"}') -> RequiredActionFunctionToolCall:
+    return RequiredActionFunctionToolCall(
+        id=call_id, type="function", function=Function(name=name, arguments=arguments)
+    )
+
+
+def driver_for(function_map: dict) -> RunDriver:
+    return RunDriver(None, function_map, "Test Assistant")
+
+
+async def answer(arguments: dict) -> QueryResults:
+    return QueryResults(display_format=arguments["query"], json_format=json.dumps(arguments))
+
+
+async def test_tool_calls_run_concurrently_within_the_limit(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(run_driver, "TOOL_CALL_CONCURRENCY", 2)
+    running = 0
+    most_running = 0
+
+    async def query(arguments: dict) -> QueryResults:
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+        return await answer(arguments)
+
+    calls = [tool_call(f"call-{index}", "query", json.dumps({"query": f"SELECT {index}"})) for index in range(5)]
+    results = await driver_for({"query": query}).run_tool_calls(calls)
+
+    assert most_running == 2
+    assert [result.display_format for result in results] == [f"SELECT {index}" for index in range(5)]
+
+
+async def test_slow_tool_call_times_out_alone(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(run_driver, "TOOL_CALL_TIMEOUT_SECONDS", 0.05)
+
+    async def slow(arguments: dict) -> QueryResults:
+        await asyncio.sleep(10)
+        return await answer(arguments)
+
+    results = await driver_for({"slow": slow, "query": answer}).run_tool_calls(
+        [tool_call("call-1", "slow"), tool_call("call-2", "query")]
+    )
+
+    assert json.loads(results[0].json_format) == {"error": "slow did not finish within 0.05 seconds."}
+    assert json.loads(results[1].json_format) == {"query": "SELECT 1"}
+
+
+async def test_failing_tool_call_isolated() -> None:
+    async def failing(arguments: dict) -> QueryResults:
+        raise ValueError("database is locked")
+
+    results = await driver_for({"failing": failing, "query": answer}).run_tool_calls(
+        [tool_call("call-1", "failing"), tool_call("call-2", "query")]
+    )
+
+    assert json.loads(results[0].json_format) == {"error": "failing failed with error: database is locked"}
+    assert json.loads(results[1].json_format) == {"query": "SELECT 1"}
+
+
+async def test_unknown_function_and_invalid_arguments_reported() -> None:
+    results = await driver_for({"query": answer}).run_tool_calls(
+        [tool_call("call-1", "missing"), tool_call("call-2", "query", "{not json")]
+    )
+
+    assert json.loads(results[0].json_format) == {"error": "Unknown function: missing"}
+    assert json.loads(results[1].json_format)["error"].startswith("Invalid query arguments:")
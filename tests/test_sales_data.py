@@ -0,0 +1,123 @@
+import json
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from sales_data import SalesData
+from tests.conftest import run_query
+
+
+@pytest.fixture
+async def sales_data(sales_db: Path) -> SalesData:
+    sales_data = SalesData(pool_size=2, max_rows=5, max_json_bytes=4096, max_vm_steps=1_000_000)
+    await sales_data.switch_snapshot(str(sales_db))
+    yield sales_data
+    await sales_data.close()
+
+
+async def test_results_match_the_database(sales_data: SalesData, sales_conn: sqlite3.Connection) -> None:
+    query = "SELECT region, COUNT(*) AS orders FROM sales_data GROUP BY region ORDER BY region LIMIT 3"
+    results = await sales_data.ask_database(query)
+
+    columns, rows = run_query(sales_conn, query)
+    assert json.loads(results.json_format) == {"columns": columns, "data": list(map(list, rows))}
+    assert results.row_count == 3
+    assert not results.truncated
+
+
+async def test_truncated_results_stay_valid_json(sales_data: SalesData) -> None:
+    results = await sales_data.ask_database("SELECT id, region FROM sales_data ORDER BY id")
+
+    assert results.truncated
+    assert results.row_count == 5
+    parsed = json.loads(results.json_format)
+    assert parsed["truncated"] is True
+    assert len(parsed["data"]) == 5
+    assert "Results truncated to the first 5 rows" in parsed["message"]
+    assert parsed["message"] in results.display_format
+
+
+async def test_byte_budget_truncates(sales_db: Path) -> None:
+    sales_data = SalesData(pool_size=1, max_rows=1000, max_json_bytes=512)
+    await sales_data.switch_snapshot(str(sales_db))
+    try:
+        results = await sales_data.ask_database("SELECT product_type, month_date FROM sales_data")
+    finally:
+        await sales_data.close()
+
+    assert results.truncated
+    assert 0 < results.row_count < 1000
+    assert json.loads(results.json_format)["truncated"] is True
+
+
+async def test_empty_result(sales_data: SalesData) -> None:
+    results = await sales_data.ask_database("SELECT region FROM sales_data WHERE region = 'ATLANTIS'")
+
+    assert results.row_count == 0
+    assert results.display_format == "The query returned no results. Try a different query."
+
+
+async def test_invalid_query_reports_error(sales_data: SalesData) -> None:
+    query = "SELECT revenu FROM sales_data"
+    results = await sales_data.ask_database(query)
+
+    assert json.loads(results.json_format) == {"error": "no such column: revenu", "query": query}
+    assert results.display_format.startswith("Query failed with error:")
+
+
+async def test_runaway_query_stopped(sales_data: SalesData) -> None:
+    query = "SELECT COUNT(*) FROM sales_data AS a, sales_data AS b"
+    results = await sales_data.ask_database(query)
+
+    assert results.display_format.startswith("Query stopped:")
+    assert json.loads(results.json_format)["query"] == query
+
+
+async def test_repeated_query_answered_from_cache(sales_data: SalesData) -> None:
+    first = await sales_data.ask_database("SELECT year, SUM(revenue) FROM sales_data GROUP BY year")
+    second = await sales_data.ask_database("select year, SUM(revenue) from sales_data group by year;")
+
+    assert second == first
+    assert sales_data.query_cache.stats.hits == 1
+
+
+async def test_group_by_huge_number_answered_by_sqlite(sales_data: SalesData, sales_conn: sqlite3.Connection) -> None:
+    query = "SELECT COUNT(*) AS orders FROM sales_data GROUP BY 1e400"
+    results = await sales_data.ask_database(query)
+
+    columns, rows = run_query(sales_conn, query)
+    assert json.loads(results.json_format) == {"columns": columns, "data": list(map(list, rows))}
+
+
+async def test_rewriter_error_falls_back_to_the_table(
+    sales_data: SalesData, sales_conn: sqlite3.Connection, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def fail(query: str) -> str:
+        raise ValueError(query)
+
+    monkeypatch.setattr(sales_data.snapshot.rollups, "rewrite", fail)
+    monkeypatch.setattr(sales_data.snapshot.columnar, "execute", lambda query: None)
+    query = "SELECT year, SUM(number_of_orders) FROM sales_data GROUP BY year"
+    results = await sales_data.ask_database(query)
+
+    columns, rows = run_query(sales_conn, query)
+    assert json.loads(results.json_format) == {"columns": columns, "data": list(map(list, rows))}
+
+
+class FailingColumnarStore:
+    enabled = True
+
+    def execute(self: "FailingColumnarStore", query: str) -> None:
+        raise IndexError(query)
+
+
+async def test_columnar_error_falls_back_to_sqlite(
+    sales_data: SalesData, sales_conn: sqlite3.Connection, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(sales_data.snapshot, "columnar", FailingColumnarStore())
+    query = "SELECT year, COUNT(*) FROM sales_data GROUP BY year"
+    results = await sales_data.ask_database(query)
+
+    columns, rows = run_query(sales_conn, query)
+    assert json.loads(results.json_format) == {"columns": columns, "data": list(map(list, rows))}
@@ -0,0 +1,57 @@
+import asyncio
+import json
+import shutil
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+import pytest
+
+import sales_data as sales_data_module
+from sales_data import SalesData
+
+COUNT_QUERY = "SELECT COUNT(*) AS orders FROM sales_data"
+
+
+async def count_orders(sales_data: SalesData) -> int:
+    results = await sales_data.ask_database(COUNT_QUERY)
+    return json.loads(results.json_format)["data"][0][0]
+
+
+async def test_switch_drains_queries_on_the_previous_snapshot(
+    sales_db: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(sales_data_module, "SNAPSHOT_DRAIN_SECONDS", 5)
+    first, second = tmp_path / "v1.db", tmp_path / "v2.db"
+    shutil.copy(sales_db, first)
+    shutil.copy(sales_db, second)
+    with closing(sqlite3.connect(second)) as conn:
+        conn.execute("DELETE FROM sales_data WHERE year = 2024;")
+        conn.commit()
+
+    sales_data = SalesData(pool_size=1)
+    await sales_data.switch_snapshot(str(first))
+    try:
+        first_orders = await count_orders(sales_data)
+        previous = sales_data.snapshot
+
+        # A query still running on the first snapshot holds it and its only connection
+        with previous.use():
+            async with previous.pool.acquire() as conn:
+                switching = asyncio.create_task(sales_data.switch_snapshot(str(second)))
+                while sales_data.snapshot is previous:
+                    await asyncio.sleep(0.01)
+
+                # New queries go to the second snapshot, and the cached result of the first is dropped
+                assert await count_orders(sales_data) < first_orders
+                async with conn.execute(COUNT_QUERY) as cursor:
+                    assert (await cursor.fetchone())[0] == first_orders
+                await asyncio.sleep(0.05)
+                assert not switching.done()
+                assert previous.pool is not None
+
+        await asyncio.wait_for(switching, 5)
+        assert previous.pool is None
+        assert sales_data.snapshot_switches == 2
+    finally:
+        await sales_data.close()
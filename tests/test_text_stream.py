@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from text_stream import TEXT_STREAM_MAX_HELD_CHARS, TextStream
+
+
+class RecordingMessage:
+    """Stands in for a Chainlit message, recording the tokens streamed to it."""
+
+    def __init__(self: "RecordingMessage") -> None:
+        self.tokens: list[str] = []
+
+    async def stream_token(self: "RecordingMessage", token: str) -> None:
+        self.tokens.append(token)
+
+    @property
+    def content(self: "RecordingMessage") -> str:
+        return "".join(self.tokens)
+
+
+async def stream(deltas: list[str], citations_index: int = 1) -> tuple[RecordingMessage, TextStream]:
+    message = RecordingMessage()
+    text_stream = TextStream(message, citations_index, flush_ms=60_000, flush_chars=1)
+    for delta in deltas:
+        await text_stream.add(delta)
+    await text_stream.close()
+    return message, text_stream
+
+
+@pytest.mark.parametrize(
+    "deltas",
+    [
+        ["See [the report](https://example.com/report.pdf) for details."],
+        ["See [the ", "report](https", "://example.com/report.pdf", ") for details."],
+        ["See [the report] ", "(", " https://example.com/report.pdf ", ")", " for details."],
+        list("See [the report](https://example.com/report.pdf) for details."),
+    ],
+)
+async def test_links_rewritten_across_deltas(deltas: list[str]) -> None:
+    message, _ = await stream(deltas)
+
+    assert message.content == "See the report for details."
+    assert not any("[" in token or "](" in token for token in message.tokens)
+
+
+async def test_link_pattern_does_not_span_lines() -> None:
+    message, _ = await stream(["A [note]\n", "(not a link) and [a link]\t(x)"])
+
+    assert message.content == "A [note]\n(not a link) and a link"
+
+
+async def test_citations_numbered_across_deltas() -> None:
+    message, text_stream = await stream(["Revenue grew【4:0†sou", "rce】 and fell【4:1", "†notes】."], 3)
+
+    assert message.content == "Revenue grew[3] and fell[4]."
+    assert text_stream.citations_index == 5
+
+
+async def test_incomplete_link_sent_as_is_on_close() -> None:
+    message, _ = await stream(["Open [bracket and (more"])
+
+    assert message.content == "Open [bracket and (more"
+
+
+async def test_unclosed_bracket_not_held_back_forever() -> None:
+    message = RecordingMessage()
+    text_stream = TextStream(message, flush_ms=60_000, flush_chars=1)
+
+    await text_stream.add("[" + "x" * TEXT_STREAM_MAX_HELD_CHARS)
+    await text_stream.add("y")
+    assert message.content.startswith("[x")
+    await text_stream.close()
+
+
+async def test_flushed_when_outgoing_text_reaches_size() -> None:
+    message = RecordingMessage()
+    text_stream = TextStream(message, flush_ms=60_000, flush_chars=10)
+
+    await text_stream.add("12345")
+    assert message.tokens == []
+    await text_stream.add("678901")
+    assert message.tokens == ["12345678901"]
+    await text_stream.close()
+
+
+async def test_flushed_after_interval() -> None:
+    message = RecordingMessage()
+    text_stream = TextStream(message, flush_ms=20, flush_chars=1000)
+
+    await text_stream.add("Hello")
+    await text_stream.add(", world")
+    assert message.tokens == []
+    await asyncio.sleep(0.1)
+    assert message.tokens == ["Hello, world"]
+
+    await text_stream.add("!")
+    await text_stream.close()
+    assert message.tokens == ["Hello, world", "!"]